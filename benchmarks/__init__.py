@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of django-loupe, run from the root of the repository with
+``python -m benchmarks.<name>``. ``benchmarks.suite`` measures tiling,
+thumbnails and the transfer pipeline and ``benchmarks.compare`` compares
+its results between commits.
+"""
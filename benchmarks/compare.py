@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compare two results files of ``benchmarks.suite`` and report the cases that
+got slower, used more memory or wrote more bytes.
+
+    python -m benchmarks.compare before.json after.json --threshold 10
+
+Exits with status 1 when any measurement regressed by more than the
+threshold, in percent.
+"""
+import json
+import sys
+from optparse import OptionParser
+
+from .suite import get_case_key
+
+# Measurements where larger is worse
+METRICS = ('seconds', 'cpu_seconds', 'peak_rss_mb', 'bytes')
+
+
+def load_results(path):
+    results_file = open(path)
+    try:
+        data = json.load(results_file)
+    finally:
+        results_file.close()
+    return data, dict((get_case_key(result), result) for result in data['results']
+                      if result.get('success') and 'seconds' in result)
+
+
+def get_change(before, after):
+    """
+    Return the change from ``before`` to ``after`` in percent
+    """
+    if not before:
+        return 0.0
+    return (after - before) * 100.0 / before
+
+
+def compare(before, after, threshold):
+    """
+    Return a row for each measurement of the cases in both results, and
+    whether any of them regressed
+    """
+    rows = []
+    regressed = False
+    for key in sorted(set(before) & set(after)):
+        for metric in METRICS:
+            change = get_change(before[key][metric], after[key][metric])
+            worse = change > threshold
+            regressed = regressed or worse
+            rows.append((key, metric, before[key][metric], after[key][metric],
+                         change, worse))
+    return rows, regressed
+
+
+def main():
+    parser = OptionParser(usage="python -m benchmarks.compare [options] before.json after.json")
+    parser.add_option('--threshold', type='float', default=10,
+        help='Percent increase that counts as a regression')
+    options, args = parser.parse_args()
+    if len(args) != 2:
+        parser.error("Give the results files to compare")
+    before_data, before = load_results(args[0])
+    after_data, after = load_results(args[1])
+    sys.stdout.write("%s (%s) -> %s (%s)\n" % (
+        args[0], before_data.get('commit') or '?',
+        args[1], after_data.get('commit') or '?'))
+    rows, regressed = compare(before, after, options.threshold)
+    for key, metric, old, new, change, worse in rows:
+        sys.stdout.write("%-36s %-12s %14.2f %14.2f %+8.1f%%%s\n" % (
+            key, metric, old, new, change, worse and '  REGRESSION' or ''))
+    for key in sorted(set(before) ^ set(after)):
+        sys.stdout.write("%-36s only in %s\n" % (
+            key, key in before and args[0] or args[1]))
+    return regressed and 1 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Runs each measurement in a fresh process, so its CPU time and peak memory
+are its own, and collects the results
+"""
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def configure_django(**loupe_settings):
+    sys.path.insert(0, ROOT)
+    from django.conf import settings
+    if not settings.configured:
+        settings.configure(INSTALLED_APPS=('loupe', ),
+                           LOUPE_SETTINGS=loupe_settings)
+
+
+def get_cpu_seconds():
+    """
+    Return the CPU time of this process and of the commands it ran
+    """
+    total = 0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def get_peak_rss_mb():
+    """
+    Return the peak resident memory of this process, or of the largest
+    command it ran
+    """
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024.0
+
+
+def count_files(path):
+    """
+    Return the number and total bytes of the files under ``path``
+    """
+    files = size = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            files += 1
+            size += os.path.getsize(os.path.join(dirpath, filename))
+    return files, size
+
+
+class Timer(object):
+    """
+    Measures the wall and CPU time of a ``with`` block
+    """
+    def __enter__(self):
+        self.start = time.time()
+        self.cpu_start = get_cpu_seconds()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.time() - self.start
+        self.cpu_seconds = get_cpu_seconds() - self.cpu_start
+
+    def as_dict(self):
+        return {
+            'seconds': self.seconds,
+            'cpu_seconds': self.cpu_seconds,
+            'peak_rss_mb': get_peak_rss_mb(),
+        }
+
+
+def run_child(module, case):
+    """
+    Run ``python -m <module> --child <case>`` and return the measurements it
+    prints as JSON
+    """
+    output = subprocess.check_output(
+        [sys.executable, '-m', module, '--child', json.dumps(case)], cwd=ROOT)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def print_child_result(result):
+    sys.stdout.write("\n%s\n" % json.dumps(result))
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=ROOT, stderr=subprocess.STDOUT).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def get_environment():
+    return {
+        'commit': get_commit(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.sysconf('SC_NPROCESSORS_ONLN'),
+    }
+
+
+def save_results(path, results):
+    """
+    Write the results and the environment they were measured in as JSON
+    """
+    data = get_environment()
+    data['results'] = results
+    output = open(path, 'w')
+    try:
+        json.dump(data, output, indent=2, sort_keys=True)
+    finally:
+        output.close()
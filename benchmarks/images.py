@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic test images of any size, written without holding them in memory
+"""
+import struct
+
+
+def write_strip_tiff(path, width, height, bands=3, rows_per_strip=64):
+    """
+    Write an uncompressed strip TIFF of a gradient, a strip at a time, so
+    images larger than memory can be generated
+    """
+    row_bytes = width * bands
+    num_strips = -(-height // rows_per_strip)
+    data_size = row_bytes * height
+    if data_size + 1024 + num_strips * 8 > 2 ** 32:
+        raise ValueError("%sx%s is too large for a classic TIFF" % (width, height))
+    ifd_offset = 8 + data_size
+    entries = 10
+    extra = ifd_offset + 2 + entries * 12 + 4
+    bits_offset = extra
+    offsets_offset = bits_offset + 6
+    counts_offset = offsets_offset + num_strips * 4
+
+    out = open(path, 'wb')
+    out.write(struct.pack('<2sHI', b'II', 42, ifd_offset))
+    column = bytearray(range(256)) * (width // 256 + 2)
+    strip_offsets, strip_counts = [], []
+    for strip in range(num_strips):
+        strip_offsets.append(out.tell())
+        top = strip * rows_per_strip
+        rows = min(rows_per_strip, height - top)
+        chunk = bytearray()
+        for y in range(top, top + rows):
+            shade = y * 255 // max(height - 1, 1)
+            if bands == 1:
+                chunk.extend(column[:width])
+            else:
+                pixels = bytearray(row_bytes)
+                pixels[0::3] = column[:width]
+                pixels[1::3] = bytearray([shade]) * width
+                pixels[2::3] = column[(y % 256):(y % 256) + width]
+                chunk.extend(pixels)
+        out.write(bytes(chunk))
+        strip_counts.append(rows * row_bytes)
+
+    def entry(tag, kind, count, value):
+        if kind == 3 and count == 1:
+            return struct.pack('<HHIHH', tag, kind, count, value, 0)
+        return struct.pack('<HHII', tag, kind, count, value)
+
+    out.write(struct.pack('<H', entries))
+    out.write(entry(256, 4, 1, width))
+    out.write(entry(257, 4, 1, height))
+    if bands == 1:
+        out.write(entry(258, 3, 1, 8))
+    else:
+        out.write(entry(258, 3, 3, bits_offset))
+    out.write(entry(259, 3, 1, 1))
+    out.write(entry(262, 3, 1, bands == 1 and 1 or 2))
+    out.write(entry(273, 4, num_strips, offsets_offset))
+    out.write(entry(277, 3, 1, bands))
+    out.write(entry(278, 4, 1, rows_per_strip))
+    out.write(entry(279, 4, num_strips, counts_offset))
+    out.write(entry(284, 3, 1, 1))
+    out.write(struct.pack('<I', 0))
+    out.write(struct.pack('<3H', 8, 8, 8))
+    out.write(struct.pack('<%sI' % num_strips, *strip_offsets))
+    out.write(struct.pack('<%sI' % num_strips, *strip_counts))
+    out.close()
+
+
+def write_sample(path, size):
+    """
+    Write a gradient with noise, which compresses more like a photograph
+    than a plain gradient
+    """
+    import numpy
+    from PIL import Image
+    state = numpy.random.RandomState(0)
+    gradient = numpy.linspace(0, 180, size)
+    pixels = state.randint(0, 60, (size, size, 3)) + gradient[None, :, None]
+    Image.fromarray(pixels.astype(numpy.uint8)).save(path)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compare rendering a page of viewers one image at a time without caching,
+with ``image.render()`` and with ``render_many``.
+
+    python -m benchmarks.rendering --viewers 50,100,200 --repeat 20
+"""
+import sys
+import time
+from optparse import OptionParser
+
+from .harness import ROOT
+
+
+def configure_django():
+    sys.path.insert(0, ROOT)
+    from django.conf import settings
+    if not settings.configured:
+        settings.configure(
+            DATABASES={'default': {
+                'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}},
+            INSTALLED_APPS=('django.contrib.staticfiles', 'loupe'),
+            STATIC_URL='/static/')
+    from django.core.management import call_command
+    call_command('syncdb', interactive=False, verbosity=0)
+
+
+def create_images(count):
+    from loupe.models import LoupeImage
+    LoupeImage.objects.all().delete()
+    LoupeImage.objects.bulk_create([
+        LoupeImage(name='Image %s' % i, slug='image-%s' % i,
+            external_tileset_url='http://example.com/image-%s.dzi' % i,
+            external_tileset_type='dzi', image_width=20000,
+            image_height=15000, tile_size=254, tile_overlap=1,
+            tile_format='jpg', level_count=16,
+            base_tile_url='http://example.com/image-%s_files/' % i)
+        for i in range(count)])
+    return LoupeImage.objects.order_by('pk')
+
+
+def render_uncached(images):
+    from django.template.loader import render_to_string
+    return [render_to_string(image.get_template_names(), {'object': image})
+            for image in images]
+
+
+def render_each(images):
+    return [image.render() for image in images]
+
+
+def time_page(render, queryset, repeat):
+    """
+    Return the mean seconds to query the images and render them
+    """
+    start = time.time()
+    for i in range(repeat):
+        render(list(queryset))
+    return (time.time() - start) / repeat
+
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('--viewers', default='50,100,200',
+        help='Comma separated numbers of viewers on a page')
+    parser.add_option('--repeat', type='int', default=20,
+        help='Times each page is rendered')
+    options, args = parser.parse_args()
+    configure_django()
+    from loupe.rendering import get_render_cache, render_many
+
+    sys.stdout.write("%8s %12s %12s %12s\n" % (
+        'viewers', 'uncached ms', 'render ms', 'many ms'))
+    for count in [int(c) for c in options.viewers.split(',')]:
+        queryset = create_images(count)
+        get_render_cache().lru.clear()
+        uncached = time_page(render_uncached, queryset, options.repeat)
+        each = time_page(render_each, queryset, options.repeat)
+        get_render_cache().lru.clear()
+        many = time_page(render_many, queryset, options.repeat)
+        sys.stdout.write("%8s %12.2f %12.2f %12.2f\n" % (
+            count, uncached * 1000, each * 1000, many * 1000))
+
+
+if __name__ == '__main__':
+    main()
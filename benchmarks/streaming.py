@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compare the peak memory and speed of the Pillow tiler with and without
+streaming, against the size of the image.
+
+    python -m benchmarks.streaming --sizes 2000,4000,8000,16000
+
+Each run happens in a fresh process so its peak RSS is its own.
+"""
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser, SUPPRESS_HELP
+
+from .harness import ROOT, configure_django
+from .images import write_strip_tiff
+
+
+def run_child(image_path, streaming):
+    """
+    Tile the image in this process and print the measurements as JSON
+    """
+    configure_django()
+    from loupe.tilers.pillow import PillowTiler
+
+    dest_path = os.path.splitext(image_path)[0]
+    start = time.time()
+    result = PillowTiler(streaming=streaming).create_tileset(image_path, dest_path)
+    elapsed = time.time() - start
+    tiles = 0
+    for dirpath, dirnames, filenames in os.walk("%s_files" % dest_path):
+        tiles += len(filenames)
+    shutil.rmtree("%s_files" % dest_path)
+    sys.stdout.write(json.dumps({
+        'success': result,
+        'seconds': elapsed,
+        'tiles': tiles,
+        'tiles_per_second': tiles / elapsed,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    }))
+
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('--sizes', default='2000,4000,8000',
+        help='Comma separated widths of the square test images')
+    parser.add_option('--bands', type='int', default=3,
+        help='1 for greyscale or 3 for RGB test images')
+    parser.add_option('--child', nargs=2, help=SUPPRESS_HELP)
+    options, args = parser.parse_args()
+    if options.child:
+        return run_child(options.child[0], options.child[1] == 'streaming')
+
+    tmp_dir = tempfile.mkdtemp()
+    sys.stdout.write("%8s %10s %10s %8s %10s %10s\n" % (
+        'size', 'mode', 'seconds', 'tiles', 'tiles/sec', 'peak MB'))
+    try:
+        for size in [int(s) for s in options.sizes.split(',')]:
+            image_path = os.path.join(tmp_dir, 'bench_%s.tif' % size)
+            write_strip_tiff(image_path, size, size, options.bands)
+            for mode in ('streaming', 'level'):
+                output = subprocess.check_output([
+                    sys.executable, '-m', 'benchmarks.streaming',
+                    '--child', image_path, mode], cwd=ROOT)
+                stats = json.loads(output.decode('utf-8'))
+                sys.stdout.write("%8s %10s %10.2f %8d %10.1f %10.1f\n" % (
+                    size, mode, stats['seconds'], stats['tiles'],
+                    stats['tiles_per_second'], stats['peak_rss_mb']))
+            os.remove(image_path)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
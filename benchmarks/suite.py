@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measure tiling, thumbnails and the save, tile and transfer pipeline for each
+tiler and tile profile, on synthetic images of each size.
+
+    python -m benchmarks.suite --sizes 1000,4000,16000 --tilers pillow,vips \\
+        --profiles jpeg,webp --output results.json
+    python -m benchmarks.compare before.json results.json
+
+Images are uncompressed strip TIFFs. RGB images larger than about 37000
+pixels square don't fit a classic TIFF; use ``--bands 1`` for up to 50000.
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+from optparse import OptionParser, SUPPRESS_HELP
+
+from .harness import (Timer, configure_django, count_files, print_child_result,
+    run_child, save_results)
+from .images import write_strip_tiff
+
+TILERS = {
+    'pillow': 'loupe.tilers.pillow.PillowTiler',
+    'vips': 'loupe.tilers.vips.VipsTiler',
+}
+
+CASES = ('tileset', 'thumbnail', 'pipeline')
+
+
+def get_fake_remote_storage(location, latency=0):
+    """
+    Return a local storage standing in for remote storage, which waits
+    ``latency`` seconds before each save like a request would
+    """
+    import time
+    from django.core.files.storage import FileSystemStorage
+
+    class FakeRemoteStorage(FileSystemStorage):
+        def _save(self, name, content):
+            time.sleep(latency)
+            return super(FakeRemoteStorage, self)._save(name, content)
+
+    return FakeRemoteStorage(location=location)
+
+
+def measure_tileset(case, image_path, dest_path):
+    from loupe.tilers import get_tiler
+    tiler = get_tiler(TILERS[case['tiler']], case['profile'])
+    with Timer() as timer:
+        success = tiler.create_tileset(image_path, dest_path)
+    return success, timer, "%s_files" % dest_path
+
+
+def measure_thumbnail(case, image_path, dest_path):
+    from loupe.tileset import create_thumbnail, create_tileset, get_thumbnail_sizes
+    if create_tileset(image_path, case['profile']) != 0:
+        return False, None, None
+    with Timer() as timer:
+        success = create_thumbnail(image_path) == 0
+    return success, timer, [path for path, size in get_thumbnail_sizes(image_path)]
+
+
+def measure_pipeline(case, image_path, dest_path):
+    """
+    Save the image to local storage, tile it and transfer everything to the
+    fake remote storage
+    """
+    from django.core.files import File
+    from django.core.files.storage import FileSystemStorage
+    from loupe.tileset import create_thumbnail, create_tileset
+    from loupe.transfer import TilesetTransfer
+    work_dir = os.path.dirname(image_path)
+    local = FileSystemStorage(location=os.path.join(work_dir, 'local'))
+    remote = get_fake_remote_storage(os.path.join(work_dir, 'remote'),
+                                     case.get('latency', 0))
+    source = open(image_path, 'rb')
+    with Timer() as timer:
+        try:
+            name = local.save('loupe/bench/%s' % os.path.basename(image_path),
+                              File(source))
+        finally:
+            source.close()
+        success = (create_tileset(local.path(name), case['profile']) == 0 and
+                   create_thumbnail(local.path(name)) == 0 and
+                   TilesetTransfer(local, remote, token='bench').run(name))
+    return success, timer, os.path.join(work_dir, 'remote')
+
+
+def run_case(case):
+    """
+    Make the case's image, measure it and return the results
+    """
+    configure_django(TILER=TILERS[case['tiler']], LAZY_LEVELS=0)
+    work_dir = tempfile.mkdtemp()
+    try:
+        image_path = os.path.join(work_dir, 'bench.tif')
+        write_strip_tiff(image_path, case['size'], case['size'], case['bands'])
+        measure = globals()['measure_%s' % case['case']]
+        success, timer, output = measure(case, image_path,
+                                         os.path.splitext(image_path)[0])
+        result = dict(case, success=bool(success))
+        if timer is None:
+            return result
+        result.update(timer.as_dict())
+        if isinstance(output, list):
+            files = len(output)
+            written = sum([os.path.getsize(path) for path in output
+                           if os.path.exists(path)])
+        else:
+            files, written = count_files(output)
+        result.update({
+            'files': files,
+            'bytes': written,
+            'files_per_second': files / max(timer.seconds, 1e-6),
+        })
+        return result
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def get_cases(options):
+    """
+    Return every combination of the chosen cases, tilers, profiles and sizes
+    """
+    cases = []
+    for name in options.cases.split(','):
+        for tiler in options.tilers.split(','):
+            for profile in options.profiles.split(','):
+                for size in [int(s) for s in options.sizes.split(',')]:
+                    cases.append({
+                        'case': name,
+                        'tiler': tiler,
+                        'profile': profile,
+                        'size': size,
+                        'bands': options.bands,
+                        'latency': options.latency / 1000.0,
+                    })
+    return cases
+
+
+def get_case_key(case):
+    return "%(case)s %(tiler)s %(profile)s %(size)s" % case
+
+
+def main():
+    parser = OptionParser(usage="python -m benchmarks.suite [options]")
+    parser.add_option('--cases', default=','.join(CASES),
+        help='Comma separated cases to run: %s' % ', '.join(CASES))
+    parser.add_option('--sizes', default='1000,4000',
+        help='Comma separated widths of the square test images')
+    parser.add_option('--bands', type='int', default=3,
+        help='1 for greyscale or 3 for RGB test images')
+    parser.add_option('--tilers', default='pillow',
+        help='Comma separated tilers: %s' % ', '.join(sorted(TILERS)))
+    parser.add_option('--profiles', default='jpeg',
+        help='Comma separated tile profiles from TILE_PROFILES')
+    parser.add_option('--latency', type='float', default=0,
+        help='Milliseconds the fake remote storage waits for each file')
+    parser.add_option('--output', default='',
+        help='Write the results to this JSON file')
+    parser.add_option('--child', help=SUPPRESS_HELP)
+    options, args = parser.parse_args()
+    if options.child:
+        return print_child_result(run_case(json.loads(options.child)))
+
+    results = []
+    sys.stdout.write("%-36s %9s %9s %8s %8s %12s %10s\n" % (
+        'case', 'seconds', 'CPU sec', 'peak MB', 'files', 'bytes', 'files/sec'))
+    for case in get_cases(options):
+        try:
+            result = run_child('benchmarks.suite', case)
+        except Exception as e:
+            sys.stdout.write("%-36s failed: %s\n" % (get_case_key(case), e))
+            continue
+        results.append(result)
+        if not result['success'] or 'seconds' not in result:
+            sys.stdout.write("%-36s failed\n" % get_case_key(case))
+            continue
+        sys.stdout.write("%-36s %9.2f %9.2f %8.1f %8d %12d %10.1f\n" % (
+            get_case_key(case), result['seconds'], result['cpu_seconds'],
+            result['peak_rss_mb'], result['files'], result['bytes'],
+            result['files_per_second']))
+    if options.output:
+        save_results(options.output, results)
+
+
+if __name__ == '__main__':
+    main()
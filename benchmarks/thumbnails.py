@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compare making thumbnails from the original image with making them from the
+smallest level of its tileset large enough.
+
+    python -m benchmarks.thumbnails --sizes 2000,4000,8000 --thumb-sizes 200,800
+
+Each run happens in a fresh process so its CPU time and peak RSS are its own.
+"""
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser, SUPPRESS_HELP
+
+from .harness import ROOT, configure_django, get_cpu_seconds
+from .images import write_strip_tiff
+
+
+def run_child(image_path, mode, thumb_sizes):
+    """
+    Make the thumbnails in this process and print the measurements as JSON
+    """
+    configure_django()
+    from loupe.pyramid import create_pyramid_thumbnails
+    from loupe.tilers.pillow import PillowTiler
+
+    dest_path = os.path.splitext(image_path)[0]
+    sizes = [("%s_thumb_%s.jpg" % (dest_path, size), size) for size in thumb_sizes]
+    start, cpu_start = time.time(), get_cpu_seconds()
+    if mode == 'pyramid':
+        result = create_pyramid_thumbnails(dest_path, sizes)
+    else:
+        tiler = PillowTiler()
+        result = all([tiler.create_thumbnail(image_path, path, size)
+                      for path, size in sizes])
+    sys.stdout.write(json.dumps({
+        'success': result,
+        'seconds': time.time() - start,
+        'cpu_seconds': get_cpu_seconds() - cpu_start,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    }))
+
+
+def tile(image_path):
+    configure_django()
+    from loupe.tilers.pillow import PillowTiler
+    PillowTiler().create_tileset(image_path, os.path.splitext(image_path)[0])
+
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('--sizes', default='2000,4000,8000',
+        help='Comma separated widths of the square test images')
+    parser.add_option('--thumb-sizes', default='200',
+        help='Comma separated sizes of the thumbnails to make')
+    parser.add_option('--child', nargs=2, help=SUPPRESS_HELP)
+    options, args = parser.parse_args()
+    thumb_sizes = [int(s) for s in options.thumb_sizes.split(',')]
+    if options.child:
+        return run_child(options.child[0], options.child[1], thumb_sizes)
+
+    tmp_dir = tempfile.mkdtemp()
+    sys.stdout.write("%8s %10s %10s %10s %10s\n" % (
+        'size', 'source', 'seconds', 'CPU sec', 'peak MB'))
+    try:
+        for size in [int(s) for s in options.sizes.split(',')]:
+            image_path = os.path.join(tmp_dir, 'bench_%s.tif' % size)
+            write_strip_tiff(image_path, size, size)
+            tile(image_path)
+            for mode in ('original', 'pyramid'):
+                output = subprocess.check_output([
+                    sys.executable, '-m', 'benchmarks.thumbnails',
+                    '--child', image_path, mode,
+                    '--thumb-sizes', options.thumb_sizes], cwd=ROOT)
+                stats = json.loads(output.decode('utf-8'))
+                sys.stdout.write("%8s %10s %10.2f %10.2f %10.1f\n" % (
+                    size, mode, stats['seconds'], stats['cpu_seconds'],
+                    stats['peak_rss_mb']))
+            for name in os.listdir(tmp_dir):
+                path = os.path.join(tmp_dir, name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compare the total size of the tiles and the time to tile an image with each
+tile profile.
+
+    python -m benchmarks.tile_profiles --profiles jpeg,webp,avif photo.jpg scan.tif
+
+Without images, a noisy gradient of each of ``--sizes`` is generated.
+Profiles are named in ``TILE_PROFILES``, and also include ``q100``, the
+JPEG quality 100 tiles that were made before profiles existed.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+from .harness import configure_django
+from .images import write_sample
+
+
+def get_tileset_bytes(dest_path):
+    total = 0
+    for dirpath, dirnames, filenames in os.walk("%s_files" % dest_path):
+        for filename in filenames:
+            total += os.path.getsize(os.path.join(dirpath, filename))
+    return total
+
+
+def main():
+    parser = OptionParser(usage="%prog [options] [image ...]")
+    parser.add_option('--profiles', default='',
+        help='Comma separated tile profiles, all of TILE_PROFILES by default')
+    parser.add_option('--sizes', default='2000,4000',
+        help='Comma separated widths of the generated square images')
+    options, images = parser.parse_args()
+    configure_django()
+    from loupe.settings import TILE_PROFILES
+    from loupe.tilers.pillow import PillowTiler
+
+    profiles = dict(TILE_PROFILES, q100={'quality': 100})
+    names = options.profiles and options.profiles.split(',') or sorted(profiles)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        if not images:
+            for size in [int(s) for s in options.sizes.split(',')]:
+                images.append(os.path.join(tmp_dir, 'sample_%s.png' % size))
+                write_sample(images[-1], size)
+        sys.stdout.write("%-24s %10s %8s %12s %10s\n" % (
+            'image', 'profile', 'format', 'bytes', 'seconds'))
+        for image_path in images:
+            for name in names:
+                dest_path = os.path.join(tmp_dir, "tiles_%s" % name)
+                tiler = PillowTiler(profile=profiles[name], lazy_levels=0)
+                start = time.time()
+                if not tiler.create_tileset(image_path, dest_path):
+                    sys.stdout.write("%-24s %10s failed\n" % (
+                        os.path.basename(image_path)[:24], name))
+                    continue
+                elapsed = time.time() - start
+                sys.stdout.write("%-24s %10s %8s %12s %10.2f\n" % (
+                    os.path.basename(image_path)[:24], name, tiler.format,
+                    get_tileset_bytes(dest_path), elapsed))
+                shutil.rmtree("%s_files" % dest_path)
+                os.remove("%s.manifest" % dest_path)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
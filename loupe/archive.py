@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Packs the tiles of a tileset into a few large archives instead of one file
+per tile.
+
+An archive is the tile data, one tile after another, followed by a JSON
+index of ``{"<level>/<column>_<row>.<format>": [offset, length]}`` and a
+footer with the offset and length of the index.
+"""
+import json
+import os
+import shutil
+import struct
+import urllib2
+
+from .caching import LRUCache, cached_read, get_local_path
+
+MAGIC = b'LOUPETL1'
+FOOTER = struct.Struct('>QQ8s')
+
+INDEX_CACHE = LRUCache(256)
+
+
+def get_archive_name(dest_name, level=None):
+    """
+    Return the name of the archive for the whole tileset, or for one level
+    """
+    if level is None:
+        return "%s.tiles" % dest_name
+    return "%s.%s.tiles" % (dest_name, level)
+
+
+def write_archive(archive_path, tiles):
+    """
+    Write the ``(key, path)`` pairs in ``tiles`` into an archive
+    """
+    index = {}
+    archive = open(archive_path, 'wb')
+    try:
+        archive.write(MAGIC)
+        for key, path in tiles:
+            tile_file = open(path, 'rb')
+            try:
+                data = tile_file.read()
+            finally:
+                tile_file.close()
+            index[key] = [archive.tell(), len(data)]
+            archive.write(data)
+        index_offset = archive.tell()
+        index_data = json.dumps(index).encode('utf-8')
+        archive.write(index_data)
+        archive.write(FOOTER.pack(index_offset, len(index_data), MAGIC))
+    finally:
+        archive.close()
+
+
+def pack_tileset(dest_path, per_level=False, remove=True):
+    """
+    Pack the tiles in ``<dest_path>_files`` into ``<dest_path>.tiles``, or
+    one ``<dest_path>.<level>.tiles`` per level, and remove the loose tiles
+    """
+    files_path = "%s_files" % dest_path
+    levels = {}
+    for dirpath, dirnames, filenames in os.walk(files_path):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            key = os.path.relpath(path, files_path).replace(os.sep, '/')
+            levels.setdefault(key.split('/')[0], []).append((key, path))
+    if per_level:
+        for level, tiles in levels.items():
+            write_archive(get_archive_name(dest_path, level), sorted(tiles))
+    else:
+        tiles = []
+        for level in sorted(levels, key=int):
+            tiles.extend(sorted(levels[level]))
+        write_archive(get_archive_name(dest_path), tiles)
+    if remove:
+        shutil.rmtree(files_path)
+
+
+class TileArchive(object):
+    """
+    Reads tiles from an archive in ``storage``. Local archives are read with
+    a seek, remote archives with HTTP range requests to the storage's URL.
+    The index of recently read archives is kept in memory.
+    """
+    def __init__(self, storage, name):
+        self.storage = storage
+        self.name = name
+
+    def read_range(self, start, length):
+        """
+        Return ``length`` bytes from ``start``. A negative ``start`` counts
+        from the end of the archive. Raises ``IOError`` when a remote archive
+        can't be read by range.
+        """
+        from .settings import METADATA_TIMEOUT
+        path = get_local_path(self.storage, self.name)
+        if path is not None:
+            archive = open(path, 'rb')
+            try:
+                archive.seek(start, start < 0 and os.SEEK_END or os.SEEK_SET)
+                return archive.read(length)
+            finally:
+                archive.close()
+        if start < 0:
+            byte_range = "bytes=%s" % start
+        else:
+            byte_range = "bytes=%s-%s" % (start, start + length - 1)
+        request = urllib2.Request(self.storage.url(self.name),
+                                  headers={'Range': byte_range})
+        response = urllib2.urlopen(request, timeout=METADATA_TIMEOUT)
+        try:
+            # A server ignoring the range sends the whole archive
+            if response.getcode() != 206:
+                raise IOError("%s was not read by range" % self.name)
+            return response.read()
+        finally:
+            response.close()
+
+    def read_index(self):
+        footer = self.read_range(-FOOTER.size, FOOTER.size)
+        index_offset, index_length, magic = FOOTER.unpack(footer)
+        if magic != MAGIC:
+            raise IOError("%s is not a tile archive" % self.name)
+        return json.loads(self.read_range(index_offset, index_length).decode('utf-8'))
+
+    @property
+    def index(self):
+        return cached_read(INDEX_CACHE, self.storage, self.name, self.read_index)
+
+    def get_tile(self, key):
+        """
+        Return the data of the tile, or ``None`` if it is not in the archive
+        """
+        index = self.index
+        if key not in index:
+            return None
+        offset, length = index[key]
+        return self.read_range(offset, length)
+
+
+def get_tile_data(storage, dest_name, key):
+    """
+    Return the data of the tile ``key`` of the tileset ``dest_name``, from
+    its archive when tiles are packed or from its file otherwise. Returns
+    ``None`` when the tile does not exist.
+    """
+    from .settings import TILE_LAYOUT, TILE_ARCHIVE_PER_LEVEL
+    if TILE_LAYOUT == 'packed':
+        level = TILE_ARCHIVE_PER_LEVEL and key.split('/')[0] or None
+        try:
+            return TileArchive(storage, get_archive_name(dest_name, level)).get_tile(key)
+        except (IOError, OSError, urllib2.URLError):
+            # Tilesets created before tiles were packed are still loose
+            pass
+    try:
+        tile_file = storage.open("%s_files/%s" % (dest_name, key))
+    except (IOError, OSError):
+        return None
+    try:
+        return tile_file.read()
+    finally:
+        tile_file.close()
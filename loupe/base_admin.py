@@ -2,6 +2,9 @@
 from django.contrib import admin
 from django.conf import settings
 
+from .fields import LargeImageField
+from .forms import ChunkedUploadWidget
+
 
 class BaseLoupeImageAdmin(admin.ModelAdmin):
     fieldsets = (
@@ -15,21 +18,23 @@ class BaseLoupeImageAdmin(admin.ModelAdmin):
             'fields': ('document_name', 'document_order')
         }),
         ('Advanced', {
-            'fields': ('slug', ),
+            'fields': ('slug', 'tile_profile'),
             'classes': ('collapsed', )
         })
     )
-    list_display = ('thumbnail_img', 'name', 'tileset_type', 'document', )
+    list_display = ('thumbnail_img', 'name', 'tileset_type', 'tileset_progress', 'document', )
     prepopulated_fields = {"slug": ("name", )}
+    formfield_overrides = {
+        LargeImageField: {'widget': ChunkedUploadWidget},
+    }
 
     def thumbnail_img(self, obj):
         """
-        Show the thumbnail or the missing thumbnail_img
+        Show the thumbnail or the missing thumbnail_img. The thumbnail's URL
+        is stored on the image, so no storage is touched.
         """
-        if hasattr(obj.thumbnail, 'file') and obj.thumbnail.file.url:
-            url = obj.thumbnail.file.url
-        elif hasattr(obj.image, 'file') and obj.image.thumbnail_url:
-            url = obj.image.thumbnail_url
+        if obj.has_thumbnail and obj.thumbnail_url:
+            url = obj.thumbnail_url
         else:
             url = "%s%s" % (settings.STATIC_URL, "loupe/noimgavailable.png")
 
@@ -37,6 +42,25 @@ class BaseLoupeImageAdmin(admin.ModelAdmin):
     thumbnail_img.short_description = "Thumbnail"
     thumbnail_img.allow_tags = True
 
+    class Media:
+        js = ('loupe/progress.js', )
+
+    def tileset_progress(self, obj):
+        """
+        Show the tileset status. While tiling or transferring, the page polls
+        the status URL for the progress.
+        """
+        from .progress import get_progress
+        if obj.image and (obj.tileset_status in ('pending', 'tiling') or
+                          get_progress(obj.image.name)):
+            from django.core.urlresolvers import reverse
+            return '<span data-loupe-status="{0}">{1}</span>'.format(
+                reverse('loupeimage-status', kwargs={'slug': obj.slug}),
+                obj.get_tileset_status_display())
+        return obj.get_tileset_status_display()
+    tileset_progress.short_description = "Tileset"
+    tileset_progress.allow_tags = True
+
     def tileset_type(self, obj):
         """
         Show the type of tileset
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+In-process caches for data read from storage
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Seconds data read from remote storage is trusted. Local files are checked
+# against their modification time instead.
+REMOTE_TTL = 60
+
+
+class LRUCache(object):
+    """
+    A thread safe least recently used cache holding no more than
+    ``max_size`` worth of values, as measured by ``sizeof``
+    """
+    def __init__(self, max_size, sizeof=None):
+        self.max_size = max_size
+        self.sizeof = sizeof or (lambda value: 1)
+        self.size = 0
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.data.pop(key)
+            except KeyError:
+                return default
+            self.data[key] = value
+            return value
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_size:
+            return
+        with self.lock:
+            if key in self.data:
+                self.size -= self.sizeof(self.data.pop(key))
+            self.data[key] = value
+            self.size += size
+            while self.size > self.max_size:
+                old_key, old_value = self.data.popitem(last=False)
+                self.size -= self.sizeof(old_value)
+
+    def delete(self, key):
+        with self.lock:
+            if key in self.data:
+                self.size -= self.sizeof(self.data.pop(key))
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.size = 0
+
+
+class MemoryCache(object):
+    """
+    The part of Django's cache API loupe uses, kept in this process
+    """
+    def __init__(self, max_size):
+        self.lru = LRUCache(max_size)
+
+    def get(self, key):
+        return self.lru.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.lru.set(key, value)
+
+    def delete(self, key):
+        self.lru.delete(key)
+
+    def get_many(self, keys):
+        values = {}
+        for key in keys:
+            value = self.lru.get(key)
+            if value is not None:
+                values[key] = value
+        return values
+
+    def set_many(self, data, timeout=None):
+        for key, value in data.items():
+            self.lru.set(key, value)
+
+
+def get_local_path(storage, name):
+    """
+    Return the file system path of ``name``, or ``None`` for remote storage
+    """
+    try:
+        return storage.path(name)
+    except NotImplementedError:
+        return None
+
+
+def get_file_version(storage, name):
+    """
+    Return a value that changes when the file changes: its modification time
+    when local, or the current period of ``REMOTE_TTL`` seconds when remote
+    """
+    path = get_local_path(storage, name)
+    if path is not None:
+        return os.path.getmtime(path)
+    return int(time.time() / REMOTE_TTL)
+
+
+def cached_read(cache, storage, name, load):
+    """
+    Return ``load()`` for the file ``name``, caching the result until the
+    file's version changes
+    """
+    version = get_file_version(storage, name)
+    key = (storage.__class__.__name__, name)
+    cached = cache.get(key)
+    if cached is None or cached[0] != version:
+        cached = (version, load())
+        cache.set(key, cached)
+    return cached[1]
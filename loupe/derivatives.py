@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Resized copies of an image in other formats, made from its tileset the
+first time they are requested and kept in its storage
+"""
+import os
+from io import BytesIO
+
+from PIL import Image
+
+from .caching import LRUCache
+
+FORMATS = {
+    'jpg': ('JPEG', 'image/jpeg'),
+    'png': ('PNG', 'image/png'),
+    'webp': ('WEBP', 'image/webp'),
+    'avif': ('AVIF', 'image/avif'),
+}
+
+# Derivatives known to be in storage, so their URLs need no storage call
+EXISTING = LRUCache(10000)
+
+
+def is_format_supported(format):
+    """
+    Return ``True`` if this Pillow can encode ``format``. AVIF needs a
+    Pillow built with it or the pillow-avif-plugin.
+    """
+    if format not in FORMATS:
+        return False
+    if format == 'avif':
+        try:
+            __import__('pillow_avif')
+        except ImportError:
+            pass
+    Image.init()
+    return FORMATS[format][0] in Image.SAVE
+
+
+class Derivative(object):
+    """
+    The image of ``field_file`` fitted within ``width`` by ``height`` and
+    encoded as ``format``. A ``height`` of 0 fits the width only.
+    """
+    def __init__(self, field_file, width, height=0, format='jpg'):
+        from .settings import DERIVATIVE_FORMATS, DERIVATIVE_MAX_SIZE
+        width, height = int(width), int(height or 0)
+        if format not in DERIVATIVE_FORMATS or format not in FORMATS:
+            raise ValueError("Unsupported derivative format %s" % format)
+        if not 0 < width <= DERIVATIVE_MAX_SIZE or not 0 <= height <= DERIVATIVE_MAX_SIZE:
+            raise ValueError("Unsupported derivative size %sx%s" % (width, height))
+        self.field_file = field_file
+        self.width = width
+        self.height = height
+        self.format = format
+
+    @property
+    def name(self):
+        base = os.path.splitext(self.field_file.name)[0]
+        return "%s_derivatives/%sx%s.%s" % (base, self.width, self.height, self.format)
+
+    @property
+    def signature(self):
+        """
+        Signs the image, size and format, so the view only makes the
+        derivatives the site links to
+        """
+        from django.utils.crypto import salted_hmac
+        return salted_hmac('loupe.derivatives', "%s/%sx%s.%s" % (
+            self.field_file.instance.slug, self.width, self.height,
+            self.format)).hexdigest()
+
+    def is_signed(self, signature):
+        from django.utils.crypto import constant_time_compare
+        return constant_time_compare(signature or '', self.signature)
+
+    @property
+    def content_type(self):
+        return FORMATS[self.format][1]
+
+    def exists(self):
+        """
+        Return ``True`` if the derivative is in storage, remembering those
+        that are
+        """
+        key = (self.field_file.storage.__class__.__name__, self.name)
+        if EXISTING.get(key):
+            return True
+        if self.field_file.storage.exists(self.name):
+            EXISTING.set(key, True)
+            return True
+        return False
+
+    @property
+    def url(self):
+        """
+        The derivative in storage when it is known to exist, otherwise the
+        signed URL of the view that makes it. Never calls storage.
+        """
+        from django.core.urlresolvers import reverse
+        key = (self.field_file.storage.__class__.__name__, self.name)
+        if EXISTING.get(key):
+            return self.field_file.storage.url(self.name)
+        return "%s?signature=%s" % (reverse('loupeimage-derivative', kwargs={
+            'slug': self.field_file.instance.slug,
+            'width': self.width,
+            'height': self.height,
+            'format': self.format}), self.signature)
+
+    def render(self):
+        """
+        Return the encoded derivative, reduced from the smallest level of the
+        tileset large enough, or ``None`` if the tileset can't be read
+        """
+        from .descriptors import DescriptorError
+        from .pyramid import PyramidReader
+        from .settings import DERIVATIVE_QUALITY
+        try:
+            dest_path = os.path.splitext(self.field_file.path)[0]
+            reader = PyramidReader(dest_path)
+        except (NotImplementedError, IOError, OSError, DescriptorError):
+            return None
+        image = reader.thumbnail(self.width, self.height or reader.metadata.height)
+        if image is None:
+            return None
+        pil_format = FORMATS[self.format][0]
+        if pil_format == 'JPEG' and image.mode not in ('L', 'RGB'):
+            image = image.convert('RGB')
+        output = BytesIO()
+        image.save(output, pil_format, quality=DERIVATIVE_QUALITY)
+        return output.getvalue()
+
+    def create(self):
+        """
+        Make the derivative if it is not in storage yet. Concurrent requests
+        for the same derivative wait for one to make it. Returns ``False`` if
+        it couldn't be made.
+        """
+        from django.core.files.base import ContentFile
+        from .lazy import get_disk_cache, render_lock
+        if self.exists():
+            return True
+        if not is_format_supported(self.format):
+            return False
+        with render_lock(get_disk_cache(), self.name):
+            if self.exists():
+                return True
+            data = self.render()
+            if data is None:
+                return False
+            storage = self.field_file.storage
+            save = getattr(storage, 'save_without_tiling', storage.save)
+            save(self.name, ContentFile(data))
+            EXISTING.set((self.field_file.storage.__class__.__name__, self.name), True)
+        return True
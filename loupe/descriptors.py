@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+Parsers for the descriptors of each type of tileset. Every parser returns
+a ``TilesetMetadata``.
+
+XML descriptors are read with ``iterparse``, stopping as soon as the
+elements holding the metadata have been seen.
+"""
+import json
+import math
+import os
+from io import BytesIO
+from urlparse import urljoin
+
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+
+DZI_XMLNS = 'http://schemas.microsoft.com/deepzoom/2008'
+OSM_SIZE = 65572864
+OSM_TILES_URL = 'http://tile.openstreetmap.org/'
+
+
+class DescriptorError(ValueError):
+    pass
+
+
+class TilesetMetadata(object):
+    """
+    The size, tiling and levels of a tileset. ``levels`` holds the
+    (width, height) of each level, smallest first.
+    """
+    def __init__(self, width, height, tile_size, overlap=0, format='jpg',
+                 base_tile_url='', levels=None):
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.format = format
+        self.base_tile_url = base_tile_url
+        self.levels = levels or get_halved_levels(width, height, 1)
+
+    @property
+    def level_count(self):
+        return len(self.levels)
+
+    def as_dict(self):
+        return {
+            'width': self.width,
+            'height': self.height,
+            'tilesize': self.tile_size,
+            'overlap': self.overlap,
+            'format': self.format,
+            'base_tile_url': self.base_tile_url,
+            'levels': self.levels,
+        }
+
+
+def get_halved_levels(width, height, smallest, round_up=True):
+    """
+    Return the sizes of the levels made by halving the image until both sides
+    are no larger than ``smallest``, smallest level first
+    """
+    levels = [(width, height)]
+    while width > smallest or height > smallest:
+        if round_up:
+            width, height = max(-(-width // 2), 1), max(-(-height // 2), 1)
+        else:
+            width, height = max(width // 2, 1), max(height // 2, 1)
+        levels.append((width, height))
+    levels.reverse()
+    return levels
+
+
+def get_tag_name(element):
+    return element.tag.rsplit('}', 1)[-1]
+
+
+def iter_elements(data, events=('start', )):
+    """
+    Yield (event, element) for each element of the XML document ``data``
+    """
+    try:
+        for event, element in ElementTree.iterparse(BytesIO(data), events):
+            yield event, element
+    except SyntaxError as e:
+        raise DescriptorError("Invalid descriptor: %s" % e)
+
+
+def get_int(attributes, name):
+    try:
+        return int(attributes[name])
+    except (KeyError, TypeError, ValueError):
+        raise DescriptorError("Descriptor is missing %s" % name)
+
+
+def parse_dzi(data, url):
+    """
+    ``<Image TileSize Overlap Format><Size Width Height/></Image>``
+    """
+    image = None
+    for event, element in iter_elements(data):
+        name = get_tag_name(element)
+        if name == 'Image':
+            image = dict(element.attrib)
+        elif name == 'Size' and image is not None:
+            path = os.path.splitext(url)[0]
+            return TilesetMetadata(
+                get_int(element.attrib, 'Width'),
+                get_int(element.attrib, 'Height'),
+                get_int(image, 'TileSize'),
+                int(image.get('Overlap', 0)),
+                image.get('Format', 'jpg'),
+                "%s_files/" % path)
+    raise DescriptorError("No Image Size in DZI descriptor")
+
+
+def parse_zoomify(data, url):
+    """
+    ``<IMAGE_PROPERTIES WIDTH HEIGHT TILESIZE .../>``
+    """
+    for event, element in iter_elements(data):
+        if get_tag_name(element).upper() == 'IMAGE_PROPERTIES':
+            attributes = dict((k.upper(), v) for k, v in element.attrib.items())
+            width = get_int(attributes, 'WIDTH')
+            height = get_int(attributes, 'HEIGHT')
+            tile_size = int(attributes.get('TILESIZE', 256))
+            return TilesetMetadata(width, height, tile_size,
+                base_tile_url=url.replace('ImageProperties.xml', ''),
+                levels=get_halved_levels(width, height, tile_size, round_up=False))
+    raise DescriptorError("No IMAGE_PROPERTIES in Zoomify descriptor")
+
+
+def parse_iif(data, url):
+    """
+    An IIIF image information response, ``info.json`` or ``info.xml``. Image
+    API 2 and 3 describe the tiles in ``tiles``, and 1.x at the top level.
+    """
+    try:
+        info = json.loads(data.decode('utf-8'))
+    except ValueError:
+        info = {}
+        for event, element in iter_elements(data, ('end', )):
+            name = get_tag_name(element)
+            if name == 'scale_factor':
+                info.setdefault('scale_factors', []).append(int(element.text))
+            elif name == 'format':
+                info.setdefault('formats', []).append(element.text.strip())
+            elif name not in ('info', 'scale_factors', 'formats'):
+                info[name] = (element.text or '').strip()
+    width = get_int(info, 'width')
+    height = get_int(info, 'height')
+    tiles = info.get('tiles') or [{}]
+    tile_size = int(tiles[0].get('width') or info.get('tile_width') or 256)
+    scale_factors = sorted(set(tiles[0].get('scaleFactors') or
+                               info.get('scale_factors') or [1]), reverse=True)
+    formats = info.get('formats') or info.get('preferredFormats')
+    levels = [(-(-width // scale), -(-height // scale)) for scale in scale_factors]
+    base_tile_url = url.rsplit('/', 1)[0] + '/'
+    return TilesetMetadata(width, height, tile_size,
+        format=(formats or ['jpg'])[0],
+        base_tile_url=base_tile_url, levels=levels)
+
+
+def parse_lip(data, url):
+    """
+    A legacy image pyramid, ``<image><level url width height/>...</image>``
+    """
+    levels = []
+    for event, element in iter_elements(data):
+        if get_tag_name(element) == 'level':
+            levels.append((get_int(element.attrib, 'width'),
+                           get_int(element.attrib, 'height'),
+                           urljoin(url, element.attrib.get('url', ''))))
+    if not levels:
+        raise DescriptorError("No levels in legacy image pyramid")
+    levels.sort()
+    width, height, level_url = levels[-1]
+    metadata = TilesetMetadata(width, height, max(width, height),
+        base_tile_url=url.rsplit('/', 1)[0] + '/',
+        levels=[(w, h) for w, h, u in levels])
+    metadata.level_urls = [u for w, h, u in levels]
+    return metadata
+
+
+def parse_tms(data, url):
+    """
+    A TMS ``tilemapresource.xml``, with the bounding box in pixels and one
+    ``TileSet`` per level
+    """
+    box = tile_format = None
+    units = []
+    for event, element in iter_elements(data):
+        name = get_tag_name(element)
+        if name == 'BoundingBox':
+            box = element.attrib
+        elif name == 'TileFormat':
+            tile_format = element.attrib
+        elif name == 'TileSet':
+            units.append(float(element.attrib.get('units-per-pixel', 1)))
+    if box is None or tile_format is None or not units:
+        raise DescriptorError("Incomplete TMS descriptor")
+    try:
+        box_width = float(box['maxx']) - float(box['minx'])
+        box_height = float(box['maxy']) - float(box['miny'])
+    except (KeyError, ValueError):
+        raise DescriptorError("Invalid TMS BoundingBox")
+    levels = [(int(math.ceil(box_width / unit)), int(math.ceil(box_height / unit)))
+              for unit in sorted(units, reverse=True)]
+    width, height = levels[-1]
+    return TilesetMetadata(width, height, get_int(tile_format, 'width'),
+        format=tile_format.get('extension', 'png'),
+        base_tile_url=url.rsplit('/', 1)[0] + '/', levels=levels)
+
+
+def parse_osm(data, url):
+    """
+    OpenStreetMap tiles have no descriptor. ``url`` is the tile server.
+    """
+    return TilesetMetadata(OSM_SIZE, OSM_SIZE, 256, format='png',
+        base_tile_url=url or OSM_TILES_URL,
+        levels=get_halved_levels(OSM_SIZE, OSM_SIZE, 256))
+
+
+PARSERS = {
+    'dzi': parse_dzi,
+    'iif': parse_iif,
+    'lip': parse_lip,
+    'osm': parse_osm,
+    'tms': parse_tms,
+    'zoomify': parse_zoomify,
+}
+
+# Types whose URL is not a descriptor to fetch
+NO_DESCRIPTOR = ('osm', )
+
+
+def get_metadata(tile_type, url):
+    """
+    Fetch and parse the descriptor of an external tileset
+    """
+    from .fetch import get_fetcher
+    if tile_type not in PARSERS:
+        raise DescriptorError("Unknown tileset type %s" % tile_type)
+    data = b''
+    if tile_type not in NO_DESCRIPTOR:
+        data = get_fetcher().fetch(url)
+    return PARSERS[tile_type](data, url)
+
+
+def get_thumbnail_url(tile_type, metadata, size):
+    """
+    Return the URL of the smallest image of the tileset at least ``size``
+    pixels, or of its largest level that is a single tile
+    """
+    base = metadata.base_tile_url
+    if tile_type == 'iif':
+        return "%sfull/%s,/0/native.%s" % (base, min(size, metadata.width), metadata.format)
+    if tile_type == 'lip':
+        for (width, height), level_url in zip(metadata.levels, metadata.level_urls):
+            if max(width, height) >= size:
+                return level_url
+        return metadata.level_urls[-1]
+    level = 0
+    for index, (width, height) in enumerate(metadata.levels):
+        if width <= metadata.tile_size and height <= metadata.tile_size:
+            level = index
+            if max(width, height) >= size:
+                break
+    if tile_type == 'zoomify':
+        return "%sTileGroup0/%s-0-0.jpg" % (base, level)
+    if tile_type in ('tms', 'osm'):
+        return "%s%s/0/0.%s" % (base, level, metadata.format)
+    return "%s%s/0_0.%s" % (base, level, metadata.format)
+
+
+def get_local_metadata(field_file):
+    """
+    Return the metadata of the tileset created from ``field_file``, from the
+    image's header, the tiling settings and the image's tile profile, so it
+    is known before tiling
+    """
+    from .tilers import get_tiler, has_alpha, open_image
+    tiler = get_tiler(profile=getattr(field_file.instance, 'tile_profile', None))
+    image_file = field_file.storage.open(field_file.name)
+    try:
+        image = open_image(image_file)
+        width, height = image.size
+        tiler.select_format(has_alpha(image))
+    except IOError as e:
+        raise DescriptorError("Unable to read %s: %s" % (field_file.name, e))
+    finally:
+        image_file.close()
+    path = os.path.splitext(field_file.url)[0]
+    return TilesetMetadata(width, height, tiler.tile_size, tiler.overlap,
+        tiler.format, "%s_files/" % path)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Documents are the images sharing a ``document_name``, in ``document_order``.
+A document is shown in one viewer, paging through its images.
+"""
+
+
+class LoupeDocument(object):
+    """
+    The pages of the document ``name``. The pages are fetched in one query
+    the first time they are needed.
+    """
+    def __init__(self, name, model=None):
+        from .models import LoupeImage
+        self.name = name
+        self.model = model or LoupeImage
+        self._pages = None
+
+    @classmethod
+    def get_names(cls, model=None):
+        """
+        Return the names of all the documents, in order
+        """
+        from .models import LoupeImage
+        model = model or LoupeImage
+        return model._default_manager.exclude(document_name__isnull=True).exclude(
+            document_name='').order_by('document_name').values_list(
+            'document_name', flat=True).distinct()
+
+    def get_queryset(self):
+        """
+        The document's images that can be shown, in order
+        """
+        return self.model._default_manager.filter(document_name=self.name,
+            tileset_status='ready').order_by('document_order', 'pk')
+
+    @property
+    def pages(self):
+        if self._pages is None:
+            self._pages = list(self.get_queryset())
+        return self._pages
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __iter__(self):
+        return iter(self.pages)
+
+    def __getitem__(self, index):
+        return self.pages[index]
+
+    def __unicode__(self):
+        return self.name
+
+    @property
+    def slug(self):
+        from django.template.defaultfilters import slugify
+        return slugify(self.name) or 'document'
+
+    @property
+    def tileset_sources(self):
+        """
+        The OpenSeadragon tile sources of every page, built from the cached
+        metadata so the viewer doesn't fetch each page's descriptor
+        """
+        return ", ".join([page.tileset_source for page in self.pages])
+
+    def get_absolute_url(self):
+        from django.core.urlresolvers import reverse
+        return reverse('loupedocument-detail', kwargs={'document_name': self.name})
+
+    def render(self):
+        """
+        return the rendered template to display the document in a webpage
+        """
+        from django.utils.safestring import mark_safe
+        from django.template.loader import render_to_string
+        return mark_safe(render_to_string('loupe/loupedocument_default.html',
+                                          {'object': self}))
+
+
+def get_document_or_404(name, model=None):
+    """
+    Return the document ``name``, raising ``Http404`` if it has no pages
+    """
+    from django.http import Http404
+    document = LoupeDocument(name, model)
+    if not document.pages:
+        raise Http404
+    return document
@@ -1,12 +1,24 @@
-import urllib
-try:
-    from cStringIO import StringIO
-except ImportError:
-    from StringIO import StringIO
+import os
+import tempfile
+from io import BytesIO
+from urlparse import urlparse
+
 from PIL import Image
 
 from django.core.files.base import ContentFile
 
+# Downloads are kept in memory up to this size, then spill to a temporary file
+SPOOL_SIZE = 4 * 1024 * 1024
+
+RESAMPLE = getattr(Image, 'LANCZOS', None) or Image.ANTIALIAS
+
+# Raised by Pillow for images over twice ``Image.MAX_IMAGE_PIXELS``, which
+# older versions only warn about
+DECOMPRESSION_BOMB_ERRORS = getattr(Image, 'DecompressionBombError', ())
+
+# Descriptors whose file name is the same for every tileset
+DESCRIPTOR_NAMES = ('ImageProperties', 'info', 'tilemapresource')
+
 
 def guess_image_format(content_type=''):
     """
@@ -19,24 +31,93 @@ def guess_image_format(content_type=''):
     return None
 
 
-def django_website_image(url):
+def download_image(url, max_bytes=None):
+    """
+    Stream the image at ``url`` into a temporary file that is deleted when
+    closed. Returns the file and the content type.
+    """
+    from .fetch import get_fetcher
+    from .settings import THUMBNAIL_MAX_BYTES
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    try:
+        content_type = get_fetcher().download(url, output, max_bytes or THUMBNAIL_MAX_BYTES)
+    except Exception:
+        output.close()
+        raise
+    output.seek(0)
+    return output, content_type
+
+
+def make_thumbnail(source, size, max_pixels=None):
     """
-    Returns a filename, (width, height), ContentFile tuple for saving in a field
+    Return the size of the image in the file ``source`` and a JPEG of it no
+    larger than ``size`` pixels square. JPEGs are decoded at the smallest
+    scale that is still large enough. Pillow's decompression bomb check stays
+    in force for these images from other sites.
+    """
+    from .settings import THUMBNAIL_MAX_PIXELS
+    from .tilers import PIXEL_LIMIT_LOCK
+    try:
+        with PIXEL_LIMIT_LOCK:
+            image = Image.open(source)
+    except DECOMPRESSION_BOMB_ERRORS as e:
+        raise IOError("Image is too large to thumbnail: %s" % e)
+    original_size = width, height = image.size
+    if width * height > (max_pixels or THUMBNAIL_MAX_PIXELS):
+        raise IOError("Image of %sx%s pixels is too large to thumbnail" % original_size)
+    image.draft('RGB', (size, size))
+    if image.mode not in ('L', 'RGB'):
+        image = image.convert('RGB')
+    image.thumbnail((size, size), RESAMPLE)
+    output = BytesIO()
+    image.save(output, 'JPEG', quality=90)
+    return original_size, ContentFile(output.getvalue())
+
+
+def get_thumbnail_name(url):
+    """
+    Name a thumbnail after the tileset's descriptor, or after its directory
+    when every descriptor of its type has the same name
+    """
+    parts = [part for part in urlparse(url).path.split('/') if part]
+    if not parts:
+        return "thumbnail.jpg"
+    name = os.path.splitext(parts[-1])[0]
+    if name in DESCRIPTOR_NAMES and len(parts) > 1:
+        name = parts[-2]
+    return "%s.jpg" % name
+
+
+def django_website_image(url, size=None):
+    """
+    Returns a filename, (width, height), ContentFile tuple for saving in a
+    field. The ContentFile is a thumbnail no larger than ``size``, which
+    defaults to ``THUMB_SIZE``.
 
     filename, dimensions, contentfile = django_website_image(self.url)
     self.key_image.save(filename, contentfile)
     """
-    import os
-    from urlparse import urlparse
+    from .settings import THUMB_SIZE
     url_filename = os.path.basename(urlparse(url).path)
-    filepath, info = urllib.urlretrieve(url)
-    img_format = guess_image_format(info.get('content-type', ''))
-    image = Image.open(filepath)
-    if image.mode not in ('L', 'RGB'):
-        image = image.convert('RGB')
+    source, content_type = download_image(url)
+    try:
+        image_size, content = make_thumbnail(source, size or THUMB_SIZE)
+    finally:
+        source.close()
+    return (url_filename, image_size, content)
 
-    destination = StringIO()
-    image.save(destination, format=img_format)
-    destination.seek(0)
 
-    return (url_filename, image.size, ContentFile(destination.read()))
+def create_external_thumbnail(tile_type, url, size=None, metadata=None):
+    """
+    Returns a filename, (width, height), ContentFile tuple with a thumbnail
+    made from the smallest level of an external tileset that is large
+    enough, usually a single tile. The tileset's ``metadata`` is fetched
+    unless given.
+    """
+    from .descriptors import get_metadata, get_thumbnail_url
+    from .settings import THUMB_SIZE
+    size = size or THUMB_SIZE
+    metadata = metadata or get_metadata(tile_type, url)
+    filename, image_size, content = django_website_image(
+        get_thumbnail_url(tile_type, metadata, size), size)
+    return get_thumbnail_name(url), image_size, content
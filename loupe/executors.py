@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Executors run claimed tiling jobs outside of the request/response cycle
+"""
+from .scheduler import run_tiling_job, dispatch_tiling_jobs
+
+
+class SyncExecutor(object):
+    """
+    Runs the job immediately in the current process
+    """
+    def submit(self, job_id):
+        run_tiling_job(job_id)
+
+
+class CeleryExecutor(object):
+    """
+    Sends the job to the ``run_tiling_job_async`` Celery task
+    """
+    def submit(self, job_id):
+        from .task import run_tiling_job_async
+        run_tiling_job_async.delay(job_id)
+
+
+def _init_worker():
+    """
+    Forked workers must not share the parent's database connection
+    """
+    from django.db import connection
+    connection.close()
+
+
+class ProcessPoolExecutor(object):
+    """
+    Runs the job in a pool of local worker processes. The parent process
+    dispatches the next jobs as each one finishes.
+    """
+    pool = None
+
+    def __init__(self, processes=None):
+        from .settings import TILING_PROCESSES
+        self.processes = processes or TILING_PROCESSES
+
+    def get_pool(self):
+        if ProcessPoolExecutor.pool is None:
+            from multiprocessing import Pool
+            ProcessPoolExecutor.pool = Pool(self.processes, _init_worker)
+        return ProcessPoolExecutor.pool
+
+    def submit(self, job_id):
+        self.get_pool().apply_async(run_tiling_job, (job_id, ),
+                                    callback=dispatch_tiling_jobs)
+
+
+EXECUTORS = {
+    'sync': SyncExecutor,
+    'celery': CeleryExecutor,
+    'process': ProcessPoolExecutor,
+}
+
+
+def get_executor(name=None):
+    """
+    Return an instance of the executor set in ``TILING_EXECUTOR``
+    """
+    from django.utils.importlib import import_module
+    from .settings import TILING_EXECUTOR, HAS_CELERY
+
+    name = name or TILING_EXECUTOR
+    if not name:
+        name = HAS_CELERY and 'celery' or 'process'
+    if name in EXECUTORS:
+        return EXECUTORS[name]()
+    module_name, class_name = name.rsplit('.', 1)
+    return getattr(import_module(module_name), class_name)()
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+Fetches the descriptors of external tilesets over reused connections and
+caches them, revalidating with their ETag or Last-Modified date
+"""
+import httplib
+import logging
+import threading
+import time
+import urlparse
+from multiprocessing.pool import ThreadPool
+
+from .caching import MemoryCache
+from .metrics import timed
+
+logger = logging.getLogger(__name__)
+
+
+class FetchError(IOError):
+    pass
+
+
+class MetadataFetcher(object):
+    """
+    Fetches URLs with one keep-alive connection per host and thread.
+
+    Responses are cached by URL. A cached response younger than ``max_age``
+    seconds is used as is. An older one is revalidated with a conditional
+    request and used again if the server answers 304 Not Modified.
+    """
+    user_agent = 'django-loupe'
+
+    def __init__(self, cache=None, timeout=None, max_age=None):
+        from .settings import METADATA_TIMEOUT, METADATA_MAX_AGE
+        self.cache = cache or MemoryCache(256)
+        self.timeout = timeout or METADATA_TIMEOUT
+        self.max_age = METADATA_MAX_AGE if max_age is None else max_age
+        self.connections = threading.local()
+
+    def get_connection(self, scheme, host):
+        """
+        Return this thread's connection to ``host``
+        """
+        pool = self.connections.__dict__.setdefault('pool', {})
+        key = (scheme, host)
+        if key not in pool:
+            connection_class = scheme == 'https' and httplib.HTTPSConnection or httplib.HTTPConnection
+            pool[key] = connection_class(host, timeout=self.timeout)
+        return pool[key]
+
+    def close_connection(self, scheme, host):
+        connection = self.connections.__dict__.get('pool', {}).pop((scheme, host), None)
+        if connection is not None:
+            connection.close()
+
+    def open(self, url, headers=None, redirects=5):
+        """
+        Return the response to a GET of ``url``, following redirects. A
+        connection the server has closed is opened again once. The response
+        must be read and released before the thread's next request.
+        """
+        parts = urlparse.urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise FetchError("Unable to fetch %s" % url)
+        path = parts.path or '/'
+        if parts.query:
+            path = "%s?%s" % (path, parts.query)
+        request_headers = {'User-Agent': self.user_agent}
+        request_headers.update(headers or {})
+        for attempt in (1, 2):
+            connection = self.get_connection(parts.scheme, parts.netloc)
+            try:
+                connection.request('GET', path, headers=request_headers)
+                response = connection.getresponse()
+                break
+            except (httplib.HTTPException, IOError) as e:
+                self.close_connection(parts.scheme, parts.netloc)
+                if attempt == 2:
+                    raise FetchError("Unable to fetch %s: %s" % (url, e))
+        response.connection_key = (parts.scheme, parts.netloc)
+        location = response.getheader('location')
+        if response.status in (301, 302, 303, 307, 308) and location:
+            self.release(response, read=True)
+            if not redirects:
+                raise FetchError("Too many redirects fetching %s" % url)
+            return self.open(urlparse.urljoin(url, location), headers, redirects - 1)
+        return response
+
+    def release(self, response, read=False):
+        """
+        Return the response's connection to the pool, or close it when the
+        response was not read to the end
+        """
+        try:
+            if read:
+                response.read()
+        except (httplib.HTTPException, IOError):
+            response.will_close = True
+        if response.will_close or not response.isclosed():
+            self.close_connection(*response.connection_key)
+
+    def request(self, url, headers=None):
+        """
+        Return the (status, headers, body) of a GET of ``url``
+        """
+        response = self.open(url, headers)
+        try:
+            body = response.read()
+        except (httplib.HTTPException, IOError) as e:
+            self.close_connection(*response.connection_key)
+            raise FetchError("Unable to fetch %s: %s" % (url, e))
+        self.release(response)
+        response_headers = dict((k.lower(), v) for k, v in response.getheaders())
+        return response.status, response_headers, body
+
+    def download(self, url, output, max_bytes=None, chunk_size=64 * 1024):
+        """
+        Write the body of ``url`` to the file ``output`` a chunk at a time
+        and return its content type. Raises ``FetchError`` once the body is
+        larger than ``max_bytes``.
+        """
+        response = self.open(url)
+        try:
+            if response.status != 200:
+                raise FetchError("Fetching %s returned %s" % (url, response.status))
+            length = int(response.getheader('content-length') or 0)
+            if max_bytes and length > max_bytes:
+                raise FetchError("%s is larger than %s bytes" % (url, max_bytes))
+            received = 0
+            while True:
+                chunk = response.read(chunk_size)
+                if not chunk:
+                    break
+                received += len(chunk)
+                if max_bytes and received > max_bytes:
+                    raise FetchError("%s is larger than %s bytes" % (url, max_bytes))
+                output.write(chunk)
+        except (httplib.HTTPException, IOError) as e:
+            self.close_connection(*response.connection_key)
+            if isinstance(e, FetchError):
+                raise
+            raise FetchError("Unable to fetch %s: %s" % (url, e))
+        self.release(response)
+        return response.getheader('content-type', '')
+
+    def fetch(self, url, revalidate=False):
+        """
+        Return the body of ``url``, from the cache while it is fresh.
+        ``revalidate`` checks a cached response with the server regardless
+        of its age.
+        """
+        key = "loupe.fetch:%s" % url
+        cached = self.cache.get(key)
+        now = time.time()
+        if cached and not revalidate and now - cached['checked'] < self.max_age:
+            return cached['body']
+        headers = {}
+        if cached and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached and cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+        with timed('metadata', url) as measurement:
+            status, response_headers, body = self.request(url, headers)
+            measurement.update(bytes=len(body), status=status,
+                               success=status in (200, 304))
+            if status not in (200, 304):
+                measurement['error'] = "HTTP %s" % status
+        if status == 304 and cached:
+            cached['checked'] = now
+            self.cache.set(key, cached, None)
+            return cached['body']
+        if status != 200:
+            raise FetchError("Fetching %s returned %s" % (url, status))
+        self.cache.set(key, {
+            'body': body,
+            'etag': response_headers.get('etag'),
+            'last_modified': response_headers.get('last-modified'),
+            'checked': now,
+        }, None)
+        return body
+
+    def fetch_many(self, urls, threads=None, revalidate=False):
+        """
+        Fetch ``urls`` concurrently and return ``{url: body}``. URLs that
+        could not be fetched are left out.
+        """
+        from .settings import TRANSFER_THREADS
+
+        def fetch(url):
+            try:
+                return url, self.fetch(url, revalidate)
+            except FetchError as e:
+                logger.error(e)
+                return url, None
+
+        urls = list(set(urls))
+        if not urls:
+            return {}
+        pool = ThreadPool(min(threads or TRANSFER_THREADS, len(urls)))
+        try:
+            results = pool.map(fetch, urls)
+        finally:
+            pool.close()
+            pool.join()
+        return dict((url, body) for url, body in results if body is not None)
+
+
+_fetcher = None
+
+
+def get_fetcher():
+    """
+    Return the fetcher shared by this process, caching in the Django cache
+    named by ``METADATA_CACHE`` or in memory
+    """
+    global _fetcher
+    if _fetcher is None:
+        from .settings import METADATA_CACHE
+        cache = None
+        if METADATA_CACHE:
+            from django.core.cache import get_cache
+            cache = get_cache(METADATA_CACHE)
+        _fetcher = MetadataFetcher(cache)
+    return _fetcher
+
+
+def refresh_external_metadata(images, threads=None):
+    """
+    Fetch the descriptors of the external tilesets of ``images``
+    concurrently, then update each image's metadata from them. Returns the
+    number of images updated.
+    """
+    from .descriptors import NO_DESCRIPTOR
+    images = [image for image in images if image.external_tileset_url]
+    fetched = get_fetcher().fetch_many(
+        [image.external_tileset_url for image in images
+         if image.external_tileset_type not in NO_DESCRIPTOR],
+        threads, revalidate=True)
+    updated = 0
+    for image in images:
+        if (image.external_tileset_url in fetched or
+                image.external_tileset_type in NO_DESCRIPTOR):
+            image.update_metadata()
+            updated += 1
+    return updated
@@ -3,14 +3,30 @@ from django.db.models.fields.files import FileField, FieldFile
 
 
 class LargeImageFieldFile(FieldFile):
-    def _thumbnail_url(self):
+    def get_thumbnail_url(self, size_name=None):
+        """
+        Return the URL of the thumbnail, or of one of the ``THUMBNAIL_SIZES``
+        """
         import os
         self._require_file()
         image_url = self.storage.url(self.name)
         name, ext = os.path.splitext(image_url)
+        if size_name:
+            return "{0}_thumb_{1}.jpg".format(name, size_name)
         return "{0}_thumb.jpg".format(name)
+
+    def _thumbnail_url(self):
+        return self.get_thumbnail_url()
     thumbnail_url = property(_thumbnail_url)
 
+    def derivative(self, width, height=0, format='jpg'):
+        """
+        Return the image fitted within ``width`` by ``height`` as ``format``.
+        Its ``url`` makes it from the tileset when first requested.
+        """
+        from .derivatives import Derivative
+        return Derivative(self, width, height, format)
+
 
 class LargeImageField(FileField):
     """
@@ -18,3 +34,59 @@ class LargeImageField(FileField):
     are created into tilesets
     """
     attr_class = LargeImageFieldFile
+
+    def formfield(self, **kwargs):
+        """
+        Uploads the file in resumable chunks with ``ChunkedUploadWidget``
+        """
+        from .forms import ChunkedImageFormField
+        defaults = {
+            'form_class': ChunkedImageFormField,
+            'upload_model': "%s.%s" % (self.model._meta.app_label,
+                                       self.model._meta.object_name.lower()),
+        }
+        defaults.update(kwargs)
+        return super(LargeImageField, self).formfield(**defaults)
+
+    def save_form_data(self, instance, data):
+        """
+        Mark a file already stored by a chunked upload with the upload
+        """
+        from .forms import StoredUploadName
+        super(LargeImageField, self).save_form_data(instance, data)
+        if isinstance(data, StoredUploadName):
+            getattr(instance, self.attname).stored_upload = data
+
+    def pre_save(self, model_instance, add):
+        """
+        Record the status and metadata of the tileset when a new file is
+        stored, or when a file already stored by a chunked upload is set, so
+        they are written with the rest of the instance. The file is tiled with
+        the instance's ``tile_profile``, and a chunked upload tiled with
+        another profile is tiled again. The upload's reference to the stored
+        file is then the instance's.
+        """
+        file = getattr(model_instance, self.attname)
+        tile_profile = getattr(model_instance, 'tile_profile', '')
+        uncommitted = bool(file) and not file._committed
+        if uncommitted:
+            # The storage tiles the file it is given with this profile
+            file.tile_profile = tile_profile
+        stored_upload = getattr(file, 'stored_upload', None)
+        if stored_upload is not None:
+            from .models import ChunkedUpload
+            del file.stored_upload
+            ChunkedUpload.objects.filter(upload_id=stored_upload.upload_id).update(
+                status='saved')
+            if (stored_upload.tile_profile != tile_profile and
+                    hasattr(file.storage, 'change_tile_profile')):
+                file.name = file.storage.change_tile_profile(file.name, tile_profile)
+        file = super(LargeImageField, self).pre_save(model_instance, add)
+        if not uncommitted and stored_upload is None:
+            return file
+        get_status = getattr(file.storage, 'get_tileset_status', None)
+        if get_status and hasattr(model_instance, 'tileset_status'):
+            model_instance.tileset_status = get_status(file.name)
+        if hasattr(model_instance, 'update_metadata'):
+            model_instance.update_metadata(commit=False)
+        return file
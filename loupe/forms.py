@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+from django import forms
+from django.utils.safestring import mark_safe
+from django.utils.translation import ugettext_lazy as _
+
+
+class ChunkedUploadValue(object):
+    """
+    The ID of a chunked upload sent in place of a file
+    """
+    def __init__(self, upload_id):
+        self.upload_id = upload_id
+
+
+class StoredUploadName(unicode):
+    """
+    The name a chunked upload was stored under, with its ``upload_id`` and
+    the ``tile_profile`` it was tiled with
+    """
+    upload_id = ''
+    tile_profile = ''
+
+
+class ChunkedUploadWidget(forms.ClearableFileInput):
+    """
+    A file input whose file is sent in resumable chunks by
+    ``loupe/chunked_upload.js`` before the form is submitted. The form only
+    sends the upload's ID. Without JavaScript the file is sent with the form.
+    """
+    upload_model = ''
+
+    class Media:
+        js = ('loupe/chunked_upload.js', )
+
+    def render(self, name, value, attrs=None):
+        from django.core.urlresolvers import reverse
+        from django.utils.html import escape
+        from .settings import CHUNKED_UPLOAD_CHUNK_SIZE
+        html = super(ChunkedUploadWidget, self).render(name, value, attrs)
+        return mark_safe(
+            '<span class="loupe-chunked-upload" data-url="%s" data-chunk-size="%s" '
+            'data-model="%s">%s<input type="hidden" name="%s_upload" value="" />'
+            '<span class="loupe-upload-progress"></span></span>' % (
+                escape(reverse('loupe-chunked-upload-create')),
+                CHUNKED_UPLOAD_CHUNK_SIZE, escape(self.upload_model), html,
+                escape(name)))
+
+    def value_from_datadict(self, data, files, name):
+        upload_id = data.get("%s_upload" % name)
+        if upload_id:
+            return ChunkedUploadValue(upload_id)
+        return super(ChunkedUploadWidget, self).value_from_datadict(data, files, name)
+
+
+class ChunkedImageFormField(forms.FileField):
+    """
+    A file field that also accepts a completed chunked upload, and cleans to
+    the ``StoredUploadName`` it was stored under
+    """
+    default_error_messages = {
+        'incomplete_upload': _('The upload has not finished.'),
+    }
+
+    def __init__(self, *args, **kwargs):
+        upload_model = kwargs.pop('upload_model', '')
+        super(ChunkedImageFormField, self).__init__(*args, **kwargs)
+        if isinstance(self.widget, ChunkedUploadWidget):
+            self.widget.upload_model = upload_model
+
+    def clean(self, data, initial=None):
+        from .models import ChunkedUpload
+        if not isinstance(data, ChunkedUploadValue):
+            return super(ChunkedImageFormField, self).clean(data, initial)
+        try:
+            upload = ChunkedUpload.objects.get(upload_id=data.upload_id,
+                                               status='complete')
+        except ChunkedUpload.DoesNotExist:
+            raise forms.ValidationError(self.error_messages['incomplete_upload'])
+        name = StoredUploadName(upload.stored_name)
+        name.upload_id, name.tile_profile = upload.upload_id, upload.tile_profile
+        return name
+
+    def bound_data(self, data, initial):
+        if isinstance(data, ChunkedUploadValue):
+            return initial
+        return super(ChunkedImageFormField, self).bound_data(data, initial)
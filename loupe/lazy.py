@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Tiles of the deepest levels, which are rarely viewed, rendered from the
+source image when first requested and kept in a bounded disk cache
+"""
+import errno
+import hashlib
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .caching import LRUCache, cached_read
+
+SIZE_CACHE = LRUCache(256)
+
+
+class TileDiskCache(object):
+    """
+    A directory of rendered tiles holding no more than ``max_size`` bytes.
+    Reading a tile touches its modification time, and the least recently
+    used tiles are deleted when the cache grows too large.
+    """
+    def __init__(self, location, max_size):
+        self.location = location
+        self.max_size = max_size
+        self.size = None
+        self.lock = threading.Lock()
+
+    def get_path(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.location, digest[:2], digest)
+
+    def get(self, key):
+        path = self.get_path(key)
+        try:
+            tile_file = open(path, 'rb')
+        except IOError:
+            return None
+        try:
+            data = tile_file.read()
+        finally:
+            tile_file.close()
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return data
+
+    def set(self, key, data):
+        path = self.get_path(key)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            os.write(handle, data)
+        finally:
+            os.close(handle)
+        os.rename(temp_path, path)
+        with self.lock:
+            if self.size is None:
+                self.size = self.get_size()
+            else:
+                self.size += len(data)
+            if self.size > self.max_size:
+                self.evict()
+
+    def get_entries(self):
+        """
+        Return (modification time, size, path) of every cached tile
+        """
+        entries = []
+        for dirpath, dirnames, filenames in os.walk(self.location):
+            for filename in filenames:
+                if filename.endswith('.lock'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def get_size(self):
+        return sum(size for mtime, size, path in self.get_entries())
+
+    def evict(self):
+        """
+        Delete the least recently used tiles until the cache is back under
+        nine tenths of its size. Other processes share the directory, so its
+        size is measured again rather than trusted.
+        """
+        entries = sorted(self.get_entries())
+        self.size = sum(size for mtime, size, path in entries)
+        limit = self.max_size * 9 // 10
+        for mtime, size, path in entries:
+            if self.size <= limit:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.size -= size
+            try:
+                os.remove("%s.lock" % path)
+            except OSError:
+                pass
+
+
+_render_locks = {}
+_render_locks_lock = threading.Lock()
+
+
+@contextmanager
+def render_lock(cache, key):
+    """
+    Hold a lock on rendering ``key`` shared by the threads of this process
+    and, where ``fcntl`` is available, by other processes using the cache
+    """
+    with _render_locks_lock:
+        lock, users = _render_locks.get(key, (None, 0))
+        lock = lock or threading.Lock()
+        _render_locks[key] = (lock, users + 1)
+    lock.acquire()
+    lock_file = None
+    try:
+        if fcntl is not None:
+            lock_path = "%s.lock" % cache.get_path(key)
+            try:
+                os.makedirs(os.path.dirname(lock_path))
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            lock_file = open(lock_path, 'a')
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+    finally:
+        if lock_file is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+        lock.release()
+        with _render_locks_lock:
+            lock, users = _render_locks[key]
+            if users > 1:
+                _render_locks[key] = (lock, users - 1)
+            else:
+                del _render_locks[key]
+
+
+_disk_cache = None
+
+
+def get_disk_cache():
+    global _disk_cache
+    if _disk_cache is None:
+        from .settings import LAZY_TILE_CACHE_DIR, LAZY_TILE_CACHE_SIZE
+        location = LAZY_TILE_CACHE_DIR or os.path.join(
+            tempfile.gettempdir(), 'loupe-tiles')
+        _disk_cache = TileDiskCache(location, LAZY_TILE_CACHE_SIZE)
+    return _disk_cache
+
+
+def read_source_info(image_path):
+    """
+    Return the size of the source and whether regions of it can be read
+    """
+    from .tilers import open_image
+    from .tilers.readers import supports_region_reads
+    image = open_image(image_path)
+    try:
+        size = image.size
+    finally:
+        image.close()
+    return size, supports_region_reads(image_path)
+
+
+def is_lazy_level(field_file, level):
+    """
+    Return ``True`` if ``level`` of the image's tileset is rendered on demand.
+    Sources that are decoded whole have no lazy levels.
+    """
+    from .settings import LAZY_LEVELS
+    from .tilers import get_level_sizes
+    if not LAZY_LEVELS:
+        return False
+    try:
+        (width, height), region_reads = cached_read(
+            SIZE_CACHE, field_file.storage, field_file.name,
+            lambda: read_source_info(field_file.path))
+    except IOError:
+        return False
+    if not region_reads:
+        return False
+    return level > len(get_level_sizes(width, height)) - 1 - LAZY_LEVELS
+
+
+def get_lazy_tile(image, dest_name, level, column, row):
+    """
+    Return the tile of a lazily rendered level of the image's tileset, from
+    the disk cache or rendered from the source. Concurrent requests for the
+    same tile wait for one render. Returns ``None`` if the level is built
+    with the tileset or the tile does not exist.
+    """
+    from .caching import get_local_path
+    from .tilers.pillow import PillowTiler
+    if get_local_path(image.image.storage, image.image.name) is None:
+        return None
+    if not is_lazy_level(image.image, level):
+        return None
+    cache = get_disk_cache()
+    key = "%s/%s/%s/%s_%s" % (dest_name, image.tileset_version, level, column, row)
+    data = cache.get(key)
+    if data is not None:
+        return data
+    with render_lock(cache, key):
+        data = cache.get(key)
+        if data is None:
+            tiler = PillowTiler(profile=getattr(image, 'tile_profile', None))
+            data = tiler.render_tile(image.image.path, level, column, row)
+            if data is not None:
+                cache.set(key, data)
+    return data
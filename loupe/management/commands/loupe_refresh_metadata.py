@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+
+class Command(NoArgsCommand):
+    help = ("Fetch the descriptor of every external tileset and update its "
+            "metadata, and record the thumbnail of every image.")
+    option_list = NoArgsCommand.option_list + (
+        make_option('--threads',
+            type='int',
+            dest='threads',
+            default=None,
+            help='Number of descriptors to fetch at once.'),
+    )
+
+    def handle_noargs(self, **options):
+        from loupe.fetch import refresh_external_metadata
+        from loupe.models import get_loupe_models, refresh_thumbnail_fields
+
+        for model in get_loupe_models():
+            images = model.objects.exclude(external_tileset_url='').exclude(
+                external_tileset_url__isnull=True)
+            updated = refresh_external_metadata(images, options['threads'])
+            self.stdout.write("Updated %s %s.\n" % (
+                updated, model._meta.verbose_name_plural))
+            updated = refresh_thumbnail_fields(model)
+            self.stdout.write("Recorded the thumbnails of %s %s.\n" % (
+                updated, model._meta.verbose_name_plural))
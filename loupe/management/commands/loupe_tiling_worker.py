@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+
+class Command(NoArgsCommand):
+    help = "Run queued tiling jobs in this process as slots become free."
+    option_list = NoArgsCommand.option_list + (
+        make_option('--once',
+            action='store_true',
+            dest='once',
+            default=False,
+            help='Run the jobs that can run now and exit.'),
+        make_option('--interval',
+            type='int',
+            dest='interval',
+            default=10,
+            help='Seconds to wait between checks of the queue.'),
+    )
+
+    def handle_noargs(self, **options):
+        from loupe.executors import SyncExecutor
+        from loupe.scheduler import TilingScheduler
+
+        scheduler = TilingScheduler(SyncExecutor())
+        while True:
+            scheduler.dispatch()
+            if options['once']:
+                break
+            time.sleep(options['interval'])
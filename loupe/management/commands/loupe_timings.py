@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+
+def format_bytes(size):
+    if size is None:
+        return ''
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return "%.0f %s" % (size, unit)
+        size /= 1024.0
+    return "%.1f GB" % size
+
+
+class Command(BaseCommand):
+    args = '[name or slug ...]'
+    help = "Print the time taken by each stage of tiling the given images, or the most recent ones."
+    option_list = BaseCommand.option_list + (
+        make_option('--recent',
+            type='int',
+            dest='recent',
+            default=10,
+            help='Number of recent images to show when none are given.'),
+        make_option('--levels',
+            action='store_true',
+            dest='levels',
+            default=False,
+            help='Show each level of the tileset.'),
+        make_option('--prune',
+            type='int',
+            dest='prune',
+            default=None,
+            help='Delete the timings older than this many days instead.'),
+    )
+
+    def get_names(self, args, recent):
+        """
+        Return the stored names of the images given by name or slug, or of
+        the most recently measured images
+        """
+        from loupe.models import StageTiming, get_loupe_models
+
+        if not args:
+            names = []
+            for name in StageTiming.objects.exclude(stage='metadata').order_by(
+                    '-created').values_list('name', flat=True).iterator():
+                if name not in names:
+                    names.append(name)
+                if len(names) >= recent:
+                    break
+            return names
+        names = []
+        for arg in args:
+            for model in get_loupe_models():
+                names.extend([image.image.name for image in
+                              model._default_manager.filter(slug=arg)
+                              if image.image])
+            if arg not in names:
+                names.append(arg)
+        return names
+
+    def handle(self, *args, **options):
+        import datetime
+        from django.utils.timezone import now
+        from loupe.models import StageTiming
+
+        if options['prune'] is not None:
+            timings = StageTiming.objects.filter(
+                created__lt=now() - datetime.timedelta(days=options['prune']))
+            count = timings.count()
+            timings.delete()
+            self.stdout.write("Deleted %s timings.\n" % count)
+            return
+        for name in self.get_names(args, options['recent']):
+            timings = StageTiming.objects.filter(name=name)
+            if not options['levels']:
+                timings = timings.exclude(stage='level')
+            if not timings:
+                continue
+            self.stdout.write("%s\n" % name)
+            for timing in timings:
+                stage = timing.stage
+                if timing.level is not None:
+                    stage = "%s %s" % (stage, timing.level)
+                self.stdout.write("  %-19s %-12s %9s %10s  %s\n" % (
+                    timing.created.strftime('%Y-%m-%d %H:%M:%S'), stage,
+                    timing.duration is not None and "%.2fs" % timing.duration or '',
+                    format_bytes(timing.bytes),
+                    timing.success and 'ok' or timing.error))
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+A manifest of the digest of every tile in a tileset, so re-tiling a changed
+image only writes and transfers the tiles whose pixels changed
+"""
+import hashlib
+import json
+import os
+
+
+def get_manifest_path(dest_path):
+    return "%s.manifest" % dest_path
+
+
+def get_digest(data):
+    """
+    Return the hex digest of a string or of the shape and pixels of an array
+    """
+    digest = hashlib.sha1()
+    if hasattr(data, 'shape'):
+        digest.update(repr(data.shape).encode('ascii'))
+        data = data.tobytes()
+    digest.update(data)
+    return digest.hexdigest()
+
+
+class TilesetManifest(object):
+    """
+    Records the digest of each tile, keyed by its path within the
+    ``_files`` directory. A previous manifest is only compared against when
+    it was written with the same ``options``; otherwise every tile changes.
+    """
+    def __init__(self, dest_path, options=None):
+        self.dest_path = dest_path
+        self.options = options or {}
+        self.tiles = {}
+        self.changed = []
+        self.previous = {}
+        previous = self.load(dest_path)
+        if previous.get('options') == self.options:
+            self.previous = previous.get('tiles', {})
+
+    @staticmethod
+    def load(dest_path):
+        """
+        Return the contents of the tileset's manifest, or an empty dict
+        """
+        try:
+            manifest_file = open(get_manifest_path(dest_path))
+        except IOError:
+            return {}
+        try:
+            return json.load(manifest_file)
+        except ValueError:
+            return {}
+        finally:
+            manifest_file.close()
+
+    def get_tile_path(self, key):
+        return os.path.join("%s_files" % self.dest_path, key)
+
+    def update(self, key, digest):
+        """
+        Record the digest of a tile and return ``True`` if the tile needs to
+        be written
+        """
+        self.tiles[key] = digest
+        if self.previous.get(key) == digest and os.path.exists(self.get_tile_path(key)):
+            return False
+        self.changed.append(key)
+        return True
+
+    @property
+    def removed(self):
+        return sorted(set(self.previous) - set(self.tiles))
+
+    def save(self):
+        """
+        Delete the tiles that are no longer part of the tileset and write the
+        manifest
+        """
+        removed = self.removed
+        for key in removed:
+            path = self.get_tile_path(key)
+            if os.path.exists(path):
+                os.remove(path)
+            level_path = os.path.dirname(path)
+            if os.path.isdir(level_path) and not os.listdir(level_path):
+                os.rmdir(level_path)
+        manifest_file = open(get_manifest_path(self.dest_path), 'w')
+        try:
+            json.dump({
+                'options': self.options,
+                'tiles': self.tiles,
+                'changed': sorted(self.changed),
+                'removed': removed,
+            }, manifest_file)
+        finally:
+            manifest_file.close()
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Measurements of each stage of the tiling pipeline.
+
+``record`` sends the ``stage_recorded`` signal, passes the measurement to
+the collectors in ``METRICS_COLLECTORS`` and, with ``METRICS_LOG``, saves it
+as a ``StageTiming`` so the stages of an image can be reviewed later with
+the ``loupe_timings`` command.
+"""
+import logging
+import time
+from contextlib import contextmanager
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .signals import stage_recorded
+
+logger = logging.getLogger(__name__)
+
+# 'upload' stores the original, 'queued' adds a tiling job, 'waited' is the
+# time the job was queued, 'tiling' creates the tileset and 'level' one
+# level of it, 'thumbnail' creates the thumbnails, 'transfer' copies them
+# to remote storage and 'metadata' fetches an external descriptor
+STAGES = ('upload', 'queued', 'waited', 'tiling', 'level', 'thumbnail',
+          'transfer', 'metadata')
+
+
+class BaseCollector(object):
+    """
+    Subclasses send each measurement, a dict with the ``stage``, ``name``,
+    ``duration`` in seconds, ``bytes``, ``success``, ``error``, a fixed
+    ``reason`` code for failures and any extra values of the stage, to a
+    metrics service
+    """
+    def record(self, measurement):
+        raise NotImplementedError
+
+
+class StatsdCollector(BaseCollector):
+    """
+    Sends timers, byte counts, failures and the queue depth to StatsD with
+    the ``statsd`` package
+    """
+    def __init__(self):
+        try:
+            import statsd
+        except ImportError:
+            raise ImproperlyConfigured("The StatsD collector needs the statsd package.")
+        from .settings import METRICS_STATSD_HOST, METRICS_STATSD_PORT, METRICS_PREFIX
+        self.client = statsd.StatsClient(METRICS_STATSD_HOST, METRICS_STATSD_PORT,
+                                         prefix=METRICS_PREFIX)
+
+    def record(self, measurement):
+        stage = measurement['stage']
+        if measurement['duration'] is not None:
+            self.client.timing("%s.duration" % stage, measurement['duration'] * 1000)
+        if measurement['bytes'] is not None:
+            self.client.incr("%s.bytes" % stage, measurement['bytes'])
+        if not measurement['success']:
+            self.client.incr("%s.failed" % stage)
+        if measurement.get('queue_depth') is not None:
+            self.client.gauge('queue_depth', measurement['queue_depth'])
+
+
+class PrometheusCollector(BaseCollector):
+    """
+    Updates ``prometheus_client`` metrics in this process, labelled by
+    stage. Expose them with ``prometheus_client.start_http_server`` or a view.
+    """
+    metrics = None
+
+    def __init__(self):
+        try:
+            import prometheus_client
+        except ImportError:
+            raise ImproperlyConfigured("The Prometheus collector needs the prometheus_client package.")
+        from .settings import METRICS_PREFIX
+        # Metrics can only be registered once per process
+        if PrometheusCollector.metrics is None:
+            PrometheusCollector.metrics = {
+                'duration': prometheus_client.Histogram(
+                    '%s_stage_seconds' % METRICS_PREFIX,
+                    'Seconds taken by each stage', ['stage']),
+                'bytes': prometheus_client.Counter(
+                    '%s_stage_bytes' % METRICS_PREFIX,
+                    'Bytes written by each stage', ['stage']),
+                'failed': prometheus_client.Counter(
+                    '%s_stage_failures' % METRICS_PREFIX,
+                    'Failures of each stage', ['stage', 'reason']),
+                'queue_depth': prometheus_client.Gauge(
+                    '%s_queue_depth' % METRICS_PREFIX,
+                    'Tiling jobs waiting to run'),
+            }
+
+    def record(self, measurement):
+        metrics, stage = self.metrics, measurement['stage']
+        if measurement['duration'] is not None:
+            metrics['duration'].labels(stage).observe(measurement['duration'])
+        if measurement['bytes'] is not None:
+            metrics['bytes'].labels(stage).inc(measurement['bytes'])
+        if not measurement['success']:
+            # Error messages name files and URLs, so they would add a
+            # series per failure
+            metrics['failed'].labels(stage, measurement['reason']).inc()
+        if measurement.get('queue_depth') is not None:
+            metrics['queue_depth'].set(measurement['queue_depth'])
+
+
+COLLECTORS = {
+    'statsd': StatsdCollector,
+    'prometheus': PrometheusCollector,
+}
+
+_collectors = None
+
+
+def get_collectors():
+    """
+    Return instances of the collectors in ``METRICS_COLLECTORS``
+    """
+    global _collectors
+    if _collectors is None:
+        from django.utils.importlib import import_module
+        from .settings import METRICS_COLLECTORS
+        collectors = []
+        for name in METRICS_COLLECTORS:
+            if name in COLLECTORS:
+                collectors.append(COLLECTORS[name]())
+            else:
+                module_name, class_name = name.rsplit('.', 1)
+                collectors.append(getattr(import_module(module_name), class_name)())
+        _collectors = collectors
+    return _collectors
+
+
+def record(stage, name='', duration=None, bytes=None, success=True, error='',
+           reason='', **extra):
+    """
+    Record a measurement of ``stage`` for the stored file or URL ``name``.
+    ``reason`` is a short code for a failure, ``'failed'`` by default.
+    A failing collector or log is logged rather than failing the stage.
+    """
+    from .settings import METRICS_LOG
+    if not success:
+        reason = reason or 'failed'
+    measurement = dict(extra, stage=stage, name=name, duration=duration,
+                       bytes=bytes, success=success, error=error or '',
+                       reason=reason or '')
+    stage_recorded.send(sender=stage, **measurement)
+    for collector in get_collectors():
+        try:
+            collector.record(measurement)
+        except Exception as e:
+            logger.error("Unable to record %s metrics: %s" % (stage, e))
+    if METRICS_LOG:
+        try:
+            from .models import StageTiming
+            StageTiming.objects.create(
+                name=name[:255], stage=stage, level=extra.get('level'),
+                job_id=extra.get('job'), duration=duration, bytes=bytes,
+                success=success, error=error or '')
+        except Exception as e:
+            logger.error("Unable to log %s timing: %s" % (stage, e))
+    return measurement
+
+
+@contextmanager
+def timed(stage, name='', **extra):
+    """
+    Record the duration of a ``with`` block. Set ``bytes``, ``success``,
+    ``error`` or ``reason`` on the yielded dict to record them too. An
+    exception is recorded as a failure with its class name as the reason,
+    and raised again.
+    """
+    values = {'bytes': None, 'success': True, 'error': '', 'reason': ''}
+    values.update(extra)
+    start = time.time()
+    try:
+        yield values
+    except Exception as e:
+        values.update(success=False, error=values['error'] or "%s" % e,
+                      reason=values['reason'] or e.__class__.__name__)
+        record(stage, name, duration=time.time() - start, **values)
+        raise
+    record(stage, name, duration=time.time() - start, **values)
@@ -1,11 +1,14 @@
 # -*- coding: utf-8 -*-
 import os
+from django import VERSION as DJANGO_VERSION
+from django.conf import settings
 from django.db import models
 from django.core.urlresolvers import reverse
+from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 from dirtyfields import DirtyFieldsMixin
 
-from .settings import STORAGE, QUEUED_STORAGE_TASK
+from .settings import STORAGE, QUEUED_STORAGE_TASK, TILE_PROFILES
 from .fields import LargeImageField
 
 if QUEUED_STORAGE_TASK:
@@ -13,6 +16,41 @@ if QUEUED_STORAGE_TASK:
 else:
     IMAGE_STORAGE = STORAGE()
 
+TILESET_STATUS_CHOICES = (
+    ('pending', _('Pending')),
+    ('tiling', _('Tiling')),
+    ('ready', _('Ready')),
+    ('failed', _('Failed')),
+)
+
+TILING_JOB_STATUS_CHOICES = (
+    ('queued', _('Queued')),
+    ('running', _('Running')),
+    ('done', _('Done')),
+    ('failed', _('Failed')),
+)
+
+CHUNKED_UPLOAD_STATUS_CHOICES = (
+    ('uploading', _('Uploading')),
+    ('storing', _('Storing')),
+    ('complete', _('Complete')),
+    ('saved', _('Saved')),
+    ('failed', _('Failed')),
+)
+
+TILESET_STATUS_FOR_JOB = {
+    'queued': 'pending',
+    'running': 'tiling',
+    'done': 'ready',
+    'failed': 'failed',
+}
+
+TILE_PROFILE_CHOICES = [(profile, profile) for profile in sorted(TILE_PROFILES)]
+
+# Columns derived from the tileset's descriptor
+METADATA_FIELDS = ('image_height', 'image_width', 'tile_size', 'tile_overlap',
+    'tile_format', 'level_count', 'base_tile_url')
+
 
 def slug_upload_to(instance, filename):
     """
@@ -63,6 +101,22 @@ class BaseLoupeImage(DirtyFieldsMixin, models.Model):
         max_length=255,
         blank=True, null=True,
         editable=False)
+    tile_overlap = models.IntegerField(_('tile overlap'),
+        default=0,
+        editable=False)
+    tile_format = models.CharField(_('tile format'),
+        max_length=10,
+        blank=True, null=True,
+        editable=False)
+    level_count = models.IntegerField(_('level count'),
+        blank=True, null=True,
+        editable=False)
+    tile_profile = models.CharField(_('tile profile'),
+        max_length=50,
+        blank=True,
+        default='',
+        choices=TILE_PROFILE_CHOICES,
+        help_text=_('How the tiles are encoded. Leave blank for the default.'))
     thumbnail = models.FileField(_('thumbnail'), upload_to="loupe_thumbs", blank=True, null=True)
     document_name = models.CharField(_('document name'),
         max_length=255,
@@ -71,39 +125,117 @@ class BaseLoupeImage(DirtyFieldsMixin, models.Model):
     document_order = models.IntegerField(_('document order'),
         blank=True, null=True,
         help_text=_('The order in which this image appears in the document.'))
+    tileset_status = models.CharField(_('tileset status'),
+        max_length=10,
+        choices=TILESET_STATUS_CHOICES,
+        default='ready',
+        editable=False)
+    tileset_version = models.IntegerField(_('tileset version'),
+        default=0,
+        editable=False)
+    has_thumbnail = models.BooleanField(_('has thumbnail'),
+        default=False,
+        editable=False)
+    thumbnail_url = models.CharField(_('thumbnail URL'),
+        max_length=255,
+        blank=True,
+        default='',
+        editable=False)
+    updated = models.DateTimeField(_('updated'),
+        auto_now=True,
+        editable=False)
 
     @property
     def tileset_url(self):
         """
         Return the appropriate url for this object's tiles
         """
-        if self.image:
+        from .settings import TILE_LAYOUT, TILE_SERVING, LAZY_LEVELS
+        if self.image and (TILE_LAYOUT == 'packed' or TILE_SERVING == 'view' or
+                           LAZY_LEVELS):
+            return "'%s'" % reverse('loupeimage-dzi-version', kwargs={
+                'slug': self.slug, 'version': self.tileset_version})
+        elif self.image:
             return "'%s.dzi'" % os.path.splitext(self.image.url)[0]
         else:
             return self.external_tileset_url
 
+    @property
+    def tiles_url(self):
+        """
+        Return the URL the tiles of an uploaded image's tileset are under.
+        Like ``tileset_url`` it follows the image's current URL, which changes
+        when a queued storage has transferred it.
+        """
+        from .settings import TILE_LAYOUT, TILE_SERVING, LAZY_LEVELS
+        if TILE_LAYOUT == 'packed' or TILE_SERVING == 'view' or LAZY_LEVELS:
+            return "%s_files/" % reverse('loupeimage-dzi-version', kwargs={
+                'slug': self.slug, 'version': self.tileset_version})[:-4]
+        return "%s_files/" % os.path.splitext(self.image.url)[0]
+
     @property
     def tileset_source(self):
-        if self.external_tileset_type == 'zoomify':
+        """
+        Return the OpenSeadragon tile source, from the cached metadata where
+        possible so the viewer doesn't fetch the descriptor again
+        """
+        import json
+        from .descriptors import DZI_XMLNS
+        tile_type = self.external_tileset_type
+        if tile_type == 'zoomify':
             return """{width: %s, height: %s, tilesUrl: "%s", type: "zoomify"}""" % (self.image_width, self.image_height, self.external_tileset_url)
+        elif tile_type == 'tms' and self.image_width:
+            return json.dumps({'type': 'tiledmapservice',
+                'width': self.image_width, 'height': self.image_height,
+                'tilesUrl': self.base_tile_url})
+        elif tile_type == 'osm':
+            return json.dumps({'type': 'openstreetmaps', 'tilesUrl': self.base_tile_url})
+        elif tile_type == 'dzi' and self.image_width and self.base_tile_url:
+            return json.dumps({'Image': {
+                'xmlns': DZI_XMLNS,
+                'Url': self.base_tile_url,
+                'Format': self.tile_format or 'jpg',
+                'Overlap': self.tile_overlap,
+                'TileSize': self.tile_size,
+                'Size': {'Width': self.image_width, 'Height': self.image_height}}})
+        elif self.image and self.image_width and self.tile_size:
+            return json.dumps({'Image': {
+                'xmlns': DZI_XMLNS,
+                'Url': self.tiles_url,
+                'Format': self.tile_format or 'jpg',
+                'Overlap': self.tile_overlap,
+                'TileSize': self.tile_size,
+                'Size': {'Width': self.image_width, 'Height': self.image_height}}})
         else:
             return self.tileset_url
 
     class Meta:
         abstract = True
+        if DJANGO_VERSION >= (1, 5):
+            index_together = [('document_name', 'document_order')]
 
-    def render(self):
+    def get_template_names(self):
         """
-        return the rendered template to display this item in a webpage
+        return the templates that may display this item, in order
         """
-        from django.utils.safestring import mark_safe
-        from django.template.loader import render_to_string
         base_template_name = "%s/%s_%%s.html" % (
             self._meta.app_label, self.__class__.__name__.lower())
         template_selection = [base_template_name % 'default', ]
-        if self.external_tileset_url:
+        if self.image and self.tileset_status != 'ready':
+            template_selection = [
+                base_template_name % self.tileset_status,
+                'loupe/tileset_unavailable.html']
+        elif self.external_tileset_url:
             template_selection.insert(0, base_template_name % self.external_tileset_type)
-        return mark_safe(render_to_string(template_selection, {'object': self}))
+        return template_selection
+
+    def render(self):
+        """
+        return the rendered template to display this item in a webpage. The
+        HTML is cached until the item is saved again.
+        """
+        from .rendering import render_image
+        return render_image(self)
 
     def clean(self):
         """
@@ -118,45 +250,204 @@ class BaseLoupeImage(DirtyFieldsMixin, models.Model):
         elif self.external_tileset_url and not self.external_tileset_type:
             raise ValidationError(_("Please select an external tileset type when using an external tileset."))
 
-    def update_metadata(self):
+    def update_metadata(self, commit=True):
         """
-        Update the tileset's metadata fields by getting the URL and parsing it
+        Update the tileset's metadata fields by getting the URL and parsing it.
+        With ``commit``, only the metadata columns of a saved image are written.
+        Returns the ``TilesetMetadata``, or ``None`` when it can't be read.
         """
-        import tileset
-        if self.external_tileset_type:
-            tile_type = self.external_tileset_type
-        else:
-            tile_type = 'local'
+        from .descriptors import get_metadata, get_local_metadata, DescriptorError
         try:
-            metadata_func = getattr(tileset, 'get_%s_metadata' % tile_type)
-            metadata = metadata_func(self.tileset_url)
-
-            self.image_height = metadata.get('height')
-            self.image_width = metadata.get('width')
-            self.tile_size = metadata.get('tilesize')
-            self.base_tile_url = metadata.get('base_tile_url')
-            self.save()
-        except AttributeError:
-            pass
+            if self.external_tileset_type:
+                metadata = get_metadata(self.external_tileset_type,
+                                        self.external_tileset_url)
+            else:
+                metadata = get_local_metadata(self.image)
+        except (DescriptorError, IOError):
+            return None
+        self.set_metadata(metadata)
+        if commit and self.pk:
+            self.updated = now()
+            self.__class__._default_manager.filter(pk=self.pk).update(
+                updated=self.updated,
+                **dict((name, getattr(self, name)) for name in METADATA_FIELDS))
+        return metadata
+
+    def create_external_thumbnail(self, metadata=None):
+        """
+        Make a thumbnail from the smallest level of the external tileset,
+        without saving the image. The tileset's ``metadata`` defaults to the
+        metadata fields.
+        """
+        from .descriptors import DescriptorError
+        from .download_external_img import create_external_thumbnail
+        if metadata is None and self.external_tileset_type != 'lip':
+            # The URL of each level of a LIP tileset isn't kept, so it is
+            # fetched again
+            metadata = self.get_metadata()
+        try:
+            filename, size, content = create_external_thumbnail(
+                self.external_tileset_type, self.external_tileset_url,
+                metadata=metadata)
+        except (DescriptorError, IOError):
+            return
+        self.thumbnail.save(filename, content, save=False)
+
+    def set_metadata(self, metadata):
+        """
+        Copy a ``TilesetMetadata`` to the metadata fields
+        """
+        self.image_height = metadata.height
+        self.image_width = metadata.width
+        self.tile_size = metadata.tile_size
+        self.tile_overlap = metadata.overlap
+        self.tile_format = metadata.format
+        self.level_count = metadata.level_count
+        self.base_tile_url = metadata.base_tile_url
+
+    def get_metadata(self):
+        """
+        Return the cached metadata as a ``TilesetMetadata``, or ``None`` if it
+        hasn't been fetched
+        """
+        from .descriptors import TilesetMetadata, get_halved_levels
+        if not self.image_width or not self.image_height:
+            return None
+        levels = None
+        if self.external_tileset_type == 'zoomify':
+            levels = get_halved_levels(self.image_width, self.image_height,
+                                       self.tile_size, round_up=False)
+        return TilesetMetadata(self.image_width, self.image_height,
+            self.tile_size, self.tile_overlap, self.tile_format or 'jpg',
+            self.base_tile_url or '', levels)
+
+    def set_aside_previous_image(self, previous):
+        """
+        When a file with the same name as the previous image is uploaded,
+        move the previous original aside so the new file is stored in its
+        place and only the tiles that changed are written again. It is deleted
+        once the image is saved. Returns what the storage needs to put it
+        back, or ``None``.
+        """
+        from .settings import INCREMENTAL_TILING
+        if not INCREMENTAL_TILING or not previous or not self.image:
+            return None
+        if self.image._committed or previous.name == self.image.name:
+            return None
+        if not hasattr(previous.storage, 'set_aside'):
+            return None
+        if os.path.basename(previous.name) == os.path.basename(self.image.name):
+            return previous.storage.set_aside(previous.name)
+        return None
+
+    def release_image(self, image):
+        """
+        Give up this image's reference to the stored ``image``, deleting it
+        and its tileset when no other image shares it
+        """
+        if image and hasattr(image.storage, 'release'):
+            image.storage.release(image.name)
+
+    def sync_tileset_status(self):
+        """
+        Record the status of the tiling job of a newly stored image again
+        once its row exists. A job that finished while the row was written
+        changed the status of no rows.
+        """
+        get_status = getattr(self.image.storage, 'get_tileset_status', None)
+        if get_status is None:
+            return
+        status = get_status(self.image.name)
+        if status != self.tileset_status:
+            self.tileset_status = status
+            update_tileset_status(sender=self.__class__, name=self.image.name,
+                                  status=status)
 
     def save(self, *args, **kwargs):
         """
-        Update the metadata if the imageurl changes
+        Fetch the metadata and thumbnail of a changed external tileset before
+        writing, so the image is saved once. The metadata of an uploaded image
+        is set by its field as the file is stored. A new tile profile tiles
+        the stored image again.
         """
-        update_metadata = (
-            "image" in self.dirty_fields or
+        # Versions of dirtyfields differ on what is dirty before the first
+        # save, so a new image is decided by its primary key
+        new = not self.pk
+        external_changed = new or (
             "external_tileset_type" in self.dirty_fields or
             "external_tileset_url" in self.dirty_fields)
-        super(BaseLoupeImage, self).save(*args, **kwargs)
-        if update_metadata:
-            self.update_metadata()
+        retile = (not new and self.image and self.image._committed and
+                  "tile_profile" in self.dirty_fields and
+                  "image" not in self.dirty_fields)
+        previous = aside = None
+        if not new and "image" in self.dirty_fields:
+            previous = self.dirty_fields['image']
+            aside = self.set_aside_previous_image(previous)
+        if retile:
+            self.update_metadata(commit=False)
+        if self.external_tileset_url:
+            metadata = None
+            if external_changed:
+                metadata = self.update_metadata(commit=False)
+            if not self.thumbnail:
+                self.create_external_thumbnail(metadata)
+        thumbnail_removed = (not new and not self.thumbnail and
+                             "thumbnail" in self.dirty_fields)
+        if self.thumbnail and ("thumbnail" in self.dirty_fields or not self.has_thumbnail):
+            self.has_thumbnail = True
+            self.thumbnail_url = self.thumbnail.url
+        elif thumbnail_removed:
+            self.has_thumbnail = False
+            self.thumbnail_url = ''
+        if self.pk:
+            from .rendering import forget_rendered
+            forget_rendered(self)
+        stored = bool(self.image) and (not self.image._committed or
+                                       hasattr(self.image, 'stored_upload'))
+        try:
+            super(BaseLoupeImage, self).save(*args, **kwargs)
+        except Exception:
+            if aside:
+                previous.storage.put_back(previous.name, aside, self.tile_profile)
+            raise
+        if stored:
+            self.sync_tileset_status()
+        if aside:
+            previous.storage.discard(previous.name, aside)
+        elif previous and (stored or previous.name != self.image.name):
+            # An identical upload may have been given the previous name, and
+            # counted as another reference to it
+            self.release_image(previous)
+        if thumbnail_removed and self.image and not stored:
+            # Fall back to the thumbnail made from the image
+            update_thumbnail_fields(self.image.name, self.image.storage)
+        if retile and hasattr(self.image.storage, 'change_tile_profile'):
+            self.change_tile_profile()
+        elif retile and hasattr(self.image.storage, 'retile'):
+            self.image.storage.retile(self.image.name, self.tile_profile)
+
+    def change_tile_profile(self):
+        """
+        Tile the stored image with the new tile profile. An image shared with
+        other images is given its own copy, or one already tiled with the
+        profile, so their tileset is left alone.
+        """
+        storage = self.image.storage
+        name = storage.change_tile_profile(self.image.name, self.tile_profile)
+        if name == self.image.name:
+            return
+        self.image.name = name
+        self.__class__._default_manager.filter(pk=self.pk).update(image=name)
+        self.sync_tileset_status()
+        self.update_metadata()
+        update_thumbnail_fields(name, storage)
 
     def __unicode__(self):
         return self.name
 
 
 class LoupeImage(BaseLoupeImage):
-    class Meta:
+    class Meta(BaseLoupeImage.Meta):
         verbose_name = _('Loupe Image')
         verbose_name_plural = _('Loupe Images')
 
@@ -164,18 +455,218 @@ class LoupeImage(BaseLoupeImage):
         return reverse('loupeimage-detail', kwargs={'slug': self.slug})
 
 
-from django.db.models.signals import post_save
-from django.dispatch import receiver
+class TilingJob(models.Model):
+    """
+    A queued request to create the tileset for a stored image
+    """
+    image_path = models.CharField(_('image path'), max_length=255)
+    name = models.CharField(_('name'), max_length=255, db_index=True)
+    status = models.CharField(_('status'),
+        max_length=10,
+        choices=TILING_JOB_STATUS_CHOICES,
+        default='queued',
+        db_index=True)
+    priority = models.IntegerField(_('priority'), default=0)
+    attempts = models.IntegerField(_('attempts'), default=0)
+    estimated_memory = models.BigIntegerField(_('estimated memory'), default=0)
+    next_attempt = models.DateTimeField(_('next attempt'), default=now)
+    created = models.DateTimeField(_('created'), default=now)
+    started = models.DateTimeField(_('started'), blank=True, null=True)
+    finished = models.DateTimeField(_('finished'), blank=True, null=True)
+    error = models.TextField(_('error'), blank=True)
+    tile_profile = models.CharField(_('tile profile'),
+        max_length=50,
+        blank=True,
+        default='')
 
+    class Meta:
+        ordering = ('-priority', 'created')
+        verbose_name = _('Tiling Job')
+        verbose_name_plural = _('Tiling Jobs')
 
-@receiver(post_save, sender=LoupeImage)
-def create_external_thumbnail(sender, instance, created, raw, using, *args, **kwargs):
-    if instance.external_tileset_url and not hasattr(instance.thumbnail, 'file'):
-        try:
-            import tileset
+    @property
+    def tileset_status(self):
+        """
+        The status of the image's tileset while this job is its latest
+        """
+        return TILESET_STATUS_FOR_JOB[self.status]
+
+    def __unicode__(self):
+        return self.name
+
+
+class StoredImage(models.Model):
+    """
+    An uploaded image stored once for each tile profile, by the SHA-256
+    digest of its contents, and the number of images sharing it and its
+    tileset
+    """
+    name = models.CharField(_('name'), max_length=255, unique=True)
+    digest = models.CharField(_('digest'), max_length=64)
+    tile_profile = models.CharField(_('tile profile'), max_length=50, blank=True, default='')
+    size = models.BigIntegerField(_('size'), default=0)
+    references = models.PositiveIntegerField(_('references'), default=1)
+    created = models.DateTimeField(_('created'), default=now)
+
+    class Meta:
+        verbose_name = _('Stored Image')
+        verbose_name_plural = _('Stored Images')
+        unique_together = (('digest', 'tile_profile'), )
+
+    def __unicode__(self):
+        return self.name
 
-            thumbnail_func = getattr(tileset, 'create_%s_thumbnail' % instance.external_tileset_type)
-            filename, size, content = thumbnail_func(instance.tileset_url)
-            instance.thumbnail.save(filename, content)
-        except AttributeError:
+
+class ChunkedUpload(models.Model):
+    """
+    An image being uploaded in chunks, and how much of it was received
+    """
+    upload_id = models.CharField(_('upload ID'), max_length=32, unique=True)
+    user = models.ForeignKey(getattr(settings, 'AUTH_USER_MODEL', 'auth.User'),
+        blank=True, null=True)
+    filename = models.CharField(_('file name'), max_length=255)
+    size = models.BigIntegerField(_('size'))
+    offset = models.BigIntegerField(_('bytes received'), default=0)
+    checksum = models.CharField(_('SHA-256 checksum'), max_length=64, blank=True)
+    slug = models.CharField(_('slug'), max_length=255, blank=True)
+    model = models.CharField(_('model'), max_length=100, blank=True)
+    tile_profile = models.CharField(_('tile profile'), max_length=50, blank=True, default='')
+    status = models.CharField(_('status'),
+        max_length=10,
+        choices=CHUNKED_UPLOAD_STATUS_CHOICES,
+        default='uploading')
+    stored_name = models.CharField(_('stored name'), max_length=255, blank=True)
+    created = models.DateTimeField(_('created'), default=now)
+    updated = models.DateTimeField(_('updated'), default=now, db_index=True)
+
+    class Meta:
+        verbose_name = _('Chunked Upload')
+        verbose_name_plural = _('Chunked Uploads')
+
+    @property
+    def path(self):
+        """
+        The partial file the chunks are written to
+        """
+        from .uploads import get_upload_dir
+        return os.path.join(get_upload_dir(), "%s.part" % self.upload_id)
+
+    def delete_file(self):
+        try:
+            os.remove(self.path)
+        except OSError:
             pass
+
+    def __unicode__(self):
+        return self.filename
+
+
+class StageTiming(models.Model):
+    """
+    The measurement of one stage of the tiling pipeline for a stored image,
+    or for an external descriptor's URL
+    """
+    name = models.CharField(_('name'), max_length=255, db_index=True)
+    stage = models.CharField(_('stage'), max_length=20)
+    level = models.IntegerField(_('level'), blank=True, null=True)
+    job = models.ForeignKey(TilingJob, blank=True, null=True,
+        on_delete=models.SET_NULL)
+    duration = models.FloatField(_('duration'), blank=True, null=True)
+    bytes = models.BigIntegerField(_('bytes'), blank=True, null=True)
+    success = models.BooleanField(_('success'), default=True)
+    error = models.TextField(_('error'), blank=True)
+    created = models.DateTimeField(_('created'), default=now, db_index=True)
+
+    class Meta:
+        ordering = ('created', 'pk')
+        verbose_name = _('Stage Timing')
+        verbose_name_plural = _('Stage Timings')
+
+    def __unicode__(self):
+        return "%s %s" % (self.name, self.stage)
+
+
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .signals import tileset_status_changed
+
+
+def get_loupe_models(cls=BaseLoupeImage):
+    """
+    Return all the concrete subclasses of ``BaseLoupeImage``
+    """
+    models_list = []
+    for subclass in cls.__subclasses__():
+        if not subclass._meta.abstract:
+            models_list.append(subclass)
+        models_list.extend(get_loupe_models(subclass))
+    return models_list
+
+
+@receiver(post_delete)
+def release_deleted_image(sender, instance, **kwargs):
+    """
+    Give up a deleted image's reference to its stored image
+    """
+    if isinstance(instance, BaseLoupeImage):
+        instance.release_image(instance.image)
+
+
+@receiver(tileset_status_changed)
+def update_tileset_status(sender, name, status, **kwargs):
+    """
+    Record the tileset status on every image using the stored file ``name``.
+    A new version of a tileset gets new URLs so the old one can be cached
+    forever.
+    """
+    from django.db.models import F
+    values = {'tileset_status': status, 'updated': now()}
+    if status == 'ready':
+        values['tileset_version'] = F('tileset_version') + 1
+    for model in get_loupe_models():
+        model._default_manager.filter(image=name).update(**values)
+    if status == 'ready':
+        update_thumbnail_fields(name)
+
+
+def update_thumbnail_fields(name, storage=None):
+    """
+    Record whether the thumbnail made from the stored file ``name`` exists,
+    and its URL, on every image using the file, so listing images makes no
+    storage calls. ``storage`` defaults to the storage of each image field.
+    """
+    from django.db.models import Q
+    from .tileset import get_thumbnail_path
+    thumbnail_name = get_thumbnail_path(name)
+    for model in get_loupe_models():
+        # Thumbnails uploaded to the thumbnail field take precedence
+        images = model._default_manager.filter(image=name).filter(
+            Q(thumbnail='') | Q(thumbnail__isnull=True))
+        if not images.exists():
+            continue
+        model_storage = storage or model._meta.get_field('image').storage
+        exists = model_storage.exists(thumbnail_name)
+        images.update(has_thumbnail=exists, updated=now(),
+            thumbnail_url=exists and model_storage.url(thumbnail_name) or '')
+
+
+def refresh_thumbnail_fields(model):
+    """
+    Record the thumbnail fields of every image of ``model``, such as the
+    images saved before they existed. Returns the number of images updated.
+    """
+    from django.db.models import Q
+    updated = 0
+    for image in model._default_manager.exclude(
+            Q(thumbnail='') | Q(thumbnail__isnull=True)).iterator():
+        updated += model._default_manager.filter(pk=image.pk).update(
+            has_thumbnail=True, thumbnail_url=image.thumbnail.url)
+    names = model._default_manager.exclude(
+        Q(image='') | Q(image__isnull=True)).filter(
+        Q(thumbnail='') | Q(thumbnail__isnull=True)).values_list(
+        'image', flat=True).distinct()
+    for name in names:
+        update_thumbnail_fields(name)
+        updated += model._default_manager.filter(image=name).count()
+    return updated
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+The progress of tiling each stored image, kept in the cache named by
+``PROGRESS_CACHE`` so it can be read cheaply while a worker tiles the image
+"""
+import hashlib
+import time
+
+# The part of the overall progress each stage covers
+STAGE_SPANS = {
+    'queued': (0.0, 0.0),
+    'tiling': (0.0, 0.9),
+    'thumbnail': (0.9, 0.95),
+    'transfer': (0.95, 1.0),
+}
+
+
+def get_progress_cache():
+    from django.core.cache import get_cache
+    from .settings import PROGRESS_CACHE
+    return get_cache(PROGRESS_CACHE)
+
+
+def get_progress_key(name):
+    return "loupe.progress:%s" % hashlib.md5(name.encode('utf-8')).hexdigest()
+
+
+def set_progress(name, stage, fraction=0.0):
+    """
+    Record that the stored file ``name`` is ``fraction`` of the way through
+    ``stage``
+    """
+    from .settings import PROGRESS_TIMEOUT
+    start, end = STAGE_SPANS.get(stage, (0.0, 1.0))
+    fraction = min(max(fraction, 0.0), 1.0)
+    get_progress_cache().set(get_progress_key(name), {
+        'stage': stage,
+        'stage_progress': fraction,
+        'progress': start + (end - start) * fraction,
+        'updated': time.time(),
+    }, PROGRESS_TIMEOUT)
+
+
+def get_progress(name):
+    """
+    Return the progress of the stored file ``name`` as a dict with its
+    ``stage``, ``stage_progress`` and overall ``progress``, or ``None``
+    """
+    return get_progress_cache().get(get_progress_key(name))
+
+
+def clear_progress(name):
+    get_progress_cache().delete(get_progress_key(name))
+
+
+class ProgressReporter(object):
+    """
+    Called with the fraction of ``stage`` done, and records it at most every
+    ``interval`` seconds
+    """
+    def __init__(self, name, stage, interval=1.0):
+        self.name = name
+        self.stage = stage
+        self.interval = interval
+        self.last = 0
+        set_progress(name, stage, 0.0)
+
+    def __call__(self, fraction):
+        now = time.time()
+        if fraction < 1 and now - self.last < self.interval:
+            return
+        self.last = now
+        set_progress(self.name, self.stage, fraction)
+
+    def transfer(self, files_done, total, bytes_done, rate):
+        """
+        The progress callback of a ``TilesetTransfer``
+        """
+        self(total and float(files_done) / total or 1.0)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Reads whole levels of a tileset already written to local storage, so small
+derivatives of an image can be made without decoding the original again
+"""
+import os
+from io import BytesIO
+
+from PIL import Image
+
+from .descriptors import parse_dzi, DescriptorError
+from .tilers import get_level_sizes, get_tile_span
+
+
+class PyramidReader(object):
+    """
+    Reads the levels of the tileset ``<dest_path>.dzi``, from its loose
+    tiles or its archive
+    """
+    def __init__(self, dest_path):
+        from django.core.files.storage import FileSystemStorage
+        self.dest_path = dest_path
+        self.storage = FileSystemStorage(location=os.path.dirname(dest_path))
+        self.dest_name = os.path.basename(dest_path)
+        dzi_file = open("%s.dzi" % dest_path, 'rb')
+        try:
+            self.metadata = parse_dzi(dzi_file.read(), "%s.dzi" % dest_path)
+        finally:
+            dzi_file.close()
+        self.sizes = get_level_sizes(self.metadata.width, self.metadata.height)
+
+    def get_level_for(self, width, height=None):
+        """
+        Return the smallest level that still covers the image fitted within
+        ``width`` by ``height``, or the full size level of a smaller image.
+        Without ``height`` the box is square.
+        """
+        height = height or width
+        scale = min(float(width) / self.metadata.width,
+                    float(height) / self.metadata.height)
+        needed = (self.metadata.width * scale, self.metadata.height * scale)
+        for level, (level_width, level_height) in enumerate(self.sizes):
+            if level_width >= needed[0] - 0.5 and level_height >= needed[1] - 0.5:
+                return level
+        return len(self.sizes) - 1
+
+    def read_level(self, level):
+        """
+        Return the level as an image, or ``None`` if any of its tiles are
+        missing
+        """
+        from .archive import get_tile_data
+        width, height = self.sizes[level]
+        tile_size, overlap = self.metadata.tile_size, self.metadata.overlap
+        image = None
+        for row in range(-(-height // tile_size)):
+            top = get_tile_span(row, tile_size, overlap, height)[0]
+            for column in range(-(-width // tile_size)):
+                left = get_tile_span(column, tile_size, overlap, width)[0]
+                key = "%s/%s_%s.%s" % (level, column, row, self.metadata.format)
+                data = get_tile_data(self.storage, self.dest_name, key)
+                if data is None:
+                    return None
+                tile = Image.open(BytesIO(data))
+                if image is None:
+                    image = Image.new(tile.mode, (width, height))
+                image.paste(tile, (left, top))
+        return image
+
+    def thumbnail(self, width, height=None):
+        """
+        Return an image fitted within ``width`` by ``height``, reduced from
+        the smallest level large enough, or ``None``
+        """
+        from .tilers.pillow import RESAMPLE
+        height = height or width
+        image = self.read_level(self.get_level_for(width, height))
+        if image is not None:
+            image.thumbnail((width, height), RESAMPLE)
+        return image
+
+
+def create_pyramid_thumbnails(dest_path, sizes):
+    """
+    Write a JPEG thumbnail for each ``(path, size)`` in ``sizes`` from the
+    tileset. Returns ``False`` if the tileset could not be read.
+    """
+    try:
+        reader = PyramidReader(dest_path)
+    except (IOError, OSError, DescriptorError):
+        return False
+    for path, size in sizes:
+        image = reader.thumbnail(size)
+        if image is None:
+            return False
+        if image.mode not in ('L', 'RGB'):
+            image = image.convert('RGB')
+        image.save(path, 'JPEG', quality=90)
+    return True
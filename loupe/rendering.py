@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Renders the viewers of images, caching the HTML by the image's primary key,
+its last update and the template used. Saving an image changes its
+``updated`` time, so its cached HTML is no longer used.
+"""
+from django.utils.safestring import mark_safe
+
+from .caching import MemoryCache
+
+_cache = None
+
+
+def get_render_cache():
+    """
+    Return the Django cache named by ``RENDER_CACHE``, or one in memory
+    """
+    global _cache
+    if _cache is None:
+        from .settings import RENDER_CACHE
+        if RENDER_CACHE:
+            from django.core.cache import get_cache
+            _cache = get_cache(RENDER_CACHE)
+        else:
+            _cache = MemoryCache(1000)
+    return _cache
+
+
+def get_render_key(image, template_names):
+    """
+    Return the cache key of the image rendered with the first of
+    ``template_names``, or ``None`` if it can't be cached
+    """
+    if not image.pk or not image.updated:
+        return None
+    return "loupe.render:%s.%s:%s:%s:%s" % (
+        image._meta.app_label, image._meta.object_name.lower(), image.pk,
+        image.updated.strftime('%Y%m%d%H%M%S%f'), template_names[0])
+
+
+def render_with(template, image):
+    from django.template import Context
+    return template.render(Context({'object': image}))
+
+
+def render_image(image):
+    """
+    Return the image's viewer, from the cache when it is there
+    """
+    from django.template.loader import select_template
+    from .settings import RENDER_CACHE_TIMEOUT
+    template_names = image.get_template_names()
+    key = get_render_key(image, template_names)
+    cache = get_render_cache()
+    html = key and cache.get(key)
+    if not html:
+        html = render_with(select_template(template_names), image)
+        if key:
+            cache.set(key, html, RENDER_CACHE_TIMEOUT)
+    return mark_safe(html)
+
+
+def forget_rendered(image):
+    """
+    Remove the image's cached viewer. Its ``updated`` time changes when it is
+    saved, but databases without fractions of seconds may store the same one.
+    """
+    key = get_render_key(image, image.get_template_names())
+    if key:
+        get_render_cache().delete(key)
+
+
+def render_many(images):
+    """
+    Return the viewers of ``images``, in order. The cached viewers are read
+    in one call, and each template is looked up once for the images
+    missing from the cache.
+    """
+    from django.template.loader import select_template
+    from .settings import RENDER_CACHE_TIMEOUT
+    images = list(images)
+    cache = get_render_cache()
+    names = [image.get_template_names() for image in images]
+    keys = [get_render_key(image, template_names)
+            for image, template_names in zip(images, names)]
+    cached = cache.get_many([key for key in keys if key])
+    templates = {}
+    rendered = {}
+    results = []
+    for image, template_names, key in zip(images, names, keys):
+        html = key and cached.get(key)
+        if not html:
+            template_names = tuple(template_names)
+            if template_names not in templates:
+                templates[template_names] = select_template(template_names)
+            html = render_with(templates[template_names], image)
+            if key:
+                rendered[key] = html
+        results.append(mark_safe(html))
+    if rendered:
+        cache.set_many(rendered, RENDER_CACHE_TIMEOUT)
+    return results
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+A bounded scheduler for tiling jobs queued in the database
+"""
+import datetime
+import logging
+
+from django.db.models import F, Sum
+from django.utils.timezone import now
+
+from .signals import tileset_status_changed
+
+logger = logging.getLogger(__name__)
+
+
+class TilingScheduler(object):
+    """
+    Runs queued tiling jobs, highest priority first, while no more than
+    ``TILING_MAX_JOBS`` are running and their estimated memory fits within
+    ``TILING_MEMORY_LIMIT``. A job larger than the limit runs on its own.
+    """
+    def __init__(self, executor=None):
+        from . import settings
+        self.executor = executor
+        self.max_jobs = settings.TILING_MAX_JOBS
+        self.memory_limit = settings.TILING_MEMORY_LIMIT
+        self.max_attempts = settings.TILING_MAX_ATTEMPTS
+        self.retry_delay = settings.TILING_RETRY_DELAY
+        self.job_timeout = settings.TILING_JOB_TIMEOUT
+
+    def submit(self, image_path, name, priority=0, dispatch=True, tile_profile=''):
+        """
+        Queue the tiling of ``image_path``, stored as ``name``, and run as
+        many queued jobs as the limits allow
+        """
+        from .metrics import record
+        from .models import TilingJob
+        from .progress import set_progress
+        from .tileset import estimate_tiling_memory
+
+        queued = list(TilingJob.objects.filter(name=name, status='queued')[:1])
+        if queued:
+            job = queued[0]
+            if priority > job.priority or tile_profile != job.tile_profile:
+                job.priority = max(priority, job.priority)
+                job.tile_profile = tile_profile
+                job.save()
+        else:
+            job = TilingJob.objects.create(
+                image_path=image_path,
+                name=name,
+                priority=priority,
+                tile_profile=tile_profile,
+                estimated_memory=estimate_tiling_memory(image_path))
+            set_progress(name, 'queued')
+            tileset_status_changed.send(sender=self.__class__, name=name,
+                                        status=job.tileset_status)
+            record('queued', name, job=job.pk,
+                   queue_depth=TilingJob.objects.filter(status='queued').count())
+        if dispatch:
+            self.dispatch()
+        return job
+
+    def latest_job(self, name):
+        """
+        Return the most recent job for the stored file ``name``, or ``None``
+        """
+        from .models import TilingJob
+        jobs = list(TilingJob.objects.filter(name=name).order_by('-pk')[:1])
+        return jobs and jobs[0] or None
+
+    def requeue_stale(self):
+        """
+        Put jobs back in the queue whose worker went away while running them
+        """
+        from .models import TilingJob
+        cutoff = now() - datetime.timedelta(seconds=self.job_timeout)
+        TilingJob.objects.filter(status='running', started__lt=cutoff).update(
+            status='queued', next_attempt=now())
+
+    def claim(self, job=None):
+        """
+        Mark queued jobs, or just ``job``, as running while they fit within
+        the limits and return them. A job is only claimed by one caller, but
+        concurrent callers may briefly exceed the limits.
+        """
+        from .models import TilingJob
+
+        running = TilingJob.objects.filter(status='running')
+        num_running = running.count()
+        memory = running.aggregate(total=Sum('estimated_memory'))['total'] or 0
+        if job is None:
+            candidates = TilingJob.objects.filter(
+                status='queued', next_attempt__lte=now()).iterator()
+        else:
+            candidates = [job]
+
+        claimed = []
+        for candidate in candidates:
+            if num_running >= self.max_jobs:
+                break
+            if num_running and memory + candidate.estimated_memory > self.memory_limit:
+                continue
+            updated = TilingJob.objects.filter(
+                pk=candidate.pk, status='queued').update(
+                    status='running',
+                    started=now(),
+                    attempts=F('attempts') + 1)
+            if updated:
+                claimed.append(candidate)
+                num_running += 1
+                memory += candidate.estimated_memory
+        return claimed
+
+    def dispatch(self):
+        """
+        Hand every job that can run now to the executor
+        """
+        from .executors import get_executor
+        executor = self.executor or get_executor()
+        self.requeue_stale()
+        jobs = self.claim()
+        while jobs:
+            for job in jobs:
+                executor.submit(job.pk)
+            jobs = self.claim()
+
+    def run_now(self, job):
+        """
+        Run just ``job`` in this process if it fits within the limits.
+        Otherwise it stays queued until a worker or the next dispatch runs it.
+        """
+        if self.claim(job):
+            self.run(job.pk)
+            return True
+        logger.warning("No tiling slot is free, '%s' stays queued." % job.name)
+        return False
+
+    def run(self, job_id):
+        """
+        Create the tileset and thumbnail for a claimed job. Failed jobs are
+        queued again with an exponential backoff until they run out of
+        attempts.
+        """
+        from .metrics import record, timed
+        from .models import TilingJob
+        from .progress import ProgressReporter, clear_progress, set_progress
+        from .tileset import create_tileset, create_thumbnail
+
+        job = TilingJob.objects.get(pk=job_id)
+        tileset_status_changed.send(sender=self.__class__, name=job.name,
+                                    status=job.tileset_status)
+        if job.started:
+            record('waited', job.name, job=job.pk,
+                   duration=(job.started - job.next_attempt).total_seconds())
+        error = ''
+        try:
+            with timed('tiling', job.name, job=job.pk) as measurement:
+                if create_tileset(job.image_path, job.tile_profile, job.name, job.pk,
+                                  ProgressReporter(job.name, 'tiling')) != 0:
+                    error = "Unable to create a tileset."
+                    measurement.update(success=False, error=error)
+            if not error:
+                set_progress(job.name, 'thumbnail')
+                with timed('thumbnail', job.name, job=job.pk) as measurement:
+                    if create_thumbnail(job.image_path) != 0:
+                        logger.error("Unable to create a thumbnail for '%s'." % job.name)
+                        measurement.update(success=False,
+                                           error="Unable to create a thumbnail.")
+                set_progress(job.name, 'thumbnail', 1.0)
+        except Exception as e:
+            logger.exception(e)
+            error = "%s" % e
+
+        job.error = error
+        job.finished = now()
+        if not error:
+            job.status = 'done'
+            # A transfer to remote storage reports its own progress
+            clear_progress(job.name)
+        elif job.attempts < self.max_attempts:
+            logger.error("%s '%s' will be retried." % (error, job.name))
+            job.status = 'queued'
+            delay = self.retry_delay * 2 ** (job.attempts - 1)
+            job.next_attempt = now() + datetime.timedelta(seconds=delay)
+            set_progress(job.name, 'queued')
+        else:
+            logger.error("%s Giving up on '%s'." % (error, job.name))
+            job.status = 'failed'
+            clear_progress(job.name)
+        job.save()
+        tileset_status_changed.send(sender=self.__class__, name=job.name,
+                                    status=job.tileset_status)
+        return job
+
+
+def run_tiling_job(job_id):
+    """
+    Run a claimed job. A module level function so it can be sent to a
+    process pool.
+    """
+    return TilingScheduler().run(job_id).status
+
+
+def dispatch_tiling_jobs(*args):
+    """
+    Run whatever jobs can run now
+    """
+    TilingScheduler().dispatch()
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP responses for tiles and descriptors that caches and proxies can reuse
+"""
+import hashlib
+import json
+import re
+
+from django.http import HttpResponse, HttpResponseNotModified
+
+from .caching import LRUCache, cached_read, get_local_path
+from .manifest import get_manifest_path
+from .settings import (TILE_CACHE_MAX_AGE, TILE_SENDFILE,
+    TILE_ACCEL_REDIRECT_PREFIX, TILE_MEMORY_CACHE_SIZE)
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+MANIFEST_CACHE = LRUCache(8)
+TILE_CACHE = LRUCache(TILE_MEMORY_CACHE_SIZE, sizeof=lambda value: len(value[1]))
+
+
+def get_tile_digests(storage, dest_name):
+    """
+    Return the digest of every tile from the tileset's manifest
+    """
+    name = get_manifest_path(dest_name)
+
+    def load():
+        try:
+            manifest = storage.open(name)
+        except (IOError, OSError):
+            return {}
+        try:
+            return json.loads(manifest.read()).get('tiles', {})
+        except ValueError:
+            return {}
+        finally:
+            manifest.close()
+    return cached_read(MANIFEST_CACHE, storage, name, load)
+
+
+def get_etag(digest, version=None):
+    """
+    Return the ETag of a tile from the digest of its pixels. The same pixels
+    are encoded again by a new tile profile, so the ``version`` of the
+    tileset is part of it.
+    """
+    if version is None:
+        return '"%s"' % digest
+    return '"%s-%s"' % (digest, version)
+
+
+def get_data_etag(data):
+    return get_etag(hashlib.sha1(data).hexdigest())
+
+
+def get_range(request, etag, length):
+    """
+    Return the (start, end) of a single byte range requested, or ``None`` for
+    the whole content. Raises ``ValueError`` if the range can't be satisfied.
+    """
+    header = request.META.get('HTTP_RANGE', '')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    match = RANGE_RE.match(header)
+    if not match or (if_range and if_range != etag):
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        start, end = max(length - int(end), 0), length - 1
+    else:
+        start, end = int(start), min(int(end or length - 1), length - 1)
+    if start > end:
+        raise ValueError("Unsatisfiable range")
+    return start, end
+
+
+def set_cache_headers(response, etag, immutable):
+    response['ETag'] = etag
+    if immutable:
+        response['Cache-Control'] = 'public, max-age=%s, immutable' % IMMUTABLE_MAX_AGE
+    else:
+        response['Cache-Control'] = 'public, max-age=%s' % TILE_CACHE_MAX_AGE
+    return response
+
+
+def not_modified(request, etag):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return etag in tags or '*' in tags
+
+
+def serve_data(request, data, etag, content_type, immutable=False):
+    """
+    Respond with ``data``, a 304 when the client's copy matches ``etag``, or
+    the part of ``data`` in a single requested byte range
+    """
+    if not_modified(request, etag):
+        return set_cache_headers(HttpResponseNotModified(), etag, immutable)
+    try:
+        byte_range = get_range(request, etag, len(data))
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */%s' % len(data)
+        return response
+    if byte_range is None:
+        response = HttpResponse(data, content_type=content_type)
+    else:
+        start, end = byte_range
+        response = HttpResponse(data[start:end + 1], content_type=content_type, status=206)
+        response['Content-Range'] = 'bytes %s-%s/%s' % (start, end, len(data))
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Length'] = str(len(response.content))
+    return set_cache_headers(response, etag, immutable)
+
+
+def serve_file(request, storage, name, etag, content_type, immutable=False):
+    """
+    Respond with the file ``name``, letting the web server send it when
+    ``TILE_SENDFILE`` is set and the file is local. Returns ``None`` if the
+    file does not exist.
+    """
+    if not_modified(request, etag):
+        return set_cache_headers(HttpResponseNotModified(), etag, immutable)
+    path = get_local_path(storage, name)
+    if TILE_SENDFILE and path is not None:
+        if not storage.exists(name):
+            return None
+        response = HttpResponse(content_type=content_type)
+        if TILE_SENDFILE == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = "%s%s" % (TILE_ACCEL_REDIRECT_PREFIX, name)
+        else:
+            response['X-Sendfile'] = path
+        return set_cache_headers(response, etag, immutable)
+    try:
+        tile_file = storage.open(name)
+    except (IOError, OSError):
+        return None
+    try:
+        data = tile_file.read()
+    finally:
+        tile_file.close()
+    return serve_data(request, data, etag, content_type, immutable)
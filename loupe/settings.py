@@ -7,6 +7,89 @@ DEFAULT_SETTINGS = {
     'IMAGE_STORAGE': 'loupe.storage.FileSystemTilesetStorage',
     'QUEUED_STORAGE_TASK': '',
     'THUMB_SIZE': 200,
+    # Additional thumbnails as {'name': size}
+    'THUMBNAIL_SIZES': {},
+    # Formats resized copies of images may be requested in
+    'DERIVATIVE_FORMATS': ('jpg', 'png', 'webp', 'avif'),
+    'DERIVATIVE_QUALITY': 85,
+    'DERIVATIVE_MAX_SIZE': 4096,
+    # Limits on the external images thumbnails are made from
+    'THUMBNAIL_MAX_BYTES': 50 * 1024 * 1024,
+    'THUMBNAIL_MAX_PIXELS': 100 * 1000 * 1000,
+    'TILER': 'loupe.tilers.vips.VipsTiler',
+    # Tile encodings by name. Options not given are taken from
+    # loupe.tilers.PROFILE_DEFAULTS
+    'TILE_PROFILES': {
+        'jpeg': {},
+        'jpeg-hq': {'quality': 95, 'subsampling': '4:4:4'},
+        'webp': {'format': 'webp', 'quality': 80},
+        'avif': {'format': 'avif', 'quality': 60},
+        'lossless': {'format': 'png'},
+    },
+    'TILE_PROFILE': 'jpeg',
+    'TILE_SIZE': 254,
+    'TILE_OVERLAP': 1,
+    'TILE_STREAMING': True,
+    'INCREMENTAL_TILING': True,
+    # Store an upload identical to a stored image once and share its tileset
+    'DEDUPLICATE_UPLOADS': True,
+    # '' keeps partial chunked uploads in the system's temporary directory
+    'CHUNKED_UPLOAD_DIR': '',
+    'CHUNKED_UPLOAD_CHUNK_SIZE': 8 * 1024 ** 2,
+    # Seconds an unfinished or unused chunked upload is kept
+    'CHUNKED_UPLOAD_EXPIRY': 24 * 60 * 60,
+    'TRANSFER_THREADS': 8,
+    # 'files' writes one file per tile, 'packed' writes tile archives
+    'TILE_LAYOUT': 'files',
+    'TILE_ARCHIVE_PER_LEVEL': False,
+    # 'storage' links to tiles in storage, 'view' serves them with loupe.urls
+    'TILE_SERVING': 'storage',
+    # Seconds tiles may be cached when their URL is not versioned
+    'TILE_CACHE_MAX_AGE': 300,
+    # '', 'x-sendfile' or 'x-accel-redirect'
+    'TILE_SENDFILE': '',
+    'TILE_ACCEL_REDIRECT_PREFIX': '/protected/',
+    'TILE_MEMORY_CACHE_SIZE': 64 * 1024 * 1024,
+    'TILE_MEMORY_CACHE_MAX_LEVEL': 10,
+    # Number of deepest levels the Pillow tiler leaves to be rendered on demand
+    'LAZY_LEVELS': 0,
+    # '' uses a directory in the system's temporary directory
+    'LAZY_TILE_CACHE_DIR': '',
+    'LAZY_TILE_CACHE_SIZE': 1024 ** 3,
+    # Name of the Django cache for external descriptors, '' caches in memory
+    'METADATA_CACHE': '',
+    # Seconds a fetched descriptor is used before it is revalidated
+    'METADATA_MAX_AGE': 60 * 60,
+    'METADATA_TIMEOUT': 10,
+    # Name of the Django cache for rendered viewers, '' caches in memory
+    'RENDER_CACHE': '',
+    'RENDER_CACHE_TIMEOUT': 24 * 60 * 60,
+    # Name of the Django cache shared by the workers and the web server that
+    # holds the progress of each tiling
+    'PROGRESS_CACHE': 'default',
+    # Seconds the progress is kept after it was last reported
+    'PROGRESS_TIMEOUT': 60 * 60,
+    # 'statsd', 'prometheus' or dotted paths to loupe.metrics.BaseCollector
+    # subclasses
+    'METRICS_COLLECTORS': (),
+    # Save the timing of each stage in the database for loupe_timings
+    'METRICS_LOG': False,
+    'METRICS_PREFIX': 'loupe',
+    'METRICS_STATSD_HOST': 'localhost',
+    'METRICS_STATSD_PORT': 8125,
+    # 'sync' tiles inside Storage.save, 'deferred' hands it to an executor
+    'TILING_MODE': 'sync',
+    # '' picks 'celery' when available, otherwise 'process'. Also accepts
+    # 'sync' or the dotted path to an executor class
+    'TILING_EXECUTOR': '',
+    'TILING_PROCESSES': 2,
+    'TILING_MAX_JOBS': 2,
+    'TILING_MEMORY_LIMIT': 2 * 1024 ** 3,
+    'TILING_MAX_ATTEMPTS': 3,
+    # Seconds before the first retry, doubled for each further attempt
+    'TILING_RETRY_DELAY': 60,
+    # Seconds after which a running job is assumed lost and queued again
+    'TILING_JOB_TIMEOUT': 6 * 60 * 60,
 }
 
 USER_SETTINGS = DEFAULT_SETTINGS.copy()
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+from django.dispatch import Signal
+
+# Sent when the tileset for the stored file ``name`` changes status. The
+# status is one of 'pending', 'tiling', 'ready' or 'failed'
+tileset_status_changed = Signal(providing_args=['name', 'status'])
+
+# Sent with the measurement of a stage of the tiling pipeline. The sender is
+# the stage, one of loupe.metrics.STAGES
+stage_recorded = Signal(providing_args=[
+    'stage', 'name', 'duration', 'bytes', 'success', 'error'])
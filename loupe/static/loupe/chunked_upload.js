@@ -0,0 +1,239 @@
+/**
+ * Resumable chunked uploads for django-loupe's LargeImageField.
+ *
+ * When a file is chosen it is sent one chunk at a time, each with its
+ * SHA-256 checksum when the browser can compute it. A failed chunk is sent
+ * again after a pause, and choosing the same file again after the page was
+ * closed resumes from the last chunk the server received. Once the server
+ * has stored the file the form only sends the upload's ID.
+ */
+(function( window, document ){
+
+var MAX_DELAY = 30000;
+
+function getCsrfToken( form ){
+    var input = form && form.querySelector( '[name=csrfmiddlewaretoken]' ),
+        match = document.cookie.match( /(?:^|;\s*)csrftoken=([^;]+)/ );
+    return input ? input.value : ( match ? match[ 1 ] : '' );
+}
+
+function request( method, url, headers, body, callback ){
+    var xhr = new XMLHttpRequest(), name, state;
+    xhr.open( method, url, true );
+    for( name in headers ){
+        if( headers.hasOwnProperty( name ) ){
+            xhr.setRequestHeader( name, headers[ name ] );
+        }
+    }
+    xhr.onload = function(){
+        try {
+            state = JSON.parse( xhr.responseText );
+        } catch( e ){
+            state = null;
+        }
+        callback( xhr.status, state );
+    };
+    xhr.onerror = function(){
+        callback( 0, null );
+    };
+    xhr.send( body );
+}
+
+function checksum( blob, callback ){
+    var crypto = window.crypto;
+    if( !crypto || !crypto.subtle || !window.FileReader ){
+        callback( '' );
+        return;
+    }
+    var reader = new window.FileReader();
+    reader.onload = function(){
+        crypto.subtle.digest( 'SHA-256', reader.result ).then( function( digest ){
+            var bytes = new Uint8Array( digest ), hex = '', i;
+            for( i = 0; i < bytes.length; i++ ){
+                hex += ( bytes[ i ] < 16 ? '0' : '' ) + bytes[ i ].toString( 16 );
+            }
+            callback( hex );
+        }, function(){
+            callback( '' );
+        });
+    };
+    reader.onerror = function(){
+        callback( '' );
+    };
+    reader.readAsArrayBuffer( blob );
+}
+
+function Upload( element ){
+    this.element = element;
+    this.input = element.querySelector( 'input[type=file]' );
+    this.hidden = element.querySelector( 'input[type=hidden]' );
+    this.status = element.querySelector( '.loupe-upload-progress' );
+    this.form = this.input.form;
+    this.url = element.getAttribute( 'data-url' );
+    this.chunkSize = parseInt( element.getAttribute( 'data-chunk-size' ), 10 );
+    this.model = element.getAttribute( 'data-model' );
+    this.uploading = false;
+    this.delay = 1000;
+
+    var self = this;
+    this.input.addEventListener( 'change', function(){
+        if( self.input.files && self.input.files.length ){
+            self.start( self.input.files[ 0 ] );
+        }
+    });
+    if( this.form ){
+        this.form.addEventListener( 'submit', function( event ){
+            if( self.uploading ){
+                event.preventDefault();
+                self.show( 'Wait for the upload to finish.' );
+            }
+        });
+    }
+}
+
+Upload.prototype.show = function( message ){
+    this.status.textContent = ' ' + message;
+};
+
+Upload.prototype.headers = function( extra ){
+    var headers = { 'X-CSRFToken': getCsrfToken( this.form ) }, name;
+    for( name in extra ){
+        if( extra.hasOwnProperty( name ) ){
+            headers[ name ] = extra[ name ];
+        }
+    }
+    return headers;
+};
+
+Upload.prototype.start = function( file ){
+    var self = this,
+        saved = window.localStorage && window.localStorage.getItem( this.key( file ) );
+    this.file = file;
+    this.uploading = true;
+    this.hidden.value = '';
+    if( saved ){
+        request( 'GET', this.url + saved + '/', {}, null, function( status, state ){
+            if( status === 200 && state.status !== 'failed' ){
+                self.resume( state );
+            } else {
+                self.create();
+            }
+        });
+    } else {
+        this.create();
+    }
+};
+
+Upload.prototype.key = function( file ){
+    return 'loupe-upload:' + file.name + ':' + file.size + ':' + file.lastModified;
+};
+
+Upload.prototype.create = function(){
+    var self = this,
+        data = new window.FormData(),
+        slug = this.form && this.form.querySelector( '[name=slug]' ),
+        profile = this.form && this.form.querySelector( '[name=tile_profile]' );
+    data.append( 'filename', this.file.name );
+    data.append( 'size', this.file.size );
+    data.append( 'model', this.model );
+    data.append( 'slug', slug ? slug.value : '' );
+    data.append( 'tile_profile', profile ? profile.value : '' );
+    request( 'POST', this.url, this.headers(), data, function( status, state ){
+        if( status === 201 ){
+            if( window.localStorage ){
+                window.localStorage.setItem( self.key( self.file ), state.id );
+            }
+            self.resume( state );
+        } else if( status >= 400 && status < 500 ){
+            self.fail( state ? state.error : 'Unable to upload.' );
+        } else {
+            self.retry( function(){ self.create(); } );
+        }
+    });
+};
+
+Upload.prototype.resume = function( state ){
+    var self = this, end, blob;
+    this.state = state;
+    if( state.status === 'complete' ){
+        this.finish();
+        return;
+    }
+    if( state.status !== 'uploading' ){
+        this.retry( function(){ self.refresh(); } );
+        return;
+    }
+    end = Math.min( state.offset + this.chunkSize, state.size );
+    blob = this.file.slice( state.offset, end );
+    this.show( Math.floor( state.offset * 100 / state.size ) + '%' );
+    checksum( blob, function( digest ){
+        var headers = { 'Content-Range': 'bytes ' + state.offset + '-' + ( end - 1 ) + '/' + state.size };
+        if( digest ){
+            headers[ 'X-Chunk-Checksum' ] = digest;
+        }
+        request( 'PUT', self.url + state.id + '/', self.headers( headers ), blob,
+            function( status, next ){
+                if( status === 200 || ( status === 409 && next && next.status !== 'failed' ) ){
+                    self.delay = 1000;
+                    self.resume( next );
+                } else if( status === 400 && next && next.status !== 'failed' ){
+                    self.retry( function(){ self.resume( next ); } );
+                } else if( status >= 400 && status < 500 ){
+                    self.fail( next ? next.error : 'Unable to upload.' );
+                } else {
+                    self.retry( function(){ self.refresh(); } );
+                }
+            });
+    });
+};
+
+Upload.prototype.refresh = function(){
+    var self = this;
+    request( 'GET', this.url + this.state.id + '/', {}, null, function( status, state ){
+        if( status === 200 ){
+            self.resume( state );
+        } else {
+            self.retry( function(){ self.refresh(); } );
+        }
+    });
+};
+
+Upload.prototype.retry = function( callback ){
+    this.show( 'Connection lost, retrying...' );
+    window.setTimeout( callback, this.delay );
+    this.delay = Math.min( this.delay * 2, MAX_DELAY );
+};
+
+Upload.prototype.finish = function(){
+    this.uploading = false;
+    this.hidden.value = this.state.id;
+    // The file is already stored, so it isn't sent with the form
+    this.input.disabled = true;
+    if( window.localStorage ){
+        window.localStorage.removeItem( this.key( this.file ) );
+    }
+    this.show( 'Uploaded' );
+};
+
+Upload.prototype.fail = function( message ){
+    this.uploading = false;
+    if( window.localStorage ){
+        window.localStorage.removeItem( this.key( this.file ) );
+    }
+    this.show( message );
+};
+
+function start(){
+    var elements = document.querySelectorAll( '.loupe-chunked-upload' ), i;
+    for( i = 0; i < elements.length; i++ ){
+        new Upload( elements[ i ] );
+    }
+}
+
+if( document.readyState === 'loading' ){
+    document.addEventListener( 'DOMContentLoaded', start );
+} else {
+    start();
+}
+
+}( window, document ));
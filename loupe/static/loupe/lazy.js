@@ -0,0 +1,130 @@
+/**
+ * Lazy viewers for django-loupe.
+ *
+ * Viewers register themselves by pushing {id, tileSources} onto
+ * window.loupeViewers. Each is shown as its thumbnail until it scrolls into
+ * view or is clicked, and OpenSeadragon is only loaded when the first one is
+ * opened. A gallery has one viewer, and clicking an item opens its tile
+ * source in it.
+ */
+(function( window, document ){
+
+var script = document.getElementById( 'loupe-lazy-js' ),
+    libraries = script.getAttribute( 'data-libraries' ).split( ' ' ),
+    prefixUrl = script.getAttribute( 'data-prefix-url' ),
+    loaded = false,
+    waiting = null,
+    configs = {},
+    observer = null;
+
+function loadScripts( urls, callback ){
+    if( !urls.length ){
+        callback();
+        return;
+    }
+    var element = document.createElement( 'script' );
+    element.src = urls[ 0 ];
+    element.onload = function(){
+        loadScripts( urls.slice( 1 ), callback );
+    };
+    document.getElementsByTagName( 'head' )[ 0 ].appendChild( element );
+}
+
+function withOpenSeadragon( callback ){
+    if( loaded ){
+        callback();
+        return;
+    }
+    if( waiting ){
+        waiting.push( callback );
+        return;
+    }
+    waiting = [ callback ];
+    loadScripts( window.OpenSeadragon ? libraries.slice( 1 ) : libraries, function(){
+        var callbacks = waiting, i;
+        loaded = true;
+        waiting = null;
+        for( i = 0; i < callbacks.length; i++ ){
+            callbacks[ i ]();
+        }
+    });
+}
+
+function open( config, index ){
+    if( index !== undefined && index !== config.index ){
+        config.index = index;
+        if( config.viewer ){
+            config.viewer.open( config.tileSources[ index ] );
+        }
+    }
+    if( config.viewer ){
+        return;
+    }
+    if( config.opening ){
+        return;
+    }
+    config.opening = true;
+    if( observer ){
+        observer.unobserve( document.getElementById( config.id ) );
+    }
+    withOpenSeadragon( function(){
+        var element = document.getElementById( config.id ),
+            placeholder = element.querySelector( '.loupe-placeholder' );
+        config.viewer = window.OpenSeadragon({
+            id: config.id + '-viewer',
+            prefixUrl: prefixUrl,
+            tileSources: config.tileSources[ config.index ]
+        });
+        if( placeholder ){
+            placeholder.parentNode.removeChild( placeholder );
+        }
+    });
+}
+
+function getIndex( target, element ){
+    while( target && target !== element ){
+        if( target.getAttribute && target.getAttribute( 'data-loupe-index' ) !== null ){
+            return parseInt( target.getAttribute( 'data-loupe-index' ), 10 );
+        }
+        target = target.parentNode;
+    }
+    return undefined;
+}
+
+function register( config ){
+    var element = document.getElementById( config.id );
+    if( !element || configs[ config.id ] ){
+        return;
+    }
+    config.index = 0;
+    configs[ config.id ] = config;
+    element.addEventListener( 'click', function( event ){
+        var index = getIndex( event.target, element );
+        if( index !== undefined ){
+            event.preventDefault();
+        }
+        open( config, index );
+    });
+    if( !( 'IntersectionObserver' in window ) ){
+        open( config );
+    } else {
+        if( !observer ){
+            observer = new window.IntersectionObserver( function( entries ){
+                for( var i = 0; i < entries.length; i++ ){
+                    if( entries[ i ].isIntersecting ){
+                        open( configs[ entries[ i ].target.id ] );
+                    }
+                }
+            }, { rootMargin: '200px' });
+        }
+        observer.observe( element );
+    }
+}
+
+var queued = window.loupeViewers || [];
+window.loupeViewers = { push: register };
+for( var i = 0; i < queued.length; i++ ){
+    register( queued[ i ] );
+}
+
+}( window, document ));
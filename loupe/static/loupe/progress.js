@@ -0,0 +1,52 @@
+/**
+ * Tiling progress for the django-loupe admin.
+ *
+ * Polls the status URL of each element with a data-loupe-status attribute
+ * and shows the status and percentage done until the tileset is ready and
+ * transferred, or has failed.
+ */
+(function( window, document ){
+
+var INTERVAL = 2000,
+    LABELS = {
+        pending: 'Pending',
+        tiling: 'Tiling',
+        ready: 'Ready',
+        failed: 'Failed'
+    };
+
+function poll( element ){
+    var request = new XMLHttpRequest();
+    request.open( 'GET', element.getAttribute( 'data-loupe-status' ), true );
+    request.onload = function(){
+        var status;
+        if( request.status !== 200 ){
+            return;
+        }
+        status = JSON.parse( request.responseText );
+        element.textContent = LABELS[ status.status ] || status.status;
+        if( status.status === 'pending' || status.status === 'tiling' ||
+                ( status.status === 'ready' && status.progress < 1 ) ){
+            if( status.progress ){
+                element.textContent += ' ' + Math.floor( status.progress * 100 ) + '%';
+            }
+            window.setTimeout( function(){ poll( element ); }, INTERVAL );
+        }
+    };
+    request.send();
+}
+
+function start(){
+    var elements = document.querySelectorAll( '[data-loupe-status]' ), i;
+    for( i = 0; i < elements.length; i++ ){
+        poll( elements[ i ] );
+    }
+}
+
+if( document.readyState === 'loading' ){
+    document.addEventListener( 'DOMContentLoaded', start );
+} else {
+    start();
+}
+
+})( window, document );
@@ -1,18 +1,279 @@
+import hashlib
+import os
+
+from django.core.files import File
 from django.core.files.storage import Storage, FileSystemStorage
 
-from .tileset import create_tileset, create_thumbnail
+
+class HashingFile(File):
+    """
+    Wraps ``content`` to compute the SHA-256 digest of its chunks while the
+    storage writes them, so the upload is only read once
+    """
+    def __init__(self, content):
+        super(HashingFile, self).__init__(content, getattr(content, 'name', None))
+        self.hash = hashlib.sha256()
+        self.hashed = 0
+
+    def chunks(self, chunk_size=None):
+        self.hash = hashlib.sha256()
+        self.hashed = 0
+        for chunk in self.file.chunks(chunk_size):
+            self.hash.update(chunk)
+            self.hashed += len(chunk)
+            yield chunk
+
+
+def get_content_digest(content):
+    """
+    Return the digest already computed for ``content``, such as by a
+    resumable upload, or ``None``
+    """
+    return (getattr(content, 'digest', None) or
+            getattr(getattr(content, 'file', None), 'digest', None))
 
 
 class TilesetStorage(Storage):
+    def __init__(self, *args, **kwargs):
+        """
+        ``deferred`` leaves the tiling to the executor instead of tiling within
+        ``save``. It defaults to the ``TILING_MODE`` setting.
+        """
+        from .settings import TILING_MODE
+        self.deferred = kwargs.pop('deferred', TILING_MODE == 'deferred')
+        super(TilesetStorage, self).__init__(*args, **kwargs)
+
     def save(self, name, content):
         """
-        Save the image and then create the tileset and a thumbnail
+        Save the image and then queue the creation of the tileset and a
+        thumbnail, with the ``tile_profile`` of ``content`` if it has one.
+        With ``DEDUPLICATE_UPLOADS``, an image identical to one already stored
+        returns the stored name instead, sharing its tileset.
         """
-        filename = super(TilesetStorage, self).save(name, content)
-        create_tileset(self.path(filename))
-        create_thumbnail(self.path(filename))
+        from .metrics import timed
+        from .settings import DEDUPLICATE_UPLOADS
+        tile_profile = getattr(content, 'tile_profile', '')
+        digest = DEDUPLICATE_UPLOADS and get_content_digest(content)
+        if DEDUPLICATE_UPLOADS and not digest:
+            content = HashingFile(content)
+        with timed('upload', name) as measurement:
+            filename = super(TilesetStorage, self).save(name, content)
+            measurement['bytes'] = size = self.size(filename)
+        if isinstance(content, HashingFile) and content.hashed == size:
+            digest = content.hash.hexdigest()
+        if digest:
+            stored_name = self.add_reference(filename, digest, size, tile_profile)
+            if stored_name != filename:
+                super(TilesetStorage, self).delete(filename)
+                return stored_name
+        self.retile(filename, tile_profile)
         return filename
 
+    def add_reference(self, name, digest, size, tile_profile=''):
+        """
+        Return the name of the stored image with the ``digest``, tiled with
+        the tile profile, after adding a reference to it, or record the image
+        ``name`` as its first reference
+        """
+        from django.db.models import F
+        from .models import StoredImage
+        stored, created = StoredImage.objects.get_or_create(
+            digest=digest, tile_profile=tile_profile,
+            defaults={'name': name, 'size': size})
+        if created:
+            return name
+        if stored.name == name or not self.exists(stored.name):
+            # The stored image was removed without being released
+            StoredImage.objects.filter(pk=stored.pk).update(
+                name=name, size=size, references=1)
+            return name
+        StoredImage.objects.filter(pk=stored.pk).update(
+            references=F('references') + 1)
+        return stored.name
+
+    def remove_reference(self, name):
+        """
+        Remove a reference to the stored image ``name``. Returns ``True``
+        when it was the last one, and ``False`` while others remain or when
+        the image's references aren't counted.
+        """
+        from django.db.models import F
+        from .models import StoredImage
+        if StoredImage.objects.filter(name=name, references__gt=1).update(
+                references=F('references') - 1):
+            return False
+        stored = StoredImage.objects.filter(name=name)
+        if not stored.exists():
+            return False
+        stored.delete()
+        return True
+
+    def delete(self, name):
+        """
+        Delete the stored image, unless other images share it
+        """
+        from .models import StoredImage
+        if StoredImage.objects.filter(name=name).exists() and not self.remove_reference(name):
+            return
+        super(TilesetStorage, self).delete(name)
+
+    def set_aside(self, name):
+        """
+        Move the stored image ``name`` out of the way, so a new upload can be
+        stored under its name and update its tileset in place. Returns what
+        ``put_back`` needs to undo it, or ``None`` when other images share the
+        image or it can't be moved.
+        """
+        from .models import StoredImage
+        stored = list(StoredImage.objects.filter(name=name))
+        if stored and stored[0].references > 1:
+            return None
+        try:
+            path = self.path(name)
+            os.rename(path, "%s.replaced" % path)
+        except (NotImplementedError, OSError):
+            return None
+        StoredImage.objects.filter(name=name).delete()
+        return "%s.replaced" % path, stored and stored[0] or None
+
+    def put_back(self, name, aside, tile_profile=''):
+        """
+        Restore an image set aside for an upload that wasn't saved, and tile
+        it again
+        """
+        path, stored = aside
+        if self.exists(name):
+            self.remove_reference(name)
+            super(TilesetStorage, self).delete(name)
+        os.rename(path, self.path(name))
+        if stored is not None:
+            stored.save()
+        self.retile(name, tile_profile)
+
+    def discard(self, name, aside):
+        """
+        Delete an image set aside once the upload replacing it is saved, and
+        its tileset unless the upload was stored under its name
+        """
+        os.remove(aside[0])
+        if not self.exists(name):
+            self.delete_tileset(name)
+
+    def release(self, name):
+        """
+        Remove a reference to the stored image ``name``, and delete it with
+        its tileset and thumbnails when it was the last one. Images stored
+        before their references were counted are left alone.
+        """
+        if not self.remove_reference(name):
+            return False
+        super(TilesetStorage, self).delete(name)
+        self.delete_tileset(name)
+        return True
+
+    def delete_files(self, name):
+        """
+        Delete the stored image ``name`` and every file derived from it,
+        leaving the references of the images using it alone, such as once
+        they were transferred to remote storage
+        """
+        super(TilesetStorage, self).delete(name)
+        self.delete_tileset(name)
+
+    def delete_tileset(self, name):
+        """
+        Delete every file derived from the stored image ``name``: the
+        descriptor, tiles, archives, manifest, thumbnails and resized copies
+        """
+        dest_name = os.path.splitext(name)[0]
+        directory, base = os.path.split(dest_name)
+        prefixes = ("%s." % base, "%s_" % base)
+
+        def delete_all(path):
+            directories, files = self.listdir(path)
+            for filename in files:
+                super(TilesetStorage, self).delete(os.path.join(path, filename))
+            for subdirectory in directories:
+                delete_all(os.path.join(path, subdirectory))
+            try:
+                os.rmdir(self.path(path))
+            except (NotImplementedError, OSError):
+                pass
+
+        try:
+            directories, files = self.listdir(directory)
+        except (IOError, OSError):
+            return
+        for filename in files:
+            if filename.startswith(prefixes):
+                super(TilesetStorage, self).delete(os.path.join(directory, filename))
+        for subdirectory in directories:
+            if subdirectory.startswith(prefixes):
+                delete_all(os.path.join(directory, subdirectory))
+
+    def change_tile_profile(self, name, tile_profile=''):
+        """
+        Tile the stored image ``name`` with the tile profile, and return the
+        name the image should use. The tileset of an image shared with other
+        images isn't changed: an identical image already stored with the
+        profile is shared instead, or else a copy is stored and tiled.
+        """
+        from django.db.models import F
+        from .models import StoredImage
+        stored = list(StoredImage.objects.filter(name=name))
+        if not stored or stored[0].tile_profile == tile_profile:
+            self.retile(name, tile_profile)
+            return name
+        stored = stored[0]
+        others = StoredImage.objects.filter(digest=stored.digest, tile_profile=tile_profile)
+        for other in others:
+            if self.exists(other.name):
+                StoredImage.objects.filter(pk=other.pk).update(
+                    references=F('references') + 1)
+                self.release(name)
+                return other.name
+        # Removed without being released
+        others.delete()
+        if stored.references == 1:
+            StoredImage.objects.filter(pk=stored.pk).update(tile_profile=tile_profile)
+            self.retile(name, tile_profile)
+            return name
+        with self.open(name) as original:
+            copy_name = super(TilesetStorage, self).save(name, original)
+        self.remove_reference(name)
+        StoredImage.objects.create(name=copy_name, digest=stored.digest,
+                                   size=stored.size, tile_profile=tile_profile)
+        self.retile(copy_name, tile_profile)
+        return copy_name
+
+    def retile(self, name, tile_profile=''):
+        """
+        Queue the creation of the tileset of the stored image ``name`` with
+        the tile profile. Unless deferred, only this job runs here, if a slot
+        is free.
+        """
+        from .scheduler import TilingScheduler
+
+        scheduler = TilingScheduler()
+        job = scheduler.submit(self.path(name), name, dispatch=self.deferred,
+                               tile_profile=tile_profile)
+        if not self.deferred:
+            scheduler.run_now(job)
+
+    def save_without_tiling(self, name, content):
+        """
+        Save a file derived from an image, such as a resized copy
+        """
+        return super(TilesetStorage, self).save(name, content)
+
+    def get_tileset_status(self, name):
+        """
+        Return the status of the tileset for the stored file ``name``
+        """
+        from .scheduler import TilingScheduler
+        job = TilingScheduler().latest_job(name)
+        return job and job.tileset_status or 'ready'
+
 
 class FileSystemTilesetStorage(TilesetStorage, FileSystemStorage):
     pass
@@ -1,4 +1,4 @@
-from queued_storage.task import Transfer, TransferAndDelete
+from queued_storage.task import Transfer
 from celery import task
 
 try:
@@ -8,15 +8,29 @@ except ImportError:
 
 logger = get_task_logger(name=__name__)
 
-from .tileset import create_tileset, get_tileset_files, create_thumbnail
+from .metrics import timed
+from .progress import ProgressReporter, clear_progress
+from .scheduler import TilingScheduler
+from .transfer import TilesetTransfer
 
 
 @task
-def create_tileset_async(image_path):
+def create_tileset_async(image_path, name=None):
     """
+    Queue the creation of the tileset and thumbnail. ``name`` is the stored
+    name of the file, used to report the tileset status.
     """
-    create_tileset(image_path)
-    create_thumbnail(image_path)
+    TilingScheduler().submit(image_path, name or image_path)
+
+
+@task
+def run_tiling_job_async(job_id):
+    """
+    Run a claimed tiling job and then whatever jobs can run next
+    """
+    scheduler = TilingScheduler()
+    scheduler.run(job_id)
+    scheduler.dispatch()
 
 
 class TileAndTransfer(Transfer):
@@ -25,31 +39,63 @@ class TileAndTransfer(Transfer):
     from the file with the given name and transfers everything to the remote
     storage.
     """
-    def transfer(self, name, local, remote, **kwargs):
+    def run(self, name, cache_key, local_path, remote_path, local_options,
+            remote_options, **kwargs):
+        """
+        Let ``transfer`` create a remote storage for each of its threads
+        """
+        from queued_storage.utils import import_attribute
+        kwargs['remote_factory'] = lambda: import_attribute(remote_path)(**remote_options)
+        return super(TileAndTransfer, self).run(
+            name, cache_key, local_path, remote_path, local_options,
+            remote_options, **kwargs)
+
+    def transfer(self, name, local, remote, remote_factory=None, **kwargs):
         """
-        Transfers the file with the given name from the local to the remote
-        storage backend.
+        Transfers the file with the given name, and its tileset, from the
+        local to the remote storage backend. A retry only transfers the files
+        that were not transferred before.
 
         :param name: The name of the file to transfer
         :param local: The local storage backend instance
         :param remote: The remote storage backend instance
+        :param remote_factory: Creates a remote storage for each thread
         :returns: `True` when the transfer succeeded, `False` if not. Retries
                   the task when returning `False`
         :rtype: bool
         """
-        if create_tileset(name) == 1:
-            logger.error("Unable to create a tileset.")
-        if create_thumbnail(name) == 1:
-            logger.error("Unable to create a thumbnail.")
-        for path in get_tileset_files(name):
-            try:
-                remote.save(path, local.open(path))
-                return True
-            except Exception as e:
-                logger.error("Unable to save '%s' to remote storage. "
-                             "About to retry." % path)
-                logger.exception(e)
-                return False
+        scheduler = TilingScheduler()
+        job = self.request.retries and scheduler.latest_job(name) or None
+        if job is None:
+            job = scheduler.submit(local.path(name), name, dispatch=False)
+        if job.status == 'queued' and scheduler.claim(job):
+            job = scheduler.run(job.pk)
+        if job.status in ('queued', 'running'):
+            # Wait for a free tiling slot, or for the job running elsewhere
+            return False
+        if job.status == 'failed':
+            logger.error("Unable to create a tileset for '%s': %s" % (name, job.error))
+        transfer = TilesetTransfer(local, remote, token=job.pk,
+                                   progress=ProgressReporter(name, 'transfer').transfer,
+                                   remote_factory=remote_factory)
+        with timed('transfer', name, job=job.pk) as measurement:
+            transferred = transfer.run(name)
+            measurement.update(bytes=transfer.bytes_done, files=transfer.files_done,
+                               success=transferred)
+            if not transferred:
+                measurement['error'] = "Unable to transfer to remote storage."
+        if not transferred:
+            logger.error("Unable to transfer '%s' to remote storage. "
+                         "About to retry." % name)
+            return False
+        from django.utils.timezone import now
+        from .models import get_loupe_models, update_thumbnail_fields
+        update_thumbnail_fields(name, remote)
+        # Viewers rendered with the local URL of the tileset are stale
+        for model in get_loupe_models():
+            model._default_manager.filter(image=name).update(updated=now())
+        clear_progress(name)
+        return True
 
 
 class TileTransferAndDelete(TileAndTransfer):
@@ -59,8 +105,12 @@ class TileTransferAndDelete(TileAndTransfer):
     storage and deletes the local files when successful
     """
     def transfer(self, name, local, remote, **kwargs):
-        result = super(TransferAndDelete, self).transfer(name, local,
-                                                         remote, **kwargs)
+        result = super(TileTransferAndDelete, self).transfer(name, local,
+                                                             remote, **kwargs)
         if result:
-            local.delete(name)
+            # The images using the file now hold references to the remote copy
+            if hasattr(local, 'delete_files'):
+                local.delete_files(name)
+            else:
+                local.delete(name)
         return result
@@ -6,7 +6,71 @@ register = template.Library()
 
 
 @register.inclusion_tag("loupe/openseadragon_js.html", takes_context=True)
-def openseadragon_js(context):
+def openseadragon_js(context, mode=''):
+    """
+    Include OpenSeadragon. ``{% openseadragon_js "lazy" %}`` includes a
+    deferred script that loads it only when a lazy viewer is opened.
+    """
     from django.conf import settings
     context['DEBUG'] = settings.DEBUG
+    context['LOUPE_LAZY'] = mode == 'lazy'
     return context
+
+
+def is_viewable(image):
+    return not (image.image and image.tileset_status != 'ready')
+
+
+@register.inclusion_tag("loupe/loupeimage_lazy.html")
+def loupe_lazy_viewer(image):
+    """
+    Show the image's thumbnail, creating its viewer when it scrolls into
+    view or is clicked. Needs ``{% openseadragon_js "lazy" %}``.
+    """
+    return {'object': image, 'viewable': is_viewable(image)}
+
+
+@register.inclusion_tag("loupe/loupe_gallery.html")
+def loupe_gallery(images, gallery_id='loupe-gallery'):
+    """
+    Show one lazy viewer for all the ``images``, and their thumbnails to
+    open each in it. Needs ``{% openseadragon_js "lazy" %}``.
+    """
+    return {
+        'images': [image for image in images if is_viewable(image)],
+        'gallery_id': gallery_id,
+    }
+
+
+@register.simple_tag
+def loupe_derivative_url(field_file, width, height=0, format='jpg'):
+    """
+    Return the URL of the image fitted within ``width`` by ``height``, or
+    nothing for a size or format that isn't allowed
+    """
+    if not field_file:
+        return ''
+    try:
+        return field_file.derivative(width, height, format).url
+    except ValueError:
+        return ''
+
+
+@register.simple_tag
+def loupe_srcset(field_file, widths, format='jpg'):
+    """
+    Return a ``srcset`` of the image at each of the comma separated
+    ``widths``, for example
+    ``<img src="..." srcset="{% loupe_srcset object.image "200,400,800" "webp" %}">``.
+    Widths that aren't allowed are left out.
+    """
+    if not field_file:
+        return ''
+    sources = []
+    for width in widths.split(','):
+        try:
+            sources.append("%s %sw" % (
+                field_file.derivative(int(width), 0, format).url, int(width)))
+        except ValueError:
+            pass
+    return ", ".join(sources)
@@ -1,6 +1,68 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+
+from django import VERSION as DJANGO_VERSION
 from django.test import TestCase
+from django.test.client import RequestFactory
+
+# Before Django 1.6 saving an existing row selects it before updating it
+UPDATE_QUERIES = DJANGO_VERSION < (1, 6) and 2 or 1
+
+
+def set_loupe_settings(test, **values):
+    """
+    Change loupe's settings until ``test`` finishes
+    """
+    from . import settings
+    for name, value in values.items():
+        test.addCleanup(setattr, settings, name, getattr(settings, name))
+        setattr(settings, name, value)
+
+
+def make_temp_dir(test):
+    path = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, path, True)
+    return path
+
+
+def use_image_storage(test, **kwargs):
+    """
+    Store the images of ``LoupeImage`` in a temporary directory until
+    ``test`` finishes
+    """
+    from .models import LoupeImage
+    from .storage import FileSystemTilesetStorage
+    field = LoupeImage._meta.get_field('image')
+    test.addCleanup(setattr, field, 'storage', field.storage)
+    field.storage = FileSystemTilesetStorage(location=make_temp_dir(test), **kwargs)
+    return field.storage
+
+
+def write_image(path, size=(600, 400), mode='RGB', format=None):
+    """
+    Write a gradient, so every tile differs
+    """
+    from PIL import Image
+    width, height = size
+    image = Image.new(mode, size)
+    image.putdata([((x * 255) // width, (y * 255) // height, 128, 255)[:len(mode)]
+                   if len(mode) > 1 else (x * 255) // width
+                   for y in range(height) for x in range(width)])
+    image.save(path, format)
+    return path
+
+
+class RecordingExecutor(object):
+    """
+    Records the jobs it is given instead of running them
+    """
+    jobs = []
+
+    def submit(self, job_id):
+        RecordingExecutor.jobs.append(job_id)
 
 
 class loupeTest(TestCase):
@@ -9,3 +71,1514 @@ class loupeTest(TestCase):
     """
     def test_loupe(self):
         pass
+
+
+class ServingTest(TestCase):
+    """
+    Tests for the conditional and range responses of tiles
+    """
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.data = b'0123456789'
+        self.etag = '"abc"'
+
+    def serve(self, **headers):
+        from .serving import serve_data
+        request = self.factory.get('/tile.jpg', **headers)
+        return serve_data(request, self.data, self.etag, 'image/jpeg', True)
+
+    def test_full_response(self):
+        response = self.serve()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, self.data)
+        self.assertEqual(response['ETag'], self.etag)
+        self.assertTrue('immutable' in response['Cache-Control'])
+
+    def test_not_modified(self):
+        response = self.serve(HTTP_IF_NONE_MATCH=self.etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_range(self):
+        response = self.serve(HTTP_RANGE='bytes=2-4')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, b'234')
+        self.assertEqual(response['Content-Range'], 'bytes 2-4/10')
+        response = self.serve(HTTP_RANGE='bytes=-3')
+        self.assertEqual(response.content, b'789')
+
+    def test_unsatisfiable_range(self):
+        response = self.serve(HTTP_RANGE='bytes=20-30')
+        self.assertEqual(response.status_code, 416)
+
+    def test_stale_if_range(self):
+        response = self.serve(HTTP_RANGE='bytes=2-4', HTTP_IF_RANGE='"old"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_version(self):
+        from .serving import get_etag
+        self.assertNotEqual(get_etag('abc', 1), get_etag('abc', 2))
+
+    def test_sendfile(self):
+        from django.core.files.base import ContentFile
+        from django.core.files.storage import FileSystemStorage
+        from . import serving
+        self.addCleanup(setattr, serving, 'TILE_SENDFILE', serving.TILE_SENDFILE)
+        serving.TILE_SENDFILE = 'x-sendfile'
+        storage = FileSystemStorage(location=make_temp_dir(self))
+        storage.save('map_files/0/0_0.jpg', ContentFile(self.data))
+        request = self.factory.get('/tile.jpg')
+        response = serving.serve_file(request, storage, 'map_files/0/0_0.jpg',
+                                      self.etag, 'image/jpeg')
+        self.assertEqual(response['X-Sendfile'], storage.path('map_files/0/0_0.jpg'))
+        self.assertEqual(serving.serve_file(request, storage, 'map_files/0/1_0.jpg',
+                                            self.etag, 'image/jpeg'), None)
+
+
+class DescriptorTest(TestCase):
+    """
+    Tests for the parsers of tileset descriptors
+    """
+    def test_dzi(self):
+        from .descriptors import parse_dzi
+        metadata = parse_dzi(
+            b'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" '
+            b'TileSize="254" Overlap="1" Format="png">'
+            b'<Size Width="1500" Height="900"/></Image>',
+            'http://example.com/tiles/image.dzi')
+        self.assertEqual((metadata.width, metadata.height), (1500, 900))
+        self.assertEqual((metadata.tile_size, metadata.overlap), (254, 1))
+        self.assertEqual(metadata.format, 'png')
+        self.assertEqual(metadata.level_count, 12)
+        self.assertEqual(metadata.base_tile_url, 'http://example.com/tiles/image_files/')
+
+    def test_iif(self):
+        from .descriptors import parse_iif
+        metadata = parse_iif(
+            b'{"width": 3000, "height": 2000, "tile_width": 512, '
+            b'"scale_factors": [1, 2, 4]}',
+            'http://example.com/iiif/map/info.json')
+        self.assertEqual(metadata.tile_size, 512)
+        self.assertEqual(metadata.levels, [(750, 500), (1500, 1000), (3000, 2000)])
+        metadata = parse_iif(
+            b'{"width": 3000, "height": 2000, "preferredFormats": ["png"], '
+            b'"tiles": [{"width": 1024, "scaleFactors": [1, 2]}]}',
+            'http://example.com/iiif/map/info.json')
+        self.assertEqual(metadata.tile_size, 1024)
+        self.assertEqual(metadata.levels, [(1500, 1000), (3000, 2000)])
+        self.assertEqual(metadata.format, 'png')
+        self.assertEqual(metadata.base_tile_url, 'http://example.com/iiif/map/')
+
+    def test_zoomify(self):
+        from .descriptors import parse_zoomify
+        metadata = parse_zoomify(
+            b'<IMAGE_PROPERTIES WIDTH="3000" HEIGHT="2000" TILESIZE="256" />',
+            'http://example.com/image/ImageProperties.xml')
+        self.assertEqual(metadata.levels[0], (187, 125))
+        self.assertEqual(metadata.levels[-1], (3000, 2000))
+        self.assertEqual(metadata.base_tile_url, 'http://example.com/image/')
+
+    def test_tms(self):
+        from .descriptors import parse_tms
+        metadata = parse_tms(
+            b'<TileMap><BoundingBox minx="0" miny="-2000" maxx="3000" maxy="0"/>'
+            b'<TileFormat width="256" height="256" extension="png"/><TileSets>'
+            b'<TileSet href="0" units-per-pixel="2"/>'
+            b'<TileSet href="1" units-per-pixel="1"/></TileSets></TileMap>',
+            'http://example.com/tms/tilemapresource.xml')
+        self.assertEqual(metadata.levels, [(1500, 1000), (3000, 2000)])
+
+    def test_invalid(self):
+        from .descriptors import parse_dzi, DescriptorError
+        self.assertRaises(DescriptorError, parse_dzi, b'<Image', 'image.dzi')
+        self.assertRaises(DescriptorError, parse_dzi, b'<Image/>', 'image.dzi')
+
+
+class SaveTest(TestCase):
+    """
+    Tests that saving an image writes it once
+    """
+    def setUp(self):
+        from . import descriptors, download_external_img
+        self.descriptors = descriptors
+        self.download_external_img = download_external_img
+        self.get_metadata = descriptors.get_metadata
+        self.django_website_image = download_external_img.django_website_image
+        self.fetched = []
+
+        def get_metadata(tile_type, url):
+            self.fetched.append(url)
+            return descriptors.TilesetMetadata(1500, 900, 254, 1)
+
+        def django_website_image(url, size=None):
+            raise IOError("No thumbnails in tests")
+        descriptors.get_metadata = get_metadata
+        download_external_img.django_website_image = django_website_image
+
+    def tearDown(self):
+        self.descriptors.get_metadata = self.get_metadata
+        self.download_external_img.django_website_image = self.django_website_image
+
+    def create_image(self):
+        from .models import LoupeImage
+        return LoupeImage(name='Map', slug='map',
+            external_tileset_url='http://example.com/map.dzi',
+            external_tileset_type='dzi')
+
+    def set_dirty_fields(self, dirty_fields):
+        from .models import LoupeImage
+        LoupeImage.dirty_fields = property(dirty_fields)
+        self.addCleanup(delattr, LoupeImage, 'dirty_fields')
+
+    def test_create(self):
+        image = self.create_image()
+        self.assertNumQueries(1, image.save)
+        self.assertEqual(self.fetched, ['http://example.com/map.dzi'])
+        self.assertEqual((image.image_width, image.image_height), (1500, 900))
+
+    def test_create_without_dirty_fields(self):
+        self.set_dirty_fields(lambda image: image.get_dirty_fields())
+        self.test_create()
+
+    def test_create_with_stored_name(self):
+        from django.core.files.base import ContentFile
+        from .models import LoupeImage, StoredImage
+        storage = use_image_storage(self)
+        name = storage.save_without_tiling('loupe/map/map.png', ContentFile('map'))
+        storage.add_reference(name, 'digest', 3)
+        # Every field dirty, with its current value, before the first save
+        self.set_dirty_fields(lambda image: image.pk and image.get_dirty_fields() or
+                              image._as_dict())
+        LoupeImage.objects.create(name='Map', slug='map', image=name)
+        self.assertTrue(storage.exists(name))
+        self.assertEqual(StoredImage.objects.get(name=name).references, 1)
+
+    def test_unchanged_tileset(self):
+        image = self.create_image()
+        image.save()
+        image.name = 'Old map'
+        self.assertNumQueries(UPDATE_QUERIES, image.save)
+        self.assertEqual(len(self.fetched), 1)
+
+    def test_changed_tileset(self):
+        image = self.create_image()
+        image.save()
+        image.external_tileset_url = 'http://example.com/other.dzi'
+        self.assertNumQueries(UPDATE_QUERIES, image.save)
+        self.assertEqual(len(self.fetched), 2)
+
+    def test_update_metadata(self):
+        image = self.create_image()
+        image.save()
+        self.assertNumQueries(1, image.update_metadata)
+
+    def test_local_metadata_over_pixel_limit(self):
+        from django.core.files.storage import FileSystemStorage
+        from PIL import Image
+        from .descriptors import get_local_metadata
+        from .models import LoupeImage
+        storage = FileSystemStorage(location=make_temp_dir(self))
+        write_image(storage.path('map.png'))
+        image = LoupeImage(name='Map', slug='map', image='map.png')
+        image.image.storage = storage
+        self.addCleanup(setattr, Image, 'MAX_IMAGE_PIXELS', Image.MAX_IMAGE_PIXELS)
+        Image.MAX_IMAGE_PIXELS = 1000
+        metadata = get_local_metadata(image.image)
+        self.assertEqual((metadata.width, metadata.height), (600, 400))
+
+
+class AdminListTest(TestCase):
+    """
+    Tests that listing images makes no storage calls
+    """
+    def setUp(self):
+        from .models import LoupeImage
+        self.storage_class = LoupeImage._meta.get_field('image').storage.__class__
+        self.calls = []
+        self.originals = {}
+        for method in ('exists', 'open', 'size', 'url', 'path'):
+            original = getattr(self.storage_class, method)
+            self.originals[method] = original
+            setattr(self.storage_class, method, self.count(method, original))
+        LoupeImage.objects.bulk_create([
+            LoupeImage(name='Image %s' % i, slug='image-%s' % i,
+                image='loupe/image-%s/image.tif' % i,
+                has_thumbnail=bool(i % 2),
+                thumbnail_url='/media/loupe/image-%s/image_thumb.jpg' % i)
+            for i in range(20)])
+
+    def tearDown(self):
+        for method, original in self.originals.items():
+            setattr(self.storage_class, method, original)
+
+    def count(self, method, original):
+        def counted(storage, *args, **kwargs):
+            self.calls.append(method)
+            return original(storage, *args, **kwargs)
+        return counted
+
+    def test_thumbnail_column(self):
+        from django.contrib import admin
+        from .base_admin import BaseLoupeImageAdmin
+        from .models import LoupeImage
+        model_admin = BaseLoupeImageAdmin(LoupeImage, admin.site)
+        with self.assertNumQueries(1):
+            cells = [model_admin.thumbnail_img(image)
+                     for image in LoupeImage.objects.all()]
+        self.assertEqual(self.calls, [])
+        self.assertEqual(len([c for c in cells if 'image_thumb.jpg' in c]), 10)
+
+
+class DocumentTest(TestCase):
+    """
+    Tests that a document's pages are loaded together
+    """
+    def setUp(self):
+        from .models import LoupeImage
+        LoupeImage.objects.bulk_create([
+            LoupeImage(name='Page %s' % i, slug='page-%s' % i,
+                image='loupe/page-%s/page.tif' % i,
+                document_name='Atlas', document_order=3 - i,
+                image_width=1000, image_height=800, tile_size=254,
+                tile_overlap=1, tile_format='jpg',
+                base_tile_url='/media/loupe/page-%s/page_files/' % i)
+            for i in range(3)])
+
+    def test_pages(self):
+        from .documents import LoupeDocument
+        document = LoupeDocument('Atlas')
+        with self.assertNumQueries(1):
+            sources = document.tileset_sources
+            self.assertEqual([page.slug for page in document],
+                             ['page-2', 'page-1', 'page-0'])
+        self.assertFalse('.dzi' in sources)
+        self.assertTrue('/media/loupe/page-2/page_files/' in sources)
+
+    def test_missing(self):
+        from django.http import Http404
+        from .documents import get_document_or_404
+        self.assertRaises(Http404, get_document_or_404, 'Missing')
+
+
+class RenderTest(TestCase):
+    """
+    Tests that viewers are rendered once until the image changes
+    """
+    def setUp(self):
+        from .models import LoupeImage
+        from .rendering import get_render_cache
+        get_render_cache().lru.clear()
+        for i in range(3):
+            LoupeImage.objects.create(name='Map %s' % i, slug='map-%s' % i,
+                external_tileset_url='http://tile.openstreetmap.org/',
+                external_tileset_type='osm',
+                thumbnail='loupe_thumbs/map.jpg')
+
+    def test_render_many(self):
+        from .models import LoupeImage
+        from .rendering import render_many
+        images = list(LoupeImage.objects.order_by('pk'))
+        html = render_many(images)
+        self.assertEqual(len(html), 3)
+        self.assertTrue('id="map-1"' in html[1])
+        self.assertEqual(render_many(images), html)
+        self.assertEqual(images[0].render(), html[0])
+
+    def test_tiles_url_follows_image_url(self):
+        from django.core.files.storage import FileSystemStorage
+        from .models import LoupeImage
+        image = LoupeImage(name='Map', slug='map', image='loupe/map/map.png',
+            image_width=600, image_height=400, tile_size=254,
+            base_tile_url='/media/loupe/map/map_files/')
+        # As after a queued storage transferred the tileset
+        image.image.storage = FileSystemStorage(base_url='http://cdn.example.com/')
+        self.assertEqual(image.tiles_url, 'http://cdn.example.com/loupe/map/map_files/')
+        self.assertTrue('http://cdn.example.com/loupe/map/map_files/' in image.tileset_source)
+
+    def test_save_renders_again(self):
+        from .models import LoupeImage
+        image = LoupeImage.objects.get(slug='map-0')
+        html = image.render()
+        image.slug = 'map-zero'
+        image.save()
+        self.assertNotEqual(image.render(), html)
+        self.assertTrue('id="map-zero"' in image.render())
+
+
+class LazyViewerTest(TestCase):
+    """
+    Tests for the lazy viewer template tags
+    """
+    def render(self, source, **context):
+        from django.template import Context, Template
+        return Template("{% load loupe_tags %}" + source).render(Context(context))
+
+    def test_lazy_js(self):
+        html = self.render('{% openseadragon_js "lazy" %}', STATIC_URL='/static/')
+        self.assertTrue('loupe/lazy.js' in html)
+        self.assertTrue(' defer' in html)
+        self.assertFalse('<script src="/static/openseadragon' in html)
+
+    def test_gallery(self):
+        from .models import LoupeImage
+        images = [
+            LoupeImage(name='Map', slug='map', external_tileset_type='osm',
+                external_tileset_url='http://tile.openstreetmap.org/'),
+            LoupeImage(name='Pending', slug='pending', image='loupe/p/p.tif',
+                tileset_status='pending'),
+        ]
+        html = self.render('{% loupe_gallery images "maps" %}', images=images)
+        self.assertTrue('id="maps"' in html)
+        self.assertTrue('data-loupe-index="0"' in html)
+        self.assertFalse('data-loupe-index="1"' in html)
+        # The gallery is registered with the lazy viewer once, by its id
+        self.assertEqual(html.count('.push('), 1)
+        self.assertTrue('"maps"' in html.split('.push(')[1])
+
+
+class TileProfileTest(TestCase):
+    """
+    Tests that tiles are encoded with the tile profile
+    """
+    def setUp(self):
+        import tempfile
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmp_dir)
+
+    def tile(self, mode, profile):
+        import os
+        from PIL import Image
+        from .tilers.pillow import PillowTiler
+        image_path = os.path.join(self.tmp_dir, 'image.png')
+        Image.new(mode, (300, 200)).save(image_path)
+        dest_path = os.path.join(self.tmp_dir, 'image')
+        self.assertTrue(PillowTiler(profile=profile).create_tileset(image_path, dest_path))
+        return open("%s.dzi" % dest_path).read(), os.listdir("%s_files/9" % dest_path)
+
+    def test_format(self):
+        descriptor, tiles = self.tile('RGB', {'format': 'png'})
+        self.assertTrue('Format="png"' in descriptor)
+        self.assertTrue('0_0.png' in tiles)
+
+    def test_alpha(self):
+        descriptor, tiles = self.tile('RGBA', 'jpeg')
+        self.assertTrue('Format="png"' in descriptor)
+        descriptor, tiles = self.tile('RGBA', {'alpha_format': ''})
+        self.assertTrue('Format="jpg"' in descriptor)
+
+    def test_alpha_over_pixel_limit(self):
+        import os
+        from PIL import Image
+        from .tilers.vips import VipsTiler
+        image_path = os.path.join(self.tmp_dir, 'image.png')
+        Image.new('RGBA', (300, 200)).save(image_path)
+        self.addCleanup(setattr, Image, 'MAX_IMAGE_PIXELS', Image.MAX_IMAGE_PIXELS)
+        Image.MAX_IMAGE_PIXELS = 1000
+        # Read by vipsheader, or by Pillow when vips isn't installed
+        self.assertEqual(VipsTiler().select_format_for(image_path), 'png')
+
+
+class MetricsTest(TestCase):
+    """
+    Tests that stage measurements are sent and logged
+    """
+    def setUp(self):
+        from .signals import stage_recorded
+        set_loupe_settings(self, METRICS_LOG=True)
+        self.received = []
+        stage_recorded.connect(self.receive)
+
+    def tearDown(self):
+        from .signals import stage_recorded
+        stage_recorded.disconnect(self.receive)
+
+    def receive(self, sender, **kwargs):
+        self.received.append(kwargs)
+
+    def test_timed(self):
+        from .metrics import timed
+        from .models import StageTiming
+        with timed('thumbnail', 'loupe/a/a.tif') as measurement:
+            measurement['bytes'] = 10
+        self.assertEqual(self.received[0]['bytes'], 10)
+        timing = StageTiming.objects.get(name='loupe/a/a.tif')
+        self.assertEqual(timing.stage, 'thumbnail')
+        self.assertTrue(timing.success)
+
+    def test_failure(self):
+        from .metrics import timed
+        from .models import StageTiming
+        try:
+            with timed('transfer', 'loupe/a/a.tif'):
+                raise IOError("Connection refused")
+        except IOError:
+            pass
+        timing = StageTiming.objects.get(name='loupe/a/a.tif')
+        self.assertFalse(timing.success)
+        self.assertEqual(timing.error, "Connection refused")
+        self.assertEqual(self.received[0]['reason'], 'IOError')
+
+    def test_failure_reason(self):
+        from .metrics import timed
+        with timed('transfer', 'loupe/a/a.tif') as measurement:
+            measurement.update(success=False, error="Unable to reach loupe/a/a.tif")
+        self.assertEqual(self.received[0]['reason'], 'failed')
+
+    def test_not_logged_by_default(self):
+        from .metrics import timed
+        from .models import StageTiming
+        set_loupe_settings(self, METRICS_LOG=False)
+        with timed('thumbnail', 'loupe/a/a.tif'):
+            pass
+        self.assertFalse(StageTiming.objects.exists())
+
+    def test_prune(self):
+        import datetime
+        from django.core.management import call_command
+        from django.utils.timezone import now
+        from .metrics import record
+        from .models import StageTiming
+        record('thumbnail', 'loupe/a/a.tif')
+        record('thumbnail', 'loupe/b/b.tif')
+        StageTiming.objects.filter(name='loupe/a/a.tif').update(
+            created=now() - datetime.timedelta(days=31))
+        call_command('loupe_timings', prune=30, stdout=open(os.devnull, 'w'))
+        self.assertEqual(list(StageTiming.objects.values_list('name', flat=True)),
+                         ['loupe/b/b.tif'])
+
+
+class ProgressTest(TestCase):
+    """
+    Tests that tiling progress is reported through the cache
+    """
+    def tearDown(self):
+        from .progress import clear_progress
+        clear_progress('loupe/a/a.tif')
+
+    def test_stage_spans(self):
+        from .progress import get_progress, set_progress
+        set_progress('loupe/a/a.tif', 'tiling', 0.5)
+        progress = get_progress('loupe/a/a.tif')
+        self.assertEqual(progress['stage'], 'tiling')
+        self.assertAlmostEqual(progress['progress'], 0.45)
+        set_progress('loupe/a/a.tif', 'transfer', 1.0)
+        self.assertAlmostEqual(get_progress('loupe/a/a.tif')['progress'], 1.0)
+
+    def test_reporter_is_throttled(self):
+        from .progress import ProgressReporter, get_progress
+        report = ProgressReporter('loupe/a/a.tif', 'tiling', interval=60)
+        report(0.1)
+        report(0.2)
+        self.assertAlmostEqual(get_progress('loupe/a/a.tif')['stage_progress'], 0.1)
+        report(1.0)
+        self.assertAlmostEqual(get_progress('loupe/a/a.tif')['stage_progress'], 1.0)
+
+    def test_status_view(self):
+        import json
+        from .models import LoupeImage
+        from .progress import set_progress
+        from .views import tileset_status
+        LoupeImage.objects.create(name='Map', slug='map',
+            external_tileset_url='http://tile.openstreetmap.org/',
+            external_tileset_type='osm')
+        LoupeImage.objects.filter(slug='map').update(
+            image='loupe/a/a.tif', tileset_status='tiling')
+        set_progress('loupe/a/a.tif', 'tiling', 0.5)
+        response = tileset_status(RequestFactory().get('/map/status.json'), 'map')
+        status = json.loads(response.content)
+        self.assertEqual(status['status'], 'tiling')
+        self.assertAlmostEqual(status['progress'], 0.45)
+        self.assertTrue('no-cache' in response['Cache-Control'] or
+                        'max-age=0' in response['Cache-Control'])
+
+    def test_status_view_while_transferring(self):
+        import json
+        from .models import LoupeImage
+        from .progress import clear_progress, set_progress
+        from .views import tileset_status
+        LoupeImage.objects.create(name='Map', slug='map',
+            external_tileset_url='http://tile.openstreetmap.org/',
+            external_tileset_type='osm')
+        LoupeImage.objects.filter(slug='map').update(
+            image='loupe/a/a.tif', tileset_status='ready')
+        set_progress('loupe/a/a.tif', 'transfer', 0.5)
+        status = json.loads(tileset_status(
+            RequestFactory().get('/map/status.json'), 'map').content)
+        self.assertEqual(status['status'], 'ready')
+        self.assertEqual(status['stage'], 'transfer')
+        self.assertAlmostEqual(status['progress'], 0.975)
+        clear_progress('loupe/a/a.tif')
+        status = json.loads(tileset_status(
+            RequestFactory().get('/map/status.json'), 'map').content)
+        self.assertEqual(status['progress'], 1.0)
+
+
+class DeduplicateTest(TestCase):
+    """
+    Tests that identical uploads share one stored image and tileset
+    """
+    def setUp(self):
+        import tempfile
+        from .storage import FileSystemTilesetStorage
+        self.location = tempfile.mkdtemp()
+        self.storage = FileSystemTilesetStorage(location=self.location)
+        self.retiled = []
+        self.storage.retile = lambda name, tile_profile='': self.retiled.append(name)
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.location)
+
+    def test_identical_upload(self):
+        from django.core.files.base import ContentFile
+        from .models import StoredImage
+        first = self.storage.save('loupe/a/scan.tif', ContentFile('scan'))
+        second = self.storage.save('loupe/b/copy.tif', ContentFile('scan'))
+        self.assertEqual(second, first)
+        self.assertFalse(self.storage.exists('loupe/b/copy.tif'))
+        self.assertEqual(self.retiled, [first])
+        self.assertEqual(StoredImage.objects.get(name=first).references, 2)
+        other = self.storage.save('loupe/c/other.tif', ContentFile('other'))
+        self.assertNotEqual(other, first)
+
+    def test_delete_files(self):
+        from django.core.files.base import ContentFile
+        from .models import StoredImage
+        name = self.storage.save('loupe/a/scan.tif', ContentFile('scan'))
+        self.storage.save('loupe/b/scan.tif', ContentFile('scan'))
+        self.storage.save_without_tiling('loupe/a/scan.dzi', ContentFile('<Image/>'))
+        self.storage.delete_files(name)
+        self.assertFalse(self.storage.exists(name))
+        self.assertFalse(self.storage.exists('loupe/a/scan.dzi'))
+        self.assertEqual(StoredImage.objects.get(name=name).references, 2)
+
+    def test_tile_profile(self):
+        from django.core.files.base import ContentFile
+        first = self.storage.save('loupe/a/scan.tif', ContentFile('scan'))
+        content = ContentFile('scan')
+        content.tile_profile = 'png'
+        second = self.storage.save('loupe/b/scan.tif', content)
+        self.assertNotEqual(second, first)
+        self.assertEqual(self.retiled, [first, second])
+
+    def test_change_shared_profile(self):
+        from django.core.files.base import ContentFile
+        from .models import StoredImage
+        name = self.storage.save('loupe/a/scan.tif', ContentFile('scan'))
+        self.storage.save('loupe/b/scan.tif', ContentFile('scan'))
+        copy_name = self.storage.change_tile_profile(name, 'png')
+        self.assertNotEqual(copy_name, name)
+        self.assertEqual(self.retiled, [name, copy_name])
+        self.assertEqual(self.storage.open(copy_name).read(), 'scan')
+        self.assertEqual(StoredImage.objects.get(name=name).references, 1)
+        self.assertEqual(StoredImage.objects.get(name=copy_name).tile_profile, 'png')
+        # The other image now shares the copy tiled with the profile
+        self.assertEqual(self.storage.change_tile_profile(name, 'png'), copy_name)
+        self.assertFalse(self.storage.exists(name))
+        self.assertEqual(StoredImage.objects.get(name=copy_name).references, 2)
+        self.assertEqual(self.retiled, [name, copy_name])
+
+    def test_change_unshared_profile(self):
+        from django.core.files.base import ContentFile
+        from .models import StoredImage
+        name = self.storage.save('loupe/a/scan.tif', ContentFile('scan'))
+        self.assertEqual(self.storage.change_tile_profile(name, 'png'), name)
+        self.assertEqual(self.retiled, [name, name])
+        self.assertEqual(StoredImage.objects.get(name=name).tile_profile, 'png')
+
+    def test_change_profile_of_shared_image(self):
+        from django.core.files.base import ContentFile
+        from .models import LoupeImage
+        set_loupe_settings(self, TILING_EXECUTOR='loupe.tests.RecordingExecutor')
+        storage = use_image_storage(self, deferred=True)
+        path = write_image(os.path.join(make_temp_dir(self), 'scan.png'))
+        data = open(path, 'rb').read()
+        first = LoupeImage(name='A', slug='a')
+        first.image.save('scan.png', ContentFile(data))
+        second = LoupeImage(name='B', slug='b')
+        second.image.save('scan.png', ContentFile(data))
+        self.assertEqual(second.image.name, first.image.name)
+        second = LoupeImage.objects.get(slug='b')
+        second.tile_profile = 'lossless'
+        second.save()
+        self.assertNotEqual(second.image.name, first.image.name)
+        self.assertEqual(LoupeImage.objects.get(slug='b').image.name, second.image.name)
+        self.assertEqual(LoupeImage.objects.get(slug='a').image.name, first.image.name)
+        self.assertTrue(storage.exists(first.image.name))
+
+    def test_resave_keeps_image(self):
+        import copy
+        from django.core.files.base import ContentFile
+        from .models import LoupeImage, StoredImage
+        set_loupe_settings(self, TILING_EXECUTOR='loupe.tests.RecordingExecutor')
+        storage = use_image_storage(self, deferred=True)
+        image = LoupeImage(name='A', slug='a')
+        image.image.save('scan.png', ContentFile('scan'))
+        image = LoupeImage.objects.get(slug='a')
+        # The image is reported changed although it is the same stored file
+        LoupeImage.dirty_fields = property(lambda self: {'image': copy.copy(self.image)})
+        self.addCleanup(delattr, LoupeImage, 'dirty_fields')
+        image.save()
+        self.assertTrue(storage.exists(image.image.name))
+        self.assertEqual(StoredImage.objects.get(name=image.image.name).references, 1)
+
+    def test_release(self):
+        from django.core.files.base import ContentFile
+        name = self.storage.save('loupe/a/scan.tif', ContentFile('scan'))
+        self.storage.save('loupe/b/scan.tif', ContentFile('scan'))
+        self.storage.save_without_tiling('loupe/a/scan.dzi', ContentFile('<Image/>'))
+        self.storage.save_without_tiling('loupe/a/scan_files/0/0_0.jpg', ContentFile('tile'))
+        self.assertFalse(self.storage.release(name))
+        self.assertTrue(self.storage.exists('loupe/a/scan_files/0/0_0.jpg'))
+        self.assertTrue(self.storage.release(name))
+        self.assertFalse(self.storage.exists(name))
+        self.assertFalse(self.storage.exists('loupe/a/scan.dzi'))
+        self.assertFalse(self.storage.exists('loupe/a/scan_files'))
+
+
+class ChunkedUploadTest(TestCase):
+    """
+    Tests that chunked uploads are assembled in order, checked and stored
+    """
+    def setUp(self):
+        import tempfile
+        from .models import LoupeImage
+        from .storage import FileSystemTilesetStorage
+        self.location = tempfile.mkdtemp()
+        self.field = LoupeImage._meta.get_field('image')
+        self.storage = self.field.storage
+        self.field.storage = FileSystemTilesetStorage(location=self.location)
+        self.retiled = []
+        self.field.storage.retile = lambda name, tile_profile='': self.retiled.append(name)
+
+    def tearDown(self):
+        import shutil
+        self.field.storage = self.storage
+        shutil.rmtree(self.location)
+
+    def upload(self, data, checksum=''):
+        from io import BytesIO
+        from .uploads import create_upload, write_chunk
+        upload = create_upload(None, 'scan.tif', len(data), checksum, slug='map')
+        for start in range(0, len(data), 4):
+            write_chunk(upload, BytesIO(data[start:start + 4]), start,
+                        len(data[start:start + 4]))
+        return upload
+
+    def test_resume(self):
+        import hashlib
+        from io import BytesIO
+        from .models import StoredImage
+        from .uploads import UploadError, complete_upload, create_upload, write_chunk
+        upload = create_upload(None, 'scan.tif', 10, slug='map')
+        write_chunk(upload, BytesIO(b'0123'), 0, 4)
+        self.assertRaises(UploadError, write_chunk, upload, BytesIO(b'89'), 8, 2)
+        self.assertRaises(UploadError, write_chunk, upload, BytesIO(b'4567'), 4, 4,
+                          checksum='0' * 64)
+        write_chunk(upload, BytesIO(b'4567'), 4, 4)
+        write_chunk(upload, BytesIO(b'89'), 8, 2)
+        name = complete_upload(upload)
+        self.assertEqual(name, 'loupe/map/scan.tif')
+        self.assertEqual(self.retiled, [name])
+        self.assertEqual(self.field.storage.open(name).read(), b'0123456789')
+        self.assertEqual(StoredImage.objects.get(name=name).digest,
+                         hashlib.sha256(b'0123456789').hexdigest())
+
+    def test_running_digest(self):
+        import hashlib
+        from io import BytesIO
+        from . import uploads
+        from .models import StoredImage
+        upload = uploads.create_upload(None, 'scan.tif', 10, slug='map')
+        uploads.write_chunk(upload, BytesIO(b'0123'), 0, 4)
+        # Another process received the next chunk
+        uploads.forget_running_digest(upload.upload_id)
+        uploads.write_chunk(upload, BytesIO(b'4567'), 4, 4)
+        uploads.write_chunk(upload, BytesIO(b'89'), 8, 2)
+        self.assertEqual(uploads._digests[upload.upload_id][0], 10)
+        # The finished file isn't read again
+        upload.delete_file()
+        open(upload.path, 'wb').close()
+        name = uploads.complete_upload(upload)
+        self.assertFalse(upload.upload_id in uploads._digests)
+        self.assertEqual(StoredImage.objects.get(name=name).digest,
+                         hashlib.sha256(b'0123456789').hexdigest())
+
+    def test_checksum(self):
+        from .models import ChunkedUpload
+        from .uploads import UploadError, complete_upload
+        upload = self.upload(b'0123456789', checksum='0' * 64)
+        self.assertRaises(UploadError, complete_upload, upload)
+        self.assertEqual(ChunkedUpload.objects.get(pk=upload.pk).status, 'failed')
+        self.assertEqual(self.retiled, [])
+
+    def test_form_field(self):
+        from django import forms
+        from .forms import ChunkedImageFormField, ChunkedUploadValue
+        from .uploads import complete_upload
+        upload = self.upload(b'0123456789')
+        field = ChunkedImageFormField()
+        self.assertRaises(forms.ValidationError, field.clean,
+                          ChunkedUploadValue(upload.upload_id))
+        name = complete_upload(upload)
+        self.assertEqual(field.clean(ChunkedUploadValue(upload.upload_id)), name)
+
+    def test_tile_profile(self):
+        from io import BytesIO
+        from .forms import ChunkedImageFormField, ChunkedUploadValue
+        from .models import LoupeImage
+        from .uploads import complete_upload, create_upload, write_chunk
+        self.field.storage.retile = lambda name, tile_profile='': self.retiled.append(
+            (name, tile_profile))
+        names = []
+        for slug, data in (('a', b'0123'), ('b', b'4567')):
+            upload = create_upload(None, 'scan.tif', 4, slug=slug, tile_profile='webp')
+            write_chunk(upload, BytesIO(data), 0, 4)
+            complete_upload(upload)
+            names.append(ChunkedImageFormField().clean(ChunkedUploadValue(upload.upload_id)))
+        self.assertEqual(self.retiled, [(names[0], 'webp'), (names[1], 'webp')])
+        image = LoupeImage(name='A', slug='a', tile_profile='webp')
+        self.field.save_form_data(image, names[0])
+        image.save()
+        self.assertEqual(len(self.retiled), 2)
+        image = LoupeImage(name='B', slug='b', tile_profile='lossless')
+        self.field.save_form_data(image, names[1])
+        image.save()
+        self.assertEqual(self.retiled[2:], [(names[1], 'lossless')])
+        # Setting the stored name again isn't another upload
+        image.save()
+        self.assertEqual(len(self.retiled), 3)
+
+    def test_expired_upload(self):
+        import datetime
+        from io import BytesIO
+        from django.utils.timezone import now
+        from .forms import ChunkedImageFormField, ChunkedUploadValue
+        from .models import ChunkedUpload, LoupeImage, StoredImage
+        from .uploads import (complete_upload, create_upload, delete_expired_uploads,
+                              write_chunk)
+        names = []
+        for slug in ('a', 'b'):
+            upload = create_upload(None, 'scan.tif', 4, slug=slug)
+            write_chunk(upload, BytesIO(b'0123'), 0, 4)
+            complete_upload(upload)
+            names.append(ChunkedImageFormField().clean(ChunkedUploadValue(upload.upload_id)))
+        # Only the first upload is saved with an image, sharing the stored file
+        self.assertEqual(names[0], names[1])
+        image = LoupeImage(name='A', slug='a')
+        self.field.save_form_data(image, names[0])
+        image.save()
+        self.assertEqual(StoredImage.objects.get(name=names[0]).references, 2)
+        ChunkedUpload.objects.update(updated=now() - datetime.timedelta(days=2))
+        delete_expired_uploads()
+        self.assertEqual(StoredImage.objects.get(name=names[0]).references, 1)
+        self.assertTrue(self.field.storage.exists(names[0]))
+        self.assertFalse(ChunkedUpload.objects.exists())
+
+
+class DeferredTilingTest(TestCase):
+    """
+    Tests that deferred tiling records the tileset status on the image
+    """
+    def setUp(self):
+        RecordingExecutor.jobs = []
+        set_loupe_settings(self, TILER='loupe.tilers.pillow.PillowTiler',
+                           TILING_EXECUTOR='loupe.tests.RecordingExecutor')
+        self.storage = use_image_storage(self, deferred=True)
+
+    def create_image(self):
+        from django.core.files import File
+        from .models import LoupeImage
+        source = open(write_image(os.path.join(make_temp_dir(self), 'map.png')), 'rb')
+        self.addCleanup(source.close)
+        image = LoupeImage(name='Map', slug='map')
+        image.image = File(source, 'map.png')
+        image.save()
+        return image
+
+    def test_deferred(self):
+        from .models import LoupeImage
+        from .scheduler import run_tiling_job
+        image = self.create_image()
+        self.assertEqual(image.tileset_status, 'tiling')
+        self.assertFalse(self.storage.exists('loupe/map/map.dzi'))
+        self.assertEqual(len(RecordingExecutor.jobs), 1)
+        self.assertEqual(run_tiling_job(RecordingExecutor.jobs[0]), 'done')
+        image = LoupeImage.objects.get(pk=image.pk)
+        self.assertEqual(image.tileset_status, 'ready')
+        self.assertEqual(image.tileset_version, 1)
+        self.assertTrue(self.storage.exists('loupe/map/map.dzi'))
+
+    def test_job_finished_while_saving(self):
+        from .models import LoupeImage
+        set_loupe_settings(self, TILING_EXECUTOR='sync')
+        get_status = self.storage.get_tileset_status
+        # The field reads the status before the job finishes
+        statuses = ['tiling']
+        self.storage.get_tileset_status = lambda name: (
+            statuses and statuses.pop() or get_status(name))
+        image = self.create_image()
+        self.assertEqual(LoupeImage.objects.get(pk=image.pk).tileset_status, 'ready')
+
+    def test_get_executor(self):
+        from .executors import get_executor, ProcessPoolExecutor, SyncExecutor
+        self.assertTrue(isinstance(get_executor('sync'), SyncExecutor))
+        self.assertTrue(isinstance(get_executor(), RecordingExecutor))
+        set_loupe_settings(self, TILING_EXECUTOR='', HAS_CELERY=False)
+        self.assertTrue(isinstance(get_executor(), ProcessPoolExecutor))
+
+
+class SchedulerTest(TestCase):
+    """
+    Tests that tiling jobs run within the scheduler's limits
+    """
+    def setUp(self):
+        set_loupe_settings(self, TILER='loupe.tilers.pillow.PillowTiler',
+                           TILING_MAX_JOBS=2, TILING_MEMORY_LIMIT=1000,
+                           TILING_MAX_ATTEMPTS=2)
+        self.storage = use_image_storage(self)
+
+    def store_image(self, name='map.png'):
+        from django.core.files.base import ContentFile
+        path = write_image(os.path.join(make_temp_dir(self), name), (100, 80))
+        return self.storage.save(name, ContentFile(open(path, 'rb').read()))
+
+    def create_job(self, name, status='queued', estimated_memory=0):
+        from .models import TilingJob
+        return TilingJob.objects.create(image_path=self.storage.path(name),
+                                        name=name, status=status,
+                                        estimated_memory=estimated_memory)
+
+    def test_sync_runs_only_its_job(self):
+        from .models import TilingJob
+        other = self.create_job('other.png')
+        name = self.store_image()
+        self.assertEqual(self.storage.get_tileset_status(name), 'ready')
+        self.assertEqual(TilingJob.objects.get(pk=other.pk).status, 'queued')
+
+    def test_sync_slots_full(self):
+        set_loupe_settings(self, TILING_MAX_JOBS=1)
+        self.create_job('other.png', status='running')
+        name = self.store_image()
+        self.assertEqual(self.storage.get_tileset_status(name), 'pending')
+        self.assertFalse(self.storage.exists('map.dzi'))
+
+    def test_claim_memory_limit(self):
+        from .scheduler import TilingScheduler
+        large = self.create_job('large.png', estimated_memory=5000)
+        small = self.create_job('small.png', estimated_memory=600)
+        self.create_job('medium.png', estimated_memory=600)
+        scheduler = TilingScheduler()
+        # A job larger than the limit runs on its own
+        self.assertEqual(scheduler.claim(), [large])
+        self.assertEqual(scheduler.claim(), [])
+        large.status = 'done'
+        large.save()
+        self.assertEqual(scheduler.claim(), [small])
+
+    def test_retry(self):
+        from .models import TilingJob
+        from .scheduler import TilingScheduler
+        scheduler = TilingScheduler()
+        job = self.create_job('missing.png')
+        for status in ('queued', 'failed'):
+            TilingJob.objects.filter(pk=job.pk).update(status='queued')
+            self.assertEqual(scheduler.claim(job), [job])
+            self.assertEqual(scheduler.run(job.pk).status, status)
+        job = TilingJob.objects.get(pk=job.pk)
+        self.assertEqual(job.attempts, 2)
+        self.assertTrue(job.error)
+
+    def test_estimate_over_pixel_limit(self):
+        from PIL import Image
+        from .tileset import estimate_tiling_memory
+        self.addCleanup(setattr, Image, 'MAX_IMAGE_PIXELS', Image.MAX_IMAGE_PIXELS)
+        Image.MAX_IMAGE_PIXELS = 1000
+        path = write_image(os.path.join(make_temp_dir(self), 'map.png'), (100, 80))
+        self.assertEqual(estimate_tiling_memory(path), 100 * 80 * 3)
+        self.assertEqual(Image.MAX_IMAGE_PIXELS, 1000)
+
+
+class PillowTilerTest(TestCase):
+    """
+    Tests the tilesets made by the Pillow tiler
+    """
+    def setUp(self):
+        self.path = write_image(os.path.join(make_temp_dir(self), 'map.png'), (600, 400))
+
+    def create_tileset(self, **kwargs):
+        from .tilers.pillow import PillowTiler
+        tiler = PillowTiler(tile_size=254, overlap=1, lazy_levels=0, **kwargs)
+        progress = []
+        tiler.progress = progress.append
+        dest_path = os.path.join(make_temp_dir(self), 'map')
+        self.assertTrue(tiler.create_tileset(self.path, dest_path))
+        tiles = {}
+        for dirpath, dirnames, filenames in os.walk("%s_files" % dest_path):
+            for filename in filenames:
+                if filename.endswith('.jpg'):
+                    key = "%s/%s" % (os.path.basename(dirpath), filename)
+                    tiles[key] = open(os.path.join(dirpath, filename), 'rb').read()
+        return tiler, dest_path, tiles, progress
+
+    def test_levels(self):
+        from PIL import Image
+        tiler, dest_path, tiles, progress = self.create_tileset(streaming=True)
+        self.assertTrue(os.path.exists("%s.dzi" % dest_path))
+        # A 3x2 grid of tiles at level 10, 2x1 at level 9 and one tile below
+        self.assertEqual(len(tiles), 6 + 2 + 9)
+        self.assertEqual(Image.open(os.path.join(
+            "%s_files" % dest_path, '10', '2_1.jpg')).size, (600 - 508 + 1, 400 - 254 + 1))
+        self.assertEqual(Image.open(os.path.join(
+            "%s_files" % dest_path, '0', '0_0.jpg')).size, (1, 1))
+        self.assertEqual(progress[-1], 1.0)
+        self.assertEqual(len(progress), len(tiles))
+        self.assertEqual([stats['level'] for stats in tiler.level_stats], list(range(11)))
+
+    def test_streaming_matches_levels(self):
+        streamed = self.create_tileset(streaming=True)[2]
+        self.assertEqual(self.create_tileset(streaming=False)[2], streamed)
+
+    def test_unchanged_tiles_kept(self):
+        from .tilers.pillow import PillowTiler
+        tiler, dest_path, tiles, progress = self.create_tileset()
+        tiler = PillowTiler(tile_size=254, overlap=1, lazy_levels=0)
+        self.assertTrue(tiler.create_tileset(self.path, dest_path))
+        self.assertEqual(sum([stats['tiles'] for stats in tiler.level_stats]), 0)
+
+    def test_thumbnail(self):
+        from PIL import Image
+        from .tilers.pillow import PillowTiler
+        dest_path = os.path.join(make_temp_dir(self), 'thumb.jpg')
+        self.assertTrue(PillowTiler().create_thumbnail(self.path, dest_path, 200))
+        self.assertEqual(Image.open(dest_path).size, (200, 133))
+
+
+class StreamingTest(TestCase):
+    """
+    Tests that sources are read in strips, even over Pillow's pixel limit
+    """
+    def setUp(self):
+        from PIL import Image
+        self.tmp_dir = make_temp_dir(self)
+        self.addCleanup(setattr, Image, 'MAX_IMAGE_PIXELS', Image.MAX_IMAGE_PIXELS)
+
+    def tile(self, path):
+        from .tilers.pillow import PillowTiler
+        dest_path = os.path.join(self.tmp_dir, 'tiles')
+        self.assertTrue(PillowTiler(streaming=True, lazy_levels=0).create_tileset(
+            path, dest_path))
+        level_path = os.path.join("%s_files" % dest_path, '10')
+        return dict([(name, open(os.path.join(level_path, name), 'rb').read())
+                     for name in os.listdir(level_path)])
+
+    def test_tiff_reader(self):
+        from .tilers.readers import TiffStripReader, get_strip_reader
+        tiff = write_image(os.path.join(self.tmp_dir, 'map.tif'), format='TIFF')
+        png = write_image(os.path.join(self.tmp_dir, 'map.png'))
+        reader = get_strip_reader(tiff)
+        self.assertTrue(isinstance(reader, TiffStripReader))
+        rows = reader.read_rows(100, 110)
+        reader.close()
+        self.assertEqual(rows.shape, (10, 600, 3))
+        self.assertEqual(rows.tolist(), get_strip_reader(png).read_rows(100, 110).tolist())
+        self.assertEqual(self.tile(tiff), self.tile(png))
+
+    def test_over_pixel_limit(self):
+        from PIL import Image
+        tiff = write_image(os.path.join(self.tmp_dir, 'map.tif'), format='TIFF')
+        png = write_image(os.path.join(self.tmp_dir, 'map.png'))
+        expected = self.tile(png)
+        Image.MAX_IMAGE_PIXELS = 1000
+        self.assertEqual(self.tile(tiff), expected)
+        self.assertEqual(self.tile(png), expected)
+        self.assertEqual(Image.MAX_IMAGE_PIXELS, 1000)
+
+
+class ReplaceImageTest(TestCase):
+    """
+    Tests that uploading a file with the previous image's name updates its
+    tileset in place
+    """
+    def setUp(self):
+        set_loupe_settings(self, TILER='loupe.tilers.pillow.PillowTiler',
+                           TILING_EXECUTOR='sync', INCREMENTAL_TILING=True,
+                           LAZY_LEVELS=0)
+        self.storage = use_image_storage(self, deferred=False)
+        self.tmp_dir = make_temp_dir(self)
+
+    def upload(self, image, changed=False):
+        from django.core.files import File
+        from PIL import Image
+        path = write_image(os.path.join(self.tmp_dir, 'map.png'))
+        if changed:
+            # Only the bottom right tile of the full size level changes
+            pixels = Image.open(path)
+            pixels.paste((255, 0, 0), (550, 350, 600, 400))
+            pixels.save(path)
+        source = open(path, 'rb')
+        self.addCleanup(source.close)
+        image.image = File(source, 'map.png')
+
+    def create_image(self):
+        from .models import LoupeImage
+        image = LoupeImage(name='Map', slug='map')
+        self.upload(image)
+        image.save()
+        return LoupeImage.objects.get(pk=image.pk)
+
+    def test_replace(self):
+        from .manifest import TilesetManifest
+        image = self.create_image()
+        self.assertEqual(image.image.name, 'loupe/map/map.png')
+        self.upload(image, changed=True)
+        image.save()
+        self.assertEqual(image.image.name, 'loupe/map/map.png')
+        self.assertEqual(self.storage.listdir('loupe/map')[1].count('map.png.replaced'), 0)
+        manifest = TilesetManifest.load(self.storage.path('loupe/map/map'))
+        self.assertTrue('10/2_1.jpg' in manifest['changed'])
+        self.assertFalse('10/0_0.jpg' in manifest['changed'])
+
+    def test_failed_save_puts_back(self):
+        from django.db import IntegrityError
+        from .manifest import TilesetManifest
+        image = self.create_image()
+        tiles = TilesetManifest.load(self.storage.path('loupe/map/map'))['tiles']
+        self.upload(image, changed=True)
+        image.slug = None
+        self.assertRaises(IntegrityError, image.save)
+        self.assertTrue(self.storage.exists('loupe/map/map.png'))
+        self.assertFalse(self.storage.exists('loupe/map/map.png.replaced'))
+        self.assertEqual(
+            TilesetManifest.load(self.storage.path('loupe/map/map'))['tiles'], tiles)
+
+    def test_manifest_removed_tiles(self):
+        from .manifest import TilesetManifest
+        dest_path = os.path.join(self.tmp_dir, 'tiles')
+        os.makedirs(os.path.join("%s_files" % dest_path, '1'))
+        manifest = TilesetManifest(dest_path, {'format': 'jpg'})
+        for key in ('1/0_0.jpg', '1/1_0.jpg'):
+            self.assertTrue(manifest.update(key, key))
+            open(manifest.get_tile_path(key), 'w').close()
+        manifest.save()
+        manifest = TilesetManifest(dest_path, {'format': 'jpg'})
+        self.assertFalse(manifest.update('1/0_0.jpg', '1/0_0.jpg'))
+        manifest.save()
+        self.assertEqual(manifest.removed, ['1/1_0.jpg'])
+        self.assertFalse(os.path.exists(manifest.get_tile_path('1/1_0.jpg')))
+        # Tiles made with other options are never reused
+        manifest = TilesetManifest(dest_path, {'format': 'png'})
+        self.assertTrue(manifest.update('1/0_0.jpg', '1/0_0.jpg'))
+
+
+class FlakyStorage(object):
+    """
+    Saves to ``storage``, failing for the names in ``failures`` once
+    """
+    def __init__(self, storage, failures, created):
+        self.storage = storage
+        self.failures = failures
+        created.append(self)
+
+    def save(self, name, content):
+        if name in self.failures:
+            self.failures.remove(name)
+            raise IOError("Connection reset")
+        return self.storage.save(name, content)
+
+    def delete(self, name):
+        self.storage.delete(name)
+
+
+class TransferTest(TestCase):
+    """
+    Tests that tilesets are transferred with one remote storage per thread,
+    and resumed from the checkpoint
+    """
+    def setUp(self):
+        from django.core.files.base import ContentFile
+        from django.core.files.storage import FileSystemStorage
+        set_loupe_settings(self, TILER='loupe.tilers.pillow.PillowTiler', LAZY_LEVELS=0)
+        self.local = use_image_storage(self, deferred=False)
+        self.remote = FileSystemStorage(location=make_temp_dir(self))
+        path = write_image(os.path.join(make_temp_dir(self), 'map.png'))
+        self.name = self.local.save('loupe/map/map.png', ContentFile(open(path, 'rb').read()))
+
+    def transfer(self, failures, created, token='1'):
+        from .transfer import TilesetTransfer
+        transfer = TilesetTransfer(
+            self.local, self.remote, threads=2, token=token,
+            remote_factory=lambda: FlakyStorage(self.remote, failures, created))
+        return transfer, transfer.run(self.name)
+
+    def test_resume(self):
+        created = []
+        failures = ['loupe/map/map_files/10/0_0.jpg']
+        transfer, transferred = self.transfer(failures, created)
+        self.assertFalse(transferred)
+        self.assertFalse(self.remote.exists('loupe/map/map_files/10/0_0.jpg'))
+        self.assertTrue(self.remote.exists('loupe/map/map.dzi'))
+        self.assertTrue(self.local.exists('loupe/map/map.transfer'))
+        self.assertTrue(0 < len(created) <= 2)
+        # Only the missing file is sent again
+        transfer, transferred = self.transfer(failures, created)
+        self.assertTrue(transferred)
+        self.assertEqual(transfer.files_done, 1)
+        self.assertTrue(self.remote.exists('loupe/map/map_files/10/0_0.jpg'))
+        self.assertFalse(self.local.exists('loupe/map/map.transfer'))
+
+    def test_new_token_starts_over(self):
+        created = []
+        failures = ['loupe/map/map_files/10/0_0.jpg']
+        first, transferred = self.transfer(failures, created)
+        transfer, transferred = self.transfer(failures, created, token='2')
+        self.assertTrue(transferred)
+        self.assertEqual(transfer.files_done, first.files_done + 1)
+
+    def test_deep_copies_remote(self):
+        from .transfer import TilesetTransfer
+        transfer = TilesetTransfer(self.local, self.remote)
+        self.assertFalse(transfer.get_remote() is self.remote)
+        self.assertTrue(transfer.get_remote() is transfer.get_remote())
+
+
+class ArchiveTest(TestCase):
+    """
+    Tests that packed tiles are read back from their archives
+    """
+    def setUp(self):
+        from django.core.files.storage import FileSystemStorage
+        from .archive import INDEX_CACHE
+        from .tilers.pillow import PillowTiler
+        self.storage = FileSystemStorage(location=make_temp_dir(self))
+        self.dest_path = self.storage.path('map')
+        path = write_image("%s.png" % self.dest_path)
+        self.assertTrue(PillowTiler(lazy_levels=0).create_tileset(path, self.dest_path))
+        self.tiles = {}
+        for key in ('10/2_1.jpg', '9/0_0.jpg', '0/0_0.jpg'):
+            self.tiles[key] = open("%s_files/%s" % (self.dest_path, key), 'rb').read()
+        INDEX_CACHE.clear()
+
+    def assertTiles(self):
+        from .archive import get_tile_data
+        for key, data in self.tiles.items():
+            self.assertEqual(get_tile_data(self.storage, 'map', key), data)
+        self.assertEqual(get_tile_data(self.storage, 'map', '10/9_9.jpg'), None)
+
+    def test_packed(self):
+        from .archive import pack_tileset
+        set_loupe_settings(self, TILE_LAYOUT='packed', TILE_ARCHIVE_PER_LEVEL=False)
+        pack_tileset(self.dest_path)
+        self.assertFalse(os.path.exists("%s_files" % self.dest_path))
+        self.assertTrue(self.storage.exists('map.tiles'))
+        self.assertTiles()
+
+    def test_remote_range(self):
+        import urllib2
+        from io import BytesIO
+        from django.core.files.storage import Storage
+        from .archive import TileArchive
+        requests = []
+
+        class RemoteStorage(Storage):
+            def url(self, name):
+                return 'http://example.com/%s' % name
+
+        class Response(BytesIO):
+            def __init__(self, data, code):
+                BytesIO.__init__(self, data)
+                self.code = code
+
+            def getcode(self):
+                return self.code
+
+        def urlopen(request, timeout=None):
+            requests.append((request.get_header('Range'), timeout))
+            return Response(b'0123456789'[2:5] if code == 206 else b'0123456789', code)
+        self.addCleanup(setattr, urllib2, 'urlopen', urllib2.urlopen)
+        urllib2.urlopen = urlopen
+        archive = TileArchive(RemoteStorage(), 'map.tiles')
+        code = 206
+        self.assertEqual(archive.read_range(2, 3), b'234')
+        self.assertEqual(requests, [('bytes=2-4', 10)])
+        code = 200
+        self.assertRaises(IOError, archive.read_range, 2, 3)
+
+    def test_packed_per_level(self):
+        from .archive import pack_tileset
+        set_loupe_settings(self, TILE_LAYOUT='packed', TILE_ARCHIVE_PER_LEVEL=True)
+        pack_tileset(self.dest_path, per_level=True)
+        self.assertTrue(self.storage.exists('map.10.tiles'))
+        self.assertTrue(self.storage.exists('map.0.tiles'))
+        self.assertTiles()
+
+    def test_loose_tiles(self):
+        # Tilesets created before tiles were packed are read from their files
+        set_loupe_settings(self, TILE_LAYOUT='packed', TILE_ARCHIVE_PER_LEVEL=False)
+        self.assertTiles()
+
+    def test_not_an_archive(self):
+        from .archive import TileArchive
+        open(self.storage.path('map.tiles'), 'wb').write(b'x' * 100)
+        self.assertRaises(IOError, TileArchive(self.storage, 'map.tiles').get_tile, '0/0_0.jpg')
+
+
+class LazyLevelTest(TestCase):
+    """
+    Tests that only sources read a region at a time have lazy levels
+    """
+    def setUp(self):
+        from . import lazy
+        set_loupe_settings(self, LAZY_LEVELS=1, LAZY_TILE_CACHE_DIR=make_temp_dir(self))
+        self.tmp_dir = make_temp_dir(self)
+        lazy.SIZE_CACHE.clear()
+        # The disk cache is created again in the temporary directory
+        self.addCleanup(setattr, lazy, '_disk_cache', None)
+        lazy._disk_cache = None
+
+    def tile(self, path, lazy_levels=1):
+        from .tilers.pillow import PillowTiler
+        dest_path = os.path.splitext(path)[0]
+        self.assertTrue(PillowTiler(lazy_levels=lazy_levels).create_tileset(path, dest_path))
+        return "%s_files" % dest_path
+
+    def get_image(self, path):
+        from django.core.files.storage import FileSystemStorage
+        from .models import LoupeImage
+        image = LoupeImage(name='Map', slug='map', image=os.path.basename(path))
+        image.image.storage = FileSystemStorage(location=self.tmp_dir)
+        return image
+
+    def test_tiff(self):
+        from .lazy import get_lazy_tile, is_lazy_level
+        path = write_image(os.path.join(self.tmp_dir, 'map.tif'), format='TIFF')
+        files_path = self.tile(path)
+        self.assertFalse(os.path.exists(os.path.join(files_path, '10')))
+        image = self.get_image(path)
+        self.assertTrue(is_lazy_level(image.image, 10))
+        self.assertFalse(is_lazy_level(image.image, 9))
+        data = get_lazy_tile(image, 'map', 10, 2, 1)
+        expected = os.path.join(self.tile(path, lazy_levels=0), '10', '2_1.jpg')
+        self.assertEqual(data, open(expected, 'rb').read())
+        self.assertEqual(get_lazy_tile(image, 'map', 10, 9, 9), None)
+
+    def test_decoded_whole(self):
+        from .lazy import get_lazy_tile, is_lazy_level
+        path = write_image(os.path.join(self.tmp_dir, 'map.png'))
+        files_path = self.tile(path)
+        self.assertTrue(os.path.exists(os.path.join(files_path, '10', '2_1.jpg')))
+        image = self.get_image(path)
+        self.assertFalse(is_lazy_level(image.image, 10))
+        self.assertEqual(get_lazy_tile(image, 'map', 10, 2, 1), None)
+
+    def test_over_pixel_limit(self):
+        from PIL import Image
+        from .lazy import is_lazy_level
+        path = write_image(os.path.join(self.tmp_dir, 'map.tif'), format='TIFF')
+        self.addCleanup(setattr, Image, 'MAX_IMAGE_PIXELS', Image.MAX_IMAGE_PIXELS)
+        Image.MAX_IMAGE_PIXELS = 1000
+        self.assertTrue(is_lazy_level(self.get_image(path).image, 10))
+
+
+class ExternalThumbnailTest(TestCase):
+    """
+    Tests that thumbnails of external images are made within the limits
+    """
+    def setUp(self):
+        from io import BytesIO
+        from PIL import Image
+        self.addCleanup(setattr, Image, 'MAX_IMAGE_PIXELS', Image.MAX_IMAGE_PIXELS)
+        self.source = BytesIO()
+        Image.new('RGB', (600, 400)).save(self.source, 'PNG')
+        self.source.seek(0)
+
+    def test_make_thumbnail(self):
+        from io import BytesIO
+        from PIL import Image
+        from .download_external_img import make_thumbnail
+        size, content = make_thumbnail(self.source, 200)
+        self.assertEqual(size, (600, 400))
+        self.assertEqual(Image.open(BytesIO(content.read())).size, (200, 133))
+
+    def test_too_many_pixels(self):
+        from .download_external_img import make_thumbnail
+        self.assertRaises(IOError, make_thumbnail, self.source, 200, 1000)
+
+    def test_decompression_bomb(self):
+        from PIL import Image
+        from .download_external_img import make_thumbnail
+        Image.MAX_IMAGE_PIXELS = 1000
+        self.assertRaises(IOError, make_thumbnail, self.source, 200, 10 ** 9)
+        self.assertEqual(Image.MAX_IMAGE_PIXELS, 1000)
+
+    def test_thumbnail_name(self):
+        from .download_external_img import get_thumbnail_name
+        self.assertEqual(get_thumbnail_name('http://example.com/maps/map.dzi'), 'map.jpg')
+        self.assertEqual(get_thumbnail_name('http://example.com/iiif/map/info.json'), 'map.jpg')
+        self.assertEqual(get_thumbnail_name('http://example.com/'), 'thumbnail.jpg')
+
+    def test_given_metadata(self):
+        from . import descriptors, download_external_img
+        fetched = []
+
+        def django_website_image(url, size=None):
+            fetched.append(url)
+            return 'tile.jpg', (1, 1), None
+        self.addCleanup(setattr, download_external_img, 'django_website_image',
+                        download_external_img.django_website_image)
+        download_external_img.django_website_image = django_website_image
+        self.addCleanup(setattr, descriptors, 'get_metadata', descriptors.get_metadata)
+        descriptors.get_metadata = None
+        name, size, content = download_external_img.create_external_thumbnail(
+            'dzi', 'http://example.com/maps/map.dzi',
+            metadata=descriptors.TilesetMetadata(1500, 900, 254, 1))
+        self.assertEqual(name, 'map.jpg')
+        self.assertEqual(len(fetched), 1)
+
+
+class PyramidTest(TestCase):
+    """
+    Tests that thumbnails are made from the levels of the tileset
+    """
+    def setUp(self):
+        from .tilers.pillow import PillowTiler
+        self.tmp_dir = make_temp_dir(self)
+        self.dest_path = os.path.join(self.tmp_dir, 'map')
+        path = write_image("%s.png" % self.dest_path)
+        self.assertTrue(PillowTiler(lazy_levels=0).create_tileset(path, self.dest_path))
+
+    def test_level_for(self):
+        from .pyramid import PyramidReader
+        reader = PyramidReader(self.dest_path)
+        self.assertEqual(reader.get_level_for(200), 9)
+        self.assertEqual(reader.get_level_for(150, 100), 8)
+        self.assertEqual(reader.get_level_for(5000), 10)
+
+    def test_read_level(self):
+        from PIL import Image
+        from .pyramid import PyramidReader
+        level = PyramidReader(self.dest_path).read_level(9)
+        self.assertEqual(level.size, (300, 200))
+        # A tile from the second column is pasted in place
+        tile = Image.open(os.path.join("%s_files" % self.dest_path, '9', '1_0.jpg'))
+        self.assertEqual(level.getpixel((260, 100)), tile.getpixel((260 - 253, 100)))
+
+    def test_thumbnails(self):
+        from PIL import Image
+        from .pyramid import create_pyramid_thumbnails
+        sizes = [(os.path.join(self.tmp_dir, 'thumb_%s.jpg' % size), size)
+                 for size in (100, 200)]
+        self.assertTrue(create_pyramid_thumbnails(self.dest_path, sizes))
+        self.assertEqual(Image.open(sizes[0][0]).size, (100, 66))
+        self.assertEqual(Image.open(sizes[1][0]).size, (200, 133))
+
+    def test_missing_tiles(self):
+        from .pyramid import create_pyramid_thumbnails
+        os.remove(os.path.join("%s_files" % self.dest_path, '9', '1_0.jpg'))
+        path = os.path.join(self.tmp_dir, 'thumb.jpg')
+        self.assertFalse(create_pyramid_thumbnails(self.dest_path, [(path, 200)]))
+        self.assertFalse(create_pyramid_thumbnails(
+            os.path.join(self.tmp_dir, 'other'), [(path, 200)]))
+
+
+class DerivativeTest(TestCase):
+    """
+    Tests that resized copies are only made for the signed URLs the site
+    links to
+    """
+    def setUp(self):
+        from django.core.files.base import ContentFile
+        from .derivatives import EXISTING
+        from .models import LoupeImage
+        set_loupe_settings(self, TILER='loupe.tilers.pillow.PillowTiler', LAZY_LEVELS=0,
+                           LAZY_TILE_CACHE_DIR=make_temp_dir(self))
+        self.storage = use_image_storage(self, deferred=False)
+        path = write_image(os.path.join(make_temp_dir(self), 'map.png'))
+        name = self.storage.save('loupe/map/map.png', ContentFile(open(path, 'rb').read()))
+        self.image = LoupeImage.objects.create(name='Map', slug='map', image=name)
+        EXISTING.clear()
+
+    def test_signed(self):
+        from PIL import Image
+        resized = self.image.image.derivative(200, 0, 'png')
+        self.assertTrue('?signature=' in resized.url)
+        response = self.client.get(resized.url)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(self.storage.exists('loupe/map/map_derivatives/200x0.png'))
+        self.assertEqual(Image.open(self.storage.path(resized.name)).size, (200, 133))
+        self.assertFalse('?signature=' in resized.url)
+
+    def test_unsigned(self):
+        from django.core.urlresolvers import reverse
+        url = reverse('loupeimage-derivative', kwargs={
+            'slug': 'map', 'width': 300, 'height': 0, 'format': 'jpg'})
+        self.assertEqual(self.client.get(url).status_code, 404)
+        signature = self.image.image.derivative(200, 0, 'jpg').signature
+        self.assertEqual(self.client.get(url, {'signature': signature}).status_code, 404)
+        self.assertFalse(self.storage.exists('loupe/map/map_derivatives/300x0.jpg'))
+
+    def test_unsupported(self):
+        self.assertRaises(ValueError, self.image.image.derivative, 5000)
+        self.assertRaises(ValueError, self.image.image.derivative, 200, 0, 'gif')
+
+    def test_template_tags(self):
+        from .templatetags.loupe_tags import loupe_derivative_url, loupe_srcset
+        self.assertEqual(loupe_derivative_url(self.image.image, 200, 0, 'gif'), '')
+        self.assertEqual(loupe_derivative_url(self.image.image, 5000), '')
+        srcset = loupe_srcset(self.image.image, '200,big,5000,400')
+        self.assertEqual([source.split(' ')[1] for source in srcset.split(', ')],
+                         ['200w', '400w'])
+
+
+class ThumbnailFieldsTest(TestCase):
+    """
+    Tests that the recorded thumbnail follows the thumbnail field, and can be
+    recorded for existing images
+    """
+    def setUp(self):
+        self.storage = use_image_storage(self)
+
+    def test_remove_thumbnail(self):
+        from .models import LoupeImage
+        image = LoupeImage.objects.create(name='Map', slug='map', thumbnail='thumbs/map.jpg')
+        self.assertTrue(image.has_thumbnail)
+        self.assertTrue(image.thumbnail_url.endswith('thumbs/map.jpg'))
+        image = LoupeImage.objects.get(pk=image.pk)
+        image.thumbnail = ''
+        image.save()
+        image = LoupeImage.objects.get(pk=image.pk)
+        self.assertFalse(image.has_thumbnail)
+        self.assertEqual(image.thumbnail_url, '')
+
+    def test_remove_thumbnail_of_upload(self):
+        from django.core.files.base import ContentFile
+        from .models import LoupeImage
+        self.storage.save_without_tiling('loupe/map/map_thumb.jpg', ContentFile(b'jpg'))
+        image = LoupeImage.objects.create(name='Map', slug='map',
+            image='loupe/map/map.png', thumbnail='thumbs/map.jpg')
+        image = LoupeImage.objects.get(pk=image.pk)
+        image.thumbnail = ''
+        image.save()
+        image = LoupeImage.objects.get(pk=image.pk)
+        self.assertTrue(image.has_thumbnail)
+        self.assertTrue(image.thumbnail_url.endswith('loupe/map/map_thumb.jpg'))
+
+    def test_refresh(self):
+        from django.core.files.base import ContentFile
+        from django.core.management import call_command
+        from .models import LoupeImage
+        self.storage.save_without_tiling('loupe/a/a_thumb.jpg', ContentFile(b'jpg'))
+        LoupeImage.objects.bulk_create([
+            LoupeImage(name='A', slug='a', image='loupe/a/a.png'),
+            LoupeImage(name='B', slug='b', image='loupe/b/b.png'),
+            LoupeImage(name='C', slug='c', thumbnail='thumbs/c.jpg'),
+        ])
+        call_command('loupe_refresh_metadata', stdout=open(os.devnull, 'w'))
+        images = dict((image.slug, image) for image in LoupeImage.objects.all())
+        self.assertTrue(images['a'].has_thumbnail)
+        self.assertTrue(images['a'].thumbnail_url.endswith('loupe/a/a_thumb.jpg'))
+        self.assertFalse(images['b'].has_thumbnail)
+        self.assertTrue(images['c'].has_thumbnail)
+        self.assertTrue(images['c'].thumbnail_url.endswith('thumbs/c.jpg'))
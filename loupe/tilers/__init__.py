@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+Tilers create the Deep Zoom tileset and the thumbnail for an image
+"""
+import math
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+
+from ..manifest import TilesetManifest, get_digest
+
+DZI_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="%(format)s" Overlap="%(overlap)s" TileSize="%(tile_size)s">
+  <Size Height="%(height)s" Width="%(width)s"/>
+</Image>
+"""
+
+
+# The options of a tile profile that aren't set in ``TILE_PROFILES``
+PROFILE_DEFAULTS = {
+    'format': 'jpg',
+    'quality': 85,
+    # '4:4:4', '4:2:2' or '4:2:0'
+    'subsampling': '4:2:0',
+    'progressive': False,
+    'strip': True,
+    # The format of images with transparency, '' drops the transparency
+    'alpha_format': 'png',
+}
+
+
+def get_tile_profile(profile=None):
+    """
+    Return the options of a profile named in ``TILE_PROFILES``, or of the
+    profile ``TILE_PROFILE`` when ``profile`` is empty or unknown. A dict is
+    used as the profile itself.
+    """
+    from ..settings import TILE_PROFILE, TILE_PROFILES
+    if not isinstance(profile, dict):
+        profile = TILE_PROFILES.get(profile or TILE_PROFILE,
+                                    TILE_PROFILES.get(TILE_PROFILE, {}))
+    options = PROFILE_DEFAULTS.copy()
+    options.update(profile)
+    return options
+
+
+# Pillow reads its decompression bomb limit from a module global, which is
+# only changed while this lock is held
+PIXEL_LIMIT_LOCK = threading.Lock()
+
+
+@contextmanager
+def pixel_limit_lifted():
+    """
+    Turn off Pillow's decompression bomb check, which refuses the very large
+    images tiled here, for images stored by the site. Images from other
+    sites are opened with the check, while holding ``PIXEL_LIMIT_LOCK``.
+    """
+    from PIL import Image
+    with PIXEL_LIMIT_LOCK:
+        limit = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None
+        try:
+            yield
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+
+
+def open_image(image_path):
+    """
+    Open an image stored by the site with Pillow, without the decompression
+    bomb check
+    """
+    from PIL import Image
+    with pixel_limit_lifted():
+        return Image.open(image_path)
+
+
+def has_alpha(image):
+    """
+    Return ``True`` if the Pillow image has transparency
+    """
+    return image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+
+
+def get_level_sizes(width, height):
+    """
+    Return the (width, height) of every Deep Zoom level, from level 0 (1x1)
+    to the full size of the image
+    """
+    max_level = int(math.ceil(math.log(max(width, height, 1), 2)))
+    sizes = []
+    for level in range(max_level + 1):
+        scale = 2 ** (max_level - level)
+        sizes.append((
+            int(math.ceil(width / float(scale))),
+            int(math.ceil(height / float(scale)))))
+    return sizes
+
+
+def get_tile_span(index, tile_size, overlap, length):
+    """
+    Return the start and end pixel of the tile ``index`` along one axis,
+    including the overlap with its neighbours
+    """
+    start = max(index * tile_size - overlap, 0)
+    end = min((index + 1) * tile_size + overlap, length)
+    return start, end
+
+
+class BaseTiler(object):
+    """
+    Subclasses implement ``create_tileset`` and ``create_thumbnail`` and
+    return ``True`` when successful. While tiling they call ``progress``,
+    when set, with the fraction of the tileset done.
+    """
+    progress = None
+
+    def __init__(self, tile_size=None, overlap=None, profile=None):
+        from ..settings import TILE_SIZE, TILE_OVERLAP
+        if overlap is None:
+            overlap = TILE_OVERLAP
+        self.tile_size = tile_size or TILE_SIZE
+        self.overlap = overlap
+        self.profile = get_tile_profile(profile)
+        self.select_format(False)
+
+    def report_progress(self, fraction):
+        if self.progress is not None:
+            self.progress(min(fraction, 1.0))
+
+    def select_format(self, alpha):
+        """
+        Encode the tiles of an image with transparency in the profile's
+        ``alpha_format``, and other images in its ``format``
+        """
+        self.alpha = bool(alpha and self.profile['alpha_format'])
+        if self.alpha:
+            self.format = self.profile['alpha_format']
+        else:
+            self.format = self.profile['format']
+        return self.format
+
+    def select_format_for(self, image_path):
+        image = open_image(image_path)
+        try:
+            return self.select_format(has_alpha(image))
+        finally:
+            image.close()
+
+    def create_tileset(self, image_path, dest_path):
+        """
+        Write ``<dest_path>.dzi`` and the tiles in ``<dest_path>_files``
+        """
+        raise NotImplementedError
+
+    def create_thumbnail(self, image_path, dest_path, size):
+        """
+        Write a JPEG no larger than ``size`` in either dimension
+        """
+        raise NotImplementedError
+
+    def write_descriptor(self, dest_path, width, height):
+        """
+        Write the DZI file describing the tileset
+        """
+        dzi_file = open("%s.dzi" % dest_path, 'w')
+        try:
+            dzi_file.write(DZI_TEMPLATE % {
+                'format': self.format,
+                'overlap': self.overlap,
+                'tile_size': self.tile_size,
+                'width': width,
+                'height': height,
+            })
+        finally:
+            dzi_file.close()
+
+    def get_options(self):
+        """
+        Return the options that change the output of the tiler. Tiles made
+        with different options are never reused.
+        """
+        options = self.profile.copy()
+        options.update({
+            'tiler': self.__class__.__name__,
+            'tile_size': self.tile_size,
+            'overlap': self.overlap,
+            'format': self.format,
+        })
+        return options
+
+    def get_manifest(self, dest_path):
+        return TilesetManifest(dest_path, self.get_options())
+
+    def sync_tiles(self, source_path, dest_path):
+        """
+        Move the tiles in ``<source_path>_files`` whose contents differ from
+        the tileset's manifest into ``<dest_path>_files``, delete the tiles
+        that no longer exist and save the manifest
+        """
+        manifest = self.get_manifest(dest_path)
+        source_files = "%s_files" % source_path
+        for dirpath, dirnames, filenames in os.walk(source_files):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                key = os.path.relpath(path, source_files).replace(os.sep, '/')
+                tile_file = open(path, 'rb')
+                try:
+                    digest = get_digest(tile_file.read())
+                finally:
+                    tile_file.close()
+                if manifest.update(key, digest):
+                    tile_path = manifest.get_tile_path(key)
+                    if not os.path.isdir(os.path.dirname(tile_path)):
+                        os.makedirs(os.path.dirname(tile_path))
+                    shutil.move(path, tile_path)
+        manifest.save()
+        shutil.rmtree(source_files)
+        return manifest
+
+    def get_tile_path(self, dest_path, level, column, row):
+        """
+        Return the path of a tile, creating its level directory when needed
+        """
+        level_path = os.path.join("%s_files" % dest_path, str(level))
+        if not os.path.isdir(level_path):
+            os.makedirs(level_path)
+        return os.path.join(level_path, self.get_tile_name(column, row))
+
+    def get_tile_name(self, column, row):
+        return "%s_%s.%s" % (column, row, self.format)
+
+
+def get_tiler(path=None, profile=None):
+    """
+    Return an instance of the tiler set in the ``TILER`` setting, encoding
+    tiles with the tile ``profile``
+    """
+    from django.utils.importlib import import_module
+    from ..settings import TILER
+
+    module_name, class_name = (path or TILER).rsplit('.', 1)
+    return getattr(import_module(module_name), class_name)(profile=profile)
@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+"""
+A Deep Zoom tiler using Pillow and NumPy, without any external binaries
+"""
+import logging
+import os
+import tempfile
+import time
+from io import BytesIO
+
+import numpy
+from PIL import Image
+
+from . import BaseTiler, get_level_sizes, get_tile_span, open_image
+from ..manifest import get_digest
+from .readers import get_strip_reader
+
+logger = logging.getLogger(__name__)
+
+RESAMPLE = getattr(Image, 'LANCZOS', None) or Image.ANTIALIAS
+
+SAVE_FORMATS = {'jpg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP', 'avif': 'AVIF'}
+
+SUBSAMPLING = {'4:4:4': 0, '4:2:2': 1, '4:2:0': 2}
+
+
+class LevelWriter(object):
+    """
+    Receives the rows of one pyramid level from top to bottom and writes each
+    row of tiles as soon as all of its pixels, overlap included, have arrived
+    """
+    def __init__(self, tiler, dest_path, level, width, height):
+        self.tiler = tiler
+        self.dest_path = dest_path
+        self.level = level
+        self.width = width
+        self.height = height
+        self.num_columns = -(-width // tiler.tile_size)
+        self.num_rows = -(-height // tiler.tile_size)
+        self.buffer = None
+        self.top = 0
+        self.received = 0
+        self.row = 0
+        self.seconds = 0.0
+        self.tiles = 0
+        self.bytes = 0
+
+    def get_stats(self):
+        return {'level': self.level, 'duration': self.seconds,
+                'bytes': self.bytes, 'tiles': self.tiles}
+
+    def add_rows(self, rows):
+        if self.buffer is None or not len(self.buffer):
+            self.buffer = rows
+        else:
+            self.buffer = numpy.concatenate((self.buffer, rows))
+        self.received += len(rows)
+        tile_size, overlap = self.tiler.tile_size, self.tiler.overlap
+        while self.row < self.num_rows:
+            start, end = get_tile_span(self.row, tile_size, overlap, self.height)
+            if self.received < end:
+                break
+            self.write_row(self.buffer[start - self.top:end - self.top])
+            self.row += 1
+            # Only the overlap of this row is needed by the next one
+            keep = max(self.row * tile_size - overlap, 0)
+            self.buffer = self.buffer[keep - self.top:]
+            self.top = keep
+
+    def write_row(self, rows):
+        tile_size, overlap = self.tiler.tile_size, self.tiler.overlap
+        started = time.time()
+        for column in range(self.num_columns):
+            start, end = get_tile_span(column, tile_size, overlap, self.width)
+            written = self.tiler.save_tile(
+                rows[:, start:end], self.dest_path, self.level, column, self.row)
+            if written is not None:
+                self.tiles += 1
+                self.bytes += written
+            self.tiler.tile_done()
+        self.seconds += time.time() - started
+
+
+class RowReducer(object):
+    """
+    Halves rows in both dimensions by averaging each 2x2 block of pixels.
+    An odd last row or column is averaged with itself.
+    """
+    def __init__(self):
+        self.leftover = None
+
+    def reduce(self, rows):
+        if self.leftover is not None:
+            rows = numpy.concatenate((self.leftover, rows))
+            self.leftover = None
+        if len(rows) % 2:
+            self.leftover = rows[-1:]
+            rows = rows[:-1]
+        return self.halve(rows)
+
+    def flush(self):
+        """
+        Return the reduction of the last row of an odd height level
+        """
+        if self.leftover is None:
+            return None
+        rows = numpy.concatenate((self.leftover, self.leftover))
+        self.leftover = None
+        return self.halve(rows)
+
+    def halve(self, rows):
+        if rows is None or not len(rows):
+            return None
+        if rows.shape[1] % 2:
+            rows = numpy.concatenate((rows, rows[:, -1:]), axis=1)
+        height, width, bands = rows.shape
+        blocks = rows.reshape(height // 2, 2, width // 2, 2, bands)
+        total = blocks.astype(numpy.uint16).sum(axis=3).sum(axis=1)
+        return ((total + 2) // 4).astype(numpy.uint8)
+
+
+class SpooledLevel(object):
+    """
+    Collects the rows of a reduced level in a temporary file, and reads them
+    back a strip at a time
+    """
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.shape = None
+
+    def append(self, rows):
+        if rows is None or not len(rows):
+            return
+        self.shape = rows.shape[1:]
+        self.file.write(numpy.ascontiguousarray(rows).tobytes())
+
+    def strips(self, strip_height):
+        try:
+            if self.shape is None:
+                return
+            row_bytes = int(numpy.prod(self.shape))
+            self.file.seek(0)
+            while True:
+                data = self.file.read(row_bytes * strip_height)
+                if not data:
+                    break
+                yield numpy.frombuffer(data, numpy.uint8).reshape((-1, ) + self.shape)
+        finally:
+            self.file.close()
+
+
+def halve_region(rows):
+    """
+    Halve a region the same way the levels of a tileset are reduced
+    """
+    reducer = RowReducer()
+    halved = [reducer.reduce(rows), reducer.flush()]
+    return numpy.concatenate([r for r in halved if r is not None])
+
+
+class PillowTiler(BaseTiler):
+    """
+    Reads the source in horizontal strips and tiles the full resolution level
+    strip by strip. Each smaller level is reduced from the previous level
+    rather than from the source.
+
+    When ``streaming``, every level is built at the same time: each strip is
+    tiled, reduced and passed on to the next level, so memory grows with the
+    width of the image rather than its area. Otherwise each level is tiled in
+    turn, and the next level, a quarter of the previous one, is written to a
+    temporary file as it is reduced.
+
+    Uncompressed strip TIFFs are memory mapped a strip at a time. Pillow
+    decodes other formats whole.
+
+    The ``lazy_levels`` deepest levels are reduced but not written. Their
+    tiles are rendered from the source when first requested, so only sources
+    whose reader reads regions without decoding the whole image have lazy
+    levels.
+
+    After tiling, ``level_stats`` holds the seconds spent writing each level
+    and the number and bytes of the tiles written.
+    """
+
+    def __init__(self, streaming=None, lazy_levels=None, **kwargs):
+        from ..settings import TILE_STREAMING, LAZY_LEVELS
+        super(PillowTiler, self).__init__(**kwargs)
+        self.streaming = TILE_STREAMING if streaming is None else streaming
+        self.lazy_levels = LAZY_LEVELS if lazy_levels is None else lazy_levels
+
+    def open(self, image_path):
+        image = open_image(image_path)
+        if image.mode not in ('L', 'RGB'):
+            image = image.convert('RGB')
+        return image
+
+    def create_tileset(self, image_path, dest_path):
+        try:
+            self.select_format_for(image_path)
+            reader = get_strip_reader(image_path, self.alpha)
+            width, height = reader.size
+            sizes = get_level_sizes(width, height)
+            strips = reader.strips(self.tile_size)
+            self.manifest = self.get_manifest(dest_path)
+            self.max_level = len(sizes) - 1
+            self.skipped_levels = reader.region_reads and self.lazy_levels or 0
+            self.level_stats = []
+            self.tiles_done = 0
+            self.total_tiles = sum([
+                -(-w // self.tile_size) * -(-h // self.tile_size)
+                for level, (w, h) in enumerate(sizes) if not self.is_lazy(level)])
+            if self.streaming:
+                self.stream_levels(strips, dest_path, sizes)
+            else:
+                level = len(sizes) - 1
+                while level >= 0:
+                    strips = self.tile_level(strips, dest_path, level, sizes[level])
+                    level -= 1
+            self.level_stats.sort(key=lambda stats: stats['level'])
+            self.write_descriptor(dest_path, width, height)
+            self.manifest.save()
+        except Exception as e:
+            logger.exception(e)
+            return False
+        return True
+
+    def tile_level(self, strips, dest_path, level, size):
+        """
+        Tile one level from its strips and return the strips of the next,
+        smaller, level
+        """
+        width, height = size
+        writer = LevelWriter(self, dest_path, level, width, height)
+        reducer = RowReducer()
+        reduced = SpooledLevel()
+        for rows in strips:
+            if not self.is_lazy(level):
+                writer.add_rows(rows)
+            if level:
+                reduced.append(reducer.reduce(rows))
+        if level:
+            reduced.append(reducer.flush())
+        if not self.is_lazy(level):
+            self.level_stats.append(writer.get_stats())
+        return reduced.strips(self.tile_size)
+
+    def stream_levels(self, strips, dest_path, sizes):
+        """
+        Tile every level as the strips of the full resolution level arrive
+        """
+        writers = [
+            LevelWriter(self, dest_path, level, width, height)
+            for level, (width, height) in enumerate(sizes)]
+        reducers = [RowReducer() for size in sizes]
+
+        def add_rows(level, rows):
+            if not self.is_lazy(level):
+                writers[level].add_rows(rows)
+            if level:
+                reduced = reducers[level].reduce(rows)
+                if reduced is not None:
+                    add_rows(level - 1, reduced)
+
+        for rows in strips:
+            add_rows(len(sizes) - 1, rows)
+        for level in range(len(sizes) - 1, 0, -1):
+            reduced = reducers[level].flush()
+            if reduced is not None:
+                add_rows(level - 1, reduced)
+        self.level_stats.extend([writer.get_stats() for writer in writers
+                                 if not self.is_lazy(writer.level)])
+
+    def tile_done(self):
+        self.tiles_done += 1
+        self.report_progress(float(self.tiles_done) / max(self.total_tiles, 1))
+
+    def is_lazy(self, level):
+        return level > self.max_level - self.skipped_levels
+
+    def save_tile(self, rows, dest_path, level, column, row):
+        """
+        Encode and write the tile unless its pixels are unchanged. Returns
+        the bytes written, or ``None`` when unchanged.
+        """
+        key = "%s/%s" % (level, self.get_tile_name(column, row))
+        if not self.manifest.update(key, get_digest(rows)):
+            return None
+        path = self.get_tile_path(dest_path, level, column, row)
+        self.encode(rows, path)
+        return os.path.getsize(path)
+
+    def get_save_options(self):
+        """
+        Return the Pillow save options of the tile profile for the format
+        """
+        options = {}
+        if self.format in ('jpg', 'webp', 'avif'):
+            options['quality'] = self.profile['quality']
+        if self.format == 'jpg':
+            options['subsampling'] = SUBSAMPLING.get(self.profile['subsampling'], 2)
+            if self.profile['progressive']:
+                options['progressive'] = True
+        return options
+
+    def encode(self, rows, output):
+        """
+        Save the pixels as a tile to a path or file object. Tiles are made
+        from bare pixels, so they never carry metadata to strip.
+        """
+        if rows.shape[2] == 1:
+            rows = rows[:, :, 0]
+        Image.fromarray(rows).save(output, SAVE_FORMATS[self.format],
+                                   **self.get_save_options())
+
+    def render_tile(self, image_path, level, column, row):
+        """
+        Return the encoded tile, read and reduced from the region of the
+        source it covers, or ``None`` if the tile does not exist
+        """
+        self.select_format_for(image_path)
+        reader = get_strip_reader(image_path, self.alpha)
+        try:
+            width, height = reader.size
+            sizes = get_level_sizes(width, height)
+            if level >= len(sizes):
+                return None
+            level_width, level_height = sizes[level]
+            left, right = get_tile_span(column, self.tile_size, self.overlap, level_width)
+            top, bottom = get_tile_span(row, self.tile_size, self.overlap, level_height)
+            if left >= right or top >= bottom:
+                return None
+            scale = 2 ** (len(sizes) - 1 - level)
+            rows = reader.read_rows(top * scale, min(bottom * scale, height))
+            rows = rows[:, left * scale:min(right * scale, width)]
+        finally:
+            reader.close()
+        while scale > 1:
+            rows = halve_region(rows)
+            scale //= 2
+        output = BytesIO()
+        self.encode(rows, output)
+        return output.getvalue()
+
+    def create_thumbnail(self, image_path, dest_path, size):
+        try:
+            image = self.open(image_path)
+            image.thumbnail((size, size), RESAMPLE)
+            image.save(dest_path, 'JPEG', quality=90)
+        except Exception as e:
+            logger.exception(e)
+            return False
+        return True
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Readers return the rows of a source image in horizontal strips
+"""
+import numpy
+
+COMPRESSION = 259
+PHOTOMETRIC = 262
+STRIP_OFFSETS = 273
+SAMPLES_PER_PIXEL = 277
+ROWS_PER_STRIP = 278
+STRIP_BYTE_COUNTS = 279
+PLANAR_CONFIGURATION = 284
+TILE_WIDTH = 322
+BITS_PER_SAMPLE = 258
+
+
+def as_rows(image):
+    """
+    Return the image's pixels as a (rows, width, bands) array
+    """
+    rows = numpy.asarray(image, dtype=numpy.uint8)
+    if rows.ndim == 2:
+        rows = rows.reshape(rows.shape + (1, ))
+    return rows
+
+
+class PillowStripReader(object):
+    """
+    Crops strips from an image opened with Pillow. Pillow decodes most
+    compressed formats whole on the first crop. With ``alpha``, images with
+    transparency are read as RGBA.
+    """
+    # Whether a few rows can be read without decoding the whole image
+    region_reads = False
+
+    def __init__(self, image_path, alpha=False):
+        from . import has_alpha, open_image
+        image = open_image(image_path)
+        if alpha and has_alpha(image):
+            if image.mode != 'RGBA':
+                image = image.convert('RGBA')
+        elif image.mode not in ('L', 'RGB'):
+            image = image.convert('RGB')
+        self.image = image
+        self.size = image.size
+
+    def read_rows(self, top, bottom):
+        """
+        Return the rows from ``top`` up to ``bottom``
+        """
+        from . import pixel_limit_lifted
+        # Decode outside the lock, cropping a wide strip is checked too
+        self.image.load()
+        with pixel_limit_lifted():
+            strip = self.image.crop((0, top, self.size[0], bottom))
+        return as_rows(strip)
+
+    def strips(self, strip_height):
+        height = self.size[1]
+        for top in range(0, height, strip_height):
+            yield self.read_rows(top, min(top + strip_height, height))
+
+    def close(self):
+        self.image.close()
+
+
+def get_tag(tags, code, default=None):
+    """
+    Return a TIFF tag as a tuple, whichever way this version of PIL stores it
+    """
+    value = tags.get(code, default)
+    if value is None or isinstance(value, tuple):
+        return value
+    return (value, )
+
+
+class TiffStripReader(object):
+    """
+    Memory maps the strips of an uncompressed, 8 bits per sample, greyscale
+    or RGB TIFF. Only the rows of the current strip are mapped, so memory
+    does not grow with the height of the image. The fourth sample of an
+    RGBA TIFF is only kept with ``alpha``.
+    """
+    region_reads = True
+
+    def __init__(self, image_path, alpha=False):
+        from . import open_image
+        image = open_image(image_path)
+        try:
+            self.read_header(image_path, image)
+        finally:
+            image.close()
+        self.alpha = alpha
+        self.file = open(image_path, 'rb')
+
+    def read_header(self, image_path, image):
+        if image.format != 'TIFF':
+            raise ValueError("%s is not a TIFF" % image_path)
+        tags = getattr(image, 'tag_v2', None) or image.tag
+        self.size = width, height = image.size
+        self.samples = get_tag(tags, SAMPLES_PER_PIXEL, (1, ))[0]
+        bits = get_tag(tags, BITS_PER_SAMPLE, (1, ))
+        if (get_tag(tags, COMPRESSION, (1, ))[0] != 1 or
+                get_tag(tags, PLANAR_CONFIGURATION, (1, ))[0] != 1 or
+                get_tag(tags, PHOTOMETRIC, (0, ))[0] not in (1, 2) or
+                get_tag(tags, TILE_WIDTH) is not None or
+                set(bits) != set([8]) or
+                self.samples not in (1, 3, 4)):
+            raise ValueError("%s is not an uncompressed 8-bit strip TIFF" % image_path)
+        self.offsets = get_tag(tags, STRIP_OFFSETS)
+        self.rows_per_strip = min(get_tag(tags, ROWS_PER_STRIP, (height, ))[0], height)
+        self.row_bytes = width * self.samples
+
+    def read_rows(self, top, bottom):
+        """
+        Return the rows from ``top`` up to ``bottom``
+        """
+        width = self.size[0]
+        rows = numpy.empty((bottom - top, width, self.samples), dtype=numpy.uint8)
+        first = top // self.rows_per_strip
+        last = (bottom - 1) // self.rows_per_strip
+        for strip in range(first, last + 1):
+            strip_top = strip * self.rows_per_strip
+            start = max(top, strip_top)
+            end = min(bottom, strip_top + self.rows_per_strip)
+            data = numpy.memmap(self.file,
+                dtype=numpy.uint8,
+                mode='r',
+                offset=self.offsets[strip] + (start - strip_top) * self.row_bytes,
+                shape=((end - start) * self.row_bytes, ))
+            rows[start - top:end - top] = data.reshape(end - start, width, self.samples)
+            del data
+        if self.samples == 4 and not self.alpha:
+            rows = rows[:, :, :3]
+        return rows
+
+    def strips(self, strip_height):
+        height = self.size[1]
+        try:
+            for top in range(0, height, strip_height):
+                yield self.read_rows(top, min(top + strip_height, height))
+        finally:
+            self.close()
+
+    def close(self):
+        self.file.close()
+
+
+def get_strip_reader(image_path, alpha=False):
+    """
+    Return the most memory efficient reader for the image
+    """
+    try:
+        return TiffStripReader(image_path, alpha)
+    except (ValueError, TypeError, IOError):
+        return PillowStripReader(image_path, alpha)
+
+
+def supports_region_reads(image_path):
+    """
+    Return ``True`` if the rows of a region of the image can be read without
+    decoding all of it
+    """
+    try:
+        TiffStripReader(image_path).close()
+    except (ValueError, TypeError, IOError):
+        return False
+    return True
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+
+from . import BaseTiler
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_RE = re.compile(br'(\d+)% complete')
+
+
+class VipsTiler(BaseTiler):
+    """
+    Creates the tileset with ``vips dzsave`` and the thumbnail with
+    ``vipsthumbnail``. With ``progress``, the percentages printed by
+    ``--vips-progress`` are reported.
+    """
+    def call(self, cmd):
+        try:
+            return subprocess.call(cmd) == 0
+        except OSError as e:
+            logger.error("Unable to run '%s': %s" % (cmd[0], e))
+            return False
+
+    def call_with_progress(self, cmd):
+        """
+        Run ``cmd`` with ``--vips-progress`` and report each percentage it
+        prints
+        """
+        if self.progress is None:
+            return self.call(cmd)
+        try:
+            process = subprocess.Popen(cmd + ['--vips-progress'],
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        except OSError as e:
+            logger.error("Unable to run '%s': %s" % (cmd[0], e))
+            return False
+        output = b''
+        while True:
+            chunk = process.stdout.read(256)
+            if not chunk:
+                break
+            # Percentages are separated by carriage returns, not new lines
+            output = (output + chunk)[-256:]
+            matches = PROGRESS_RE.findall(output)
+            if matches:
+                self.report_progress(int(matches[-1]) / 100.0)
+                output = output[output.rfind(b'complete'):]
+        return process.wait() == 0
+
+    def select_format_for(self, image_path):
+        """
+        Read the number of bands from the header with ``vipsheader``, which
+        doesn't decode the image. A second or fourth band is the alpha.
+        """
+        try:
+            bands = int(subprocess.check_output(
+                ['vipsheader', '-f', 'bands', image_path]))
+        except (OSError, ValueError, subprocess.CalledProcessError):
+            return super(VipsTiler, self).select_format_for(image_path)
+        return self.select_format(bands in (2, 4))
+
+    def create_tileset(self, image_path, dest_path):
+        """
+        Tile into a temporary directory and then only replace the tiles that
+        changed since the last time the image was tiled
+        """
+        try:
+            self.select_format_for(image_path)
+        except IOError:
+            pass
+        tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(dest_path) or None)
+        tmp_path = os.path.join(tmp_dir, os.path.basename(dest_path))
+        try:
+            if not self.call_with_progress([
+                    'vips', 'dzsave', image_path, tmp_path,
+                    '--suffix', self.get_suffix(),
+                    '--tile-size', str(self.tile_size),
+                    '--overlap', str(self.overlap), ]):
+                return False
+            shutil.move("%s.dzi" % tmp_path, "%s.dzi" % dest_path)
+            self.sync_tiles(tmp_path, dest_path)
+        finally:
+            shutil.rmtree(tmp_dir, True)
+        return True
+
+    def get_suffix(self):
+        """
+        Return the tile suffix with the profile's save options, such as
+        ``.jpg[Q=85,strip]``
+        """
+        options = []
+        if self.format in ('jpg', 'webp', 'avif'):
+            options.append('Q=%s' % self.profile['quality'])
+        if self.format == 'jpg':
+            if self.profile['subsampling'] == '4:4:4':
+                options.append('no_subsample')
+            if self.profile['progressive']:
+                options.append('interlace')
+        if self.profile['strip']:
+            options.append('strip')
+        return ".%s[%s]" % (self.format, ",".join(options))
+
+    def create_thumbnail(self, image_path, dest_path, size):
+        return self.call([
+            'vipsthumbnail', image_path,
+            '--output', dest_path,
+            '--size', str(size)])
@@ -1,118 +1,157 @@
 import os
-import subprocess
-import urllib
-import re
 
-WIDTH_RE = "width=[\"\'](\d+)[\"\']"
-HEIGHT_RE = "height=[\"\'](\d+)[\"\']"
-TILESIZE_RE = "tilesize=[\"\'](\d+)[\"\']"
 
-
-def get_thumbnail_path(image_path):
+def get_thumbnail_path(image_path, size_name=None):
     """
-    Get the derived thumbnail path from the image_path
+    Get the derived thumbnail path from the image_path, for one of the
+    ``THUMBNAIL_SIZES`` or for ``THUMB_SIZE``
     """
     path, filename = os.path.split(image_path)
     name, ext = os.path.splitext(filename)
+    if size_name:
+        return os.path.join(path, "%s_thumb_%s.jpg" % (name, size_name))
     return os.path.join(path, "%s_thumb.jpg" % name)
 
 
-def create_tileset(image_path):
+def get_thumbnail_sizes(image_path):
+    """
+    Return the (path, size) of every thumbnail of the image
     """
-    Create a tileset from an image
+    from .settings import THUMB_SIZE, THUMBNAIL_SIZES
+    sizes = [(get_thumbnail_path(image_path), THUMB_SIZE)]
+    for size_name, size in sorted(THUMBNAIL_SIZES.items()):
+        sizes.append((get_thumbnail_path(image_path, size_name), size))
+    return sizes
+
+
+def create_tileset(image_path, tile_profile=None, name=None, job=None,
+                   progress=None):
     """
+    Create a tileset from an image, encoding the tiles with ``tile_profile``.
+    The time and bytes of each level are recorded for the stored file
+    ``name`` when the tiler measures them. ``progress`` is called with the
+    fraction done.
+    """
+    from .settings import TILE_LAYOUT, TILE_ARCHIVE_PER_LEVEL
+    from .metrics import record
+    from .tilers import get_tiler
+    from .archive import pack_tileset
     path, filename = os.path.split(image_path)
-    name, ext = os.path.splitext(filename)
-    dest_path = os.path.join(path, name)
-    cmd = ['vips', 'dzsave', image_path, dest_path, '--suffix', ".jpg[Q=100]", ]
-    return subprocess.call(cmd)
+    dest_path = os.path.join(path, os.path.splitext(filename)[0])
+    tiler = get_tiler(profile=tile_profile)
+    tiler.progress = progress
+    success = tiler.create_tileset(image_path, dest_path)
+    for stats in getattr(tiler, 'level_stats', []):
+        record('level', name or image_path, job=job, **stats)
+    if not success:
+        return 1
+    if TILE_LAYOUT == 'packed':
+        pack_tileset(dest_path, per_level=TILE_ARCHIVE_PER_LEVEL)
+    return 0
 
 
-def get_tileset_files(image_path):
+def estimate_tiling_memory(image_path):
+    """
+    Estimate the number of bytes needed to tile the image, as the size of the
+    decoded image. Falls back to the file size for unreadable formats.
+    """
+    from .tilers import open_image
+    try:
+        image = open_image(image_path)
+    except Exception:
+        try:
+            return os.path.getsize(image_path)
+        except OSError:
+            return 0
+    try:
+        width, height = image.size
+        return width * height * len(image.getbands())
+    finally:
+        image.close()
+
+
+def get_tileset_files(image_path, changed_only=False):
     """
     Return a list of all the files involved in the tileset for given image,
-    including the original image
+    including the original image. ``changed_only`` leaves out the tiles that
+    were unchanged the last time the image was tiled.
     """
+    from .manifest import TilesetManifest
     path, filename = os.path.split(image_path)
+    unchanged = set()
+    if changed_only:
+        dest_path = os.path.join(path, os.path.splitext(filename)[0])
+        manifest = TilesetManifest.load(dest_path)
+        files_path = "%s_files" % dest_path
+        unchanged = set([
+            os.path.join(files_path, *key.split('/'))
+            for key in set(manifest.get('tiles', {})) - set(manifest.get('changed', []))])
     file_list = []
     for dirpath, dirnames, filenames in os.walk(path):
-        file_list.extend([os.path.join(dirpath, name) for name in filenames])
+        file_list.extend([os.path.join(dirpath, name) for name in filenames
+                          if os.path.join(dirpath, name) not in unchanged])
     return file_list
 
 
-def create_thumbnail(image_path):
-    from .settings import THUMB_SIZE
-    dest_path = get_thumbnail_path(image_path)
-    cmd = [
-        'vipsthumbnail', image_path,
-        '--output', dest_path,
-        '--size', str(THUMB_SIZE)]
-    return subprocess.call(cmd)
-
-
-def get_data(url):
-    filepath, info = urllib.urlretrieve(url)
-    try:
-        return open(filepath).read()
-    except IOError:
-        return ""
+def get_removed_tileset_files(image_path):
+    """
+    Return the tiles removed from the tileset the last time it was tiled
+    """
+    from .manifest import TilesetManifest
+    path, filename = os.path.split(image_path)
+    dest_path = os.path.join(path, os.path.splitext(filename)[0])
+    files_path = "%s_files" % dest_path
+    return [os.path.join(files_path, *key.split('/'))
+            for key in TilesetManifest.load(dest_path).get('removed', [])]
 
 
-def extract_data(regex, string, flags=re.I):
+def create_thumbnail(image_path):
     """
-    Return the data from the regular expression
+    Create the thumbnails from the smallest level of the tileset that is
+    large enough, or from the image if the tileset can't be read
     """
-    result = re.search(regex, string, flags)
-    if result:
-        return result.groups()
-    else:
-        return []
+    from .pyramid import create_pyramid_thumbnails
+    from .tilers import get_tiler
+    sizes = get_thumbnail_sizes(image_path)
+    if create_pyramid_thumbnails(os.path.splitext(image_path)[0], sizes):
+        return 0
+    tiler = get_tiler()
+    for path, size in sizes:
+        if not tiler.create_thumbnail(image_path, path, size):
+            return 1
+    return 0
 
 
-def get_dzi_metadata(url):
+def get_metadata(tile_type, url):
     """
-    url should be in the format "http://domain.com/path/to/images.dzi"
+    Return the metadata of an external tileset as a dict, empty when its
+    descriptor can't be fetched or parsed
     """
-    dzi_data = get_data(url)
-    width = extract_data(WIDTH_RE, dzi_data)
-    height = extract_data(HEIGHT_RE, dzi_data)
-    tilesize = extract_data(TILESIZE_RE, dzi_data)
-    path, ext = os.path.splitext(url)
-    output = {'base_tile_url': "%s_files/" % path}
-    if width:
-        output['width'] = int(width[0])
-    if height:
-        output['height'] = int(height[0])
-    if tilesize:
-        output['tilesize'] = int(tilesize[0])
-    return output
+    from .descriptors import get_metadata as get_tileset_metadata, DescriptorError
+    try:
+        return get_tileset_metadata(tile_type, url).as_dict()
+    except (DescriptorError, IOError):
+        return {}
 
 
-def get_local_metadata(url):
+def get_dzi_metadata(url):
     """
-    For handling locally hosted images
+    url should be in the format "http://domain.com/path/to/images.dzi"
     """
-    from django.contrib.sites.models import Site
-    url = "http://%s" % Site.objects.get_current().domain
-    return get_dzi_metadata(url)
+    return get_metadata('dzi', url)
 
 
 def create_zoomify_thumbnail(url):
     """
-    Download the 0-0-0.jpg image to use as the thumbnail.
+    Download the smallest tile to use as the thumbnail.
     Returns a filename, (width, height), ContentFile tuple for saving in a field
     """
-    from .download_external_img import django_website_image
-    thumb_url = url.replace('ImageProperties.xml', 'TileGroup0/0-0-0.jpg')
-    name = "{0}.jpg".format(thumb_url.split("/")[-3])
-    filename, size, contentfile = django_website_image(thumb_url)
-    return name, size, contentfile
+    from .download_external_img import create_external_thumbnail
+    return create_external_thumbnail('zoomify', url)
 
 
 def get_zoomify_metadata(url):
     """
     url should be in the format "http://domain.com/path/to/images/ImageProperties.xml"
     """
-    zoomify_data = get_dzi_metadata(url)
-    zoomify_data['base_tile_url'] = url.replace('ImageProperties.xml', '')
-    return zoomify_data
+    return get_metadata('zoomify', url)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent, resumable transfer of a tileset to remote storage
+"""
+import copy
+import logging
+import os
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from .tileset import get_tileset_files, get_removed_tileset_files
+
+logger = logging.getLogger(__name__)
+
+
+class TilesetTransfer(object):
+    """
+    Uploads the files of a tileset from ``local`` to ``remote`` storage with a
+    pool of threads. Each thread saves through its own storage for all of its
+    files, so a storage that connects lazily keeps one connection per thread.
+    The storages are created by ``remote_factory``, or deep copied from
+    ``remote`` so they share no client.
+
+    Every transferred file is recorded in a checkpoint next to the image.
+    When the transfer fails part way, running it again with the same
+    ``token`` only uploads the files that are missing.
+    """
+    def __init__(self, local, remote, threads=None, token='', progress=None,
+                 remote_factory=None):
+        from .settings import TRANSFER_THREADS
+        self.local = local
+        self.remote = remote
+        self.remote_factory = remote_factory or (lambda: copy.deepcopy(remote))
+        self.threads = threads or TRANSFER_THREADS
+        self.token = "%s" % token
+        self.progress = progress
+        self.thread_data = threading.local()
+        self.files_done = 0
+        self.bytes_done = 0
+        self.started = None
+
+    def get_remote(self):
+        """
+        Return this thread's remote storage
+        """
+        if not hasattr(self.thread_data, 'remote'):
+            self.thread_data.remote = self.remote_factory()
+        return self.thread_data.remote
+
+    def get_checkpoint_path(self, name):
+        return "%s.transfer" % os.path.splitext(self.local.path(name))[0]
+
+    def load_checkpoint(self, checkpoint_path):
+        """
+        Return the names already transferred for this token
+        """
+        try:
+            checkpoint = open(checkpoint_path)
+        except IOError:
+            return set()
+        try:
+            lines = checkpoint.read().splitlines()
+        finally:
+            checkpoint.close()
+        if not lines or lines[0] != self.token:
+            return set()
+        return set(lines[1:])
+
+    def get_name(self, path):
+        return os.path.relpath(path, self.local.location).replace(os.sep, '/')
+
+    def transfer_file(self, name):
+        """
+        Save one file to remote storage and return (name, bytes, error)
+        """
+        try:
+            content = self.local.open(name)
+            try:
+                self.get_remote().save(name, content)
+                return name, content.size, None
+            finally:
+                content.close()
+        except Exception as e:
+            return name, 0, e
+
+    def report(self, total):
+        elapsed = max(time.time() - self.started, 0.001)
+        rate = self.bytes_done / elapsed
+        logger.info("Transferred %s of %s files, %s bytes at %.0f bytes/sec." % (
+            self.files_done, total, self.bytes_done, rate))
+        if self.progress:
+            self.progress(self.files_done, total, self.bytes_done, rate)
+
+    def run(self, name):
+        """
+        Transfer the image ``name``, its thumbnail and the changed tiles of
+        its tileset, and delete the tiles that were removed. Returns ``True``
+        when every file was transferred.
+        """
+        image_path = self.local.path(name)
+        checkpoint_path = self.get_checkpoint_path(name)
+        done = self.load_checkpoint(checkpoint_path)
+        names = [self.get_name(path)
+                 for path in get_tileset_files(image_path, changed_only=True)
+                 if path != checkpoint_path]
+        pending = [n for n in names if n not in done]
+        self.started = time.time()
+
+        checkpoint = open(checkpoint_path, done and 'a' or 'w')
+        if not done:
+            checkpoint.write("%s\n" % self.token)
+        failed = []
+        pool = ThreadPool(self.threads)
+        try:
+            for file_name, size, error in pool.imap_unordered(self.transfer_file, pending):
+                if error is not None:
+                    logger.error("Unable to save '%s' to remote storage: %s" % (
+                        file_name, error))
+                    failed.append(file_name)
+                    continue
+                checkpoint.write("%s\n" % file_name)
+                checkpoint.flush()
+                self.files_done += 1
+                self.bytes_done += size
+                if self.files_done % 1000 == 0:
+                    self.report(len(pending))
+        finally:
+            pool.close()
+            pool.join()
+            checkpoint.close()
+        self.report(len(pending))
+        if failed:
+            return False
+
+        remote = self.get_remote()
+        for path in get_removed_tileset_files(image_path):
+            try:
+                remote.delete(self.get_name(path))
+            except Exception as e:
+                logger.exception(e)
+        os.remove(checkpoint_path)
+        return True
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Resumable uploads of large images in chunks.
+
+The client creates an upload with the file's name and size, then sends the
+file in order, one chunk per request, and can ask for the number of bytes
+received to resume after a dropped connection. Chunks are written straight
+to a partial file in ``CHUNKED_UPLOAD_DIR``, and added to a running SHA-256
+digest of the file. When the last chunk arrives the file is checked against
+its checksum and stored, which starts its tiling.
+"""
+import datetime
+import hashlib
+import os
+import threading
+import uuid
+
+from django.core.files import File
+from django.utils.timezone import now
+
+# Bytes read from the request at a time
+BLOCK_SIZE = 64 * 1024
+
+# The running digest of each upload this process received chunks of, by
+# upload ID, with the number of bytes it covers
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    """
+    A request the upload can't accept, with the HTTP status to answer with
+    """
+    def __init__(self, message, status=400):
+        super(UploadError, self).__init__(message)
+        self.status = status
+
+
+class ChunkedUploadFile(File):
+    """
+    The assembled file, which the file system storage moves into place
+    instead of copying, with the ``digest`` already computed for it
+    """
+    def __init__(self, path, name, digest):
+        super(ChunkedUploadFile, self).__init__(open(path, 'rb'), name)
+        self.path = path
+        self.digest = digest
+
+    def temporary_file_path(self):
+        return self.path
+
+
+def get_upload_dir():
+    from .settings import CHUNKED_UPLOAD_DIR
+    import tempfile
+    upload_dir = CHUNKED_UPLOAD_DIR or os.path.join(
+        tempfile.gettempdir(), 'loupe-uploads')
+    if not os.path.isdir(upload_dir):
+        os.makedirs(upload_dir)
+    return upload_dir
+
+
+def get_upload_model(label=''):
+    """
+    Return the image model named ``app_label.model_name``, which decides
+    where the upload is stored, defaulting to ``LoupeImage``
+    """
+    from .models import LoupeImage, get_loupe_models
+    for model in get_loupe_models():
+        if "%s.%s" % (model._meta.app_label, model._meta.object_name.lower()) == label.lower():
+            return model
+    return LoupeImage
+
+
+def get_running_digest(upload, offset):
+    """
+    Return a copy of the SHA-256 of the first ``offset`` bytes of the upload.
+    Only the chunks received by other processes since this one last saw the
+    upload are read back from the partial file.
+    """
+    with _digests_lock:
+        done, digest = _digests.get(upload.upload_id, (0, None))
+    if digest is None or done > offset:
+        done, digest = 0, hashlib.sha256()
+    else:
+        digest = digest.copy()
+    if done < offset:
+        with open(upload.path, 'rb') as partial:
+            partial.seek(done)
+            while done < offset:
+                block = partial.read(min(BLOCK_SIZE * 16, offset - done))
+                if not block:
+                    break
+                digest.update(block)
+                done += len(block)
+    return digest
+
+
+def forget_running_digest(upload_id):
+    with _digests_lock:
+        _digests.pop(upload_id, None)
+
+
+def create_upload(user, filename, size, checksum='', slug='', model='',
+                  tile_profile=''):
+    """
+    Start an upload of ``size`` bytes and create its empty partial file. It
+    is tiled with the tile profile chosen in the form.
+    """
+    from .models import ChunkedUpload
+    filename = os.path.basename(filename or '')
+    if not filename:
+        raise UploadError("A file name is required.")
+    if size <= 0:
+        raise UploadError("The file is empty.")
+    delete_expired_uploads()
+    upload = ChunkedUpload.objects.create(
+        upload_id=uuid.uuid4().hex,
+        user=user,
+        filename=filename[:255],
+        size=size,
+        checksum=checksum.lower(),
+        slug=slug,
+        model=model,
+        tile_profile=tile_profile[:50])
+    open(upload.path, 'wb').close()
+    return upload
+
+
+def write_chunk(upload, stream, start, length, checksum=''):
+    """
+    Write ``length`` bytes read from ``stream`` at ``start``, which must be
+    the number of bytes received so far. A chunk whose SHA-256 doesn't match
+    ``checksum`` is discarded. Returns the new number of bytes received.
+    """
+    from .models import ChunkedUpload
+    from .settings import CHUNKED_UPLOAD_CHUNK_SIZE
+    if upload.status != 'uploading':
+        raise UploadError("The upload is %s." % upload.status, 409)
+    if start != upload.offset:
+        raise UploadError("Expected the chunk at byte %s." % upload.offset, 409)
+    if length <= 0 or length > CHUNKED_UPLOAD_CHUNK_SIZE or start + length > upload.size:
+        raise UploadError("Invalid chunk length.")
+
+    running = get_running_digest(upload, start)
+    digest = hashlib.sha256()
+    received = 0
+    with open(upload.path, 'r+b') as partial:
+        partial.seek(start)
+        while received < length:
+            block = stream.read(min(BLOCK_SIZE, length - received))
+            if not block:
+                break
+            digest.update(block)
+            running.update(block)
+            partial.write(block)
+            received += len(block)
+    if received != length:
+        raise UploadError("The chunk was incomplete.")
+    if checksum and digest.hexdigest() != checksum.lower():
+        raise UploadError("The chunk's checksum doesn't match.")
+    # Only one request may advance the offset past this chunk
+    if not ChunkedUpload.objects.filter(pk=upload.pk, offset=start).update(
+            offset=start + length, updated=now()):
+        raise UploadError("The chunk was already received.", 409)
+    upload.offset = start + length
+    with _digests_lock:
+        _digests[upload.upload_id] = (upload.offset, running)
+    return upload.offset
+
+
+def complete_upload(upload):
+    """
+    Check the received file against its checksum and store it, tiling it.
+    Returns the stored name.
+    """
+    from .models import ChunkedUpload
+    if upload.offset != upload.size:
+        raise UploadError("The upload is incomplete.", 409)
+    digest = get_running_digest(upload, upload.size).hexdigest()
+    forget_running_digest(upload.upload_id)
+    if upload.checksum and digest != upload.checksum:
+        ChunkedUpload.objects.filter(pk=upload.pk).update(
+            status='failed', updated=now())
+        upload.delete_file()
+        raise UploadError("The file's checksum doesn't match.")
+    if not ChunkedUpload.objects.filter(pk=upload.pk, status='uploading').update(
+            status='storing', updated=now()):
+        raise UploadError("The upload was already completed.", 409)
+
+    model = get_upload_model(upload.model)
+    field = model._meta.get_field('image')
+    instance = model(slug=upload.slug)
+    content = ChunkedUploadFile(upload.path, upload.filename, digest)
+    content.tile_profile = upload.tile_profile
+    try:
+        stored_name = field.storage.save(
+            field.generate_filename(instance, upload.filename), content)
+    except Exception:
+        ChunkedUpload.objects.filter(pk=upload.pk).update(
+            status='uploading', updated=now())
+        raise
+    finally:
+        content.close()
+    upload.delete_file()
+    ChunkedUpload.objects.filter(pk=upload.pk).update(
+        status='complete', stored_name=stored_name, updated=now())
+    upload.status, upload.stored_name = 'complete', stored_name
+    return stored_name
+
+
+def delete_expired_uploads():
+    """
+    Delete the partial files of uploads untouched for
+    ``CHUNKED_UPLOAD_EXPIRY`` seconds, and release the reference of completed
+    uploads no image was saved with. An identical upload shares the stored
+    file of other images, so whether they use the name doesn't matter.
+    """
+    from .models import ChunkedUpload
+    from .settings import CHUNKED_UPLOAD_EXPIRY
+    cutoff = now() - datetime.timedelta(seconds=CHUNKED_UPLOAD_EXPIRY)
+    for upload in ChunkedUpload.objects.filter(updated__lt=cutoff):
+        upload.delete_file()
+        forget_running_digest(upload.upload_id)
+        if upload.status == 'complete' and upload.stored_name:
+            storage = get_upload_model(upload.model)._meta.get_field('image').storage
+            if hasattr(storage, 'release'):
+                storage.release(upload.stored_name)
+        upload.delete()
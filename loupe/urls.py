@@ -2,9 +2,40 @@
 # -*- coding: utf-8 -*-
 from django.conf.urls.defaults import patterns, url
 
-from .views import LoupeImageDetailView
+from .views import (LoupeImageDetailView, tileset_descriptor, tileset_tile,
+    derivative, document_detail, tileset_status, chunked_upload_create,
+    chunked_upload)
+
+TILE_RE = r'_files/(?P<level>\d+)/(?P<column>\d+)_(?P<row>\d+)\.(?P<format>\w+)$'
 
 urlpatterns = patterns('',
+    url(r'^uploads/$',
+        chunked_upload_create,
+        name='loupe-chunked-upload-create'),
+    url(r'^uploads/(?P<upload_id>[0-9a-f]{32})/$',
+        chunked_upload,
+        name='loupe-chunked-upload'),
+    url(r'^documents/(?P<document_name>[^/]+)/$',
+        document_detail,
+        name='loupedocument-detail'),
+    url(r'^(?P<slug>[-_\w]+)/v(?P<version>\d+)\.dzi$',
+        tileset_descriptor,
+        name='loupeimage-dzi-version'),
+    url(r'^(?P<slug>[-_\w]+)/v(?P<version>\d+)' + TILE_RE,
+        tileset_tile,
+        name='loupeimage-tile-version'),
+    url(r'^(?P<slug>[-_\w]+)\.dzi$',
+        tileset_descriptor,
+        name='loupeimage-dzi'),
+    url(r'^(?P<slug>[-_\w]+)' + TILE_RE,
+        tileset_tile,
+        name='loupeimage-tile'),
+    url(r'^(?P<slug>[-_\w]+)/(?P<width>\d+)x(?P<height>\d+)\.(?P<format>\w+)$',
+        derivative,
+        name='loupeimage-derivative'),
+    url(r'^(?P<slug>[-_\w]+)/status\.json$',
+        tileset_status,
+        name='loupeimage-status'),
     url(r'^(?P<slug>[-_\w]+)/$',
         LoupeImageDetailView.as_view(),
         name='loupeimage-detail'),
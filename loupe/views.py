@@ -1,7 +1,236 @@
 # -*- coding: utf-8 -*-
+import mimetypes
+import os
+import re
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import require_http_methods, require_POST
 from django.views.generic import DetailView
 from .models import LoupeImage
 
+mimetypes.add_type('image/webp', '.webp')
+mimetypes.add_type('image/avif', '.avif')
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
 
 class LoupeImageDetailView(DetailView):
     model = LoupeImage
+
+
+def document_detail(request, document_name):
+    """
+    Show all the pages of a document in one viewer
+    """
+    from django.shortcuts import render
+    from .documents import get_document_or_404
+    document = get_document_or_404(document_name)
+    return render(request, 'loupe/loupedocument_detail.html', {'object': document})
+
+
+def get_local_image(slug):
+    """
+    Return the image with the slug, and the name of its tileset in storage
+    """
+    image = get_object_or_404(LoupeImage, slug=slug)
+    if not image.image:
+        raise Http404
+    return image, os.path.splitext(image.image.name)[0]
+
+
+def is_current(image, version):
+    """
+    Versioned URLs of the current tileset never change, so may be cached
+    forever
+    """
+    return version is not None and int(version) == image.tileset_version
+
+
+def tileset_descriptor(request, slug, version=None):
+    """
+    Return the DZI descriptor of the image's tileset
+    """
+    from .serving import TILE_CACHE, get_data_etag, serve_data
+
+    image, dest_name = get_local_image(slug)
+    cache_key = (dest_name, 'dzi', image.tileset_version)
+    cached = TILE_CACHE.get(cache_key)
+    if cached is None:
+        try:
+            descriptor = image.image.storage.open("%s.dzi" % dest_name)
+        except (IOError, OSError):
+            raise Http404
+        try:
+            data = descriptor.read()
+        finally:
+            descriptor.close()
+        cached = (get_data_etag(data), data)
+        TILE_CACHE.set(cache_key, cached)
+    etag, data = cached
+    return serve_data(request, data, etag, 'application/xml', is_current(image, version))
+
+
+def tileset_tile(request, slug, level, column, row, format, version=None):
+    """
+    Return one tile of the image's tileset. The tiles of the lowest levels,
+    which every viewer loads first, are kept in memory. Loose tiles of the
+    other levels may be sent by the web server. Tiles of lazy levels are
+    rendered when first requested.
+    """
+    from .archive import get_tile_data
+    from .lazy import get_lazy_tile
+    from .serving import (TILE_CACHE, get_tile_digests, get_etag,
+        get_data_etag, serve_data, serve_file)
+    from .settings import TILE_LAYOUT, TILE_MEMORY_CACHE_MAX_LEVEL
+
+    image, dest_name = get_local_image(slug)
+    storage = image.image.storage
+    key = "%s/%s_%s.%s" % (level, column, row, format)
+    content_type = mimetypes.guess_type(key)[0] or 'application/octet-stream'
+    immutable = is_current(image, version)
+    cache_key = (dest_name, key, image.tileset_version)
+    low_level = int(level) <= TILE_MEMORY_CACHE_MAX_LEVEL
+
+    cached = TILE_CACHE.get(cache_key)
+    if cached is not None:
+        return serve_data(request, cached[1], cached[0], content_type, immutable)
+
+    digest = get_tile_digests(storage, dest_name).get(key)
+    if digest and not low_level and TILE_LAYOUT != 'packed':
+        response = serve_file(request, storage, "%s_files/%s" % (dest_name, key),
+                              get_etag(digest, image.tileset_version), content_type,
+                              immutable)
+        if response is None:
+            raise Http404
+        return response
+
+    data = get_tile_data(storage, dest_name, key)
+    if data is None:
+        data = get_lazy_tile(image, dest_name, int(level), int(column), int(row))
+    if data is None:
+        raise Http404
+    etag = digest and get_etag(digest, image.tileset_version) or get_data_etag(data)
+    if low_level:
+        TILE_CACHE.set(cache_key, (etag, data))
+    return serve_data(request, data, etag, content_type, immutable)
+
+
+def tileset_status(request, slug):
+    """
+    Return the tileset status of the image, and the progress of its tiling
+    and transfer, as JSON for polling. The tileset is ready before its
+    transfer to remote storage finishes, so the progress is reported while
+    there is any.
+    """
+    import json
+    from django.http import HttpResponse
+    from django.utils.cache import add_never_cache_headers
+    from .progress import get_progress
+
+    image = get_object_or_404(LoupeImage, slug=slug)
+    status = {
+        'status': image.tileset_status,
+        'version': image.tileset_version,
+        'stage': None,
+        'progress': image.tileset_status == 'ready' and 1.0 or 0.0,
+    }
+    if image.image:
+        progress = get_progress(image.image.name)
+        if progress:
+            status.update(stage=progress['stage'], progress=progress['progress'])
+    response = HttpResponse(json.dumps(status), content_type='application/json')
+    add_never_cache_headers(response)
+    return response
+
+
+def derivative(request, slug, width, height, format):
+    """
+    Redirect to a resized copy of the image, making it from the tileset the
+    first time it is requested. Only the signed URLs the site links to make
+    derivatives.
+    """
+    from django.http import HttpResponseRedirect
+
+    image, dest_name = get_local_image(slug)
+    try:
+        resized = image.image.derivative(width, height, format)
+    except ValueError:
+        raise Http404
+    if not resized.exists() and not resized.is_signed(request.GET.get('signature')):
+        raise Http404
+    if not resized.create():
+        raise Http404
+    return HttpResponseRedirect(image.image.storage.url(resized.name))
+
+
+def json_response(data, status=200):
+    import json
+    from django.http import HttpResponse
+    from django.utils.cache import add_never_cache_headers
+    response = HttpResponse(json.dumps(data), content_type='application/json',
+                            status=status)
+    add_never_cache_headers(response)
+    return response
+
+
+def get_upload_state(upload):
+    return {
+        'id': upload.upload_id,
+        'offset': upload.offset,
+        'size': upload.size,
+        'status': upload.status,
+        'name': upload.stored_name,
+    }
+
+
+@staff_member_required
+@require_POST
+def chunked_upload_create(request):
+    """
+    Start a chunked upload of the file ``filename`` of ``size`` bytes, with
+    an optional SHA-256 ``checksum``, to be tiled with ``tile_profile``
+    """
+    from .uploads import UploadError, create_upload
+    try:
+        size = int(request.POST.get('size', 0))
+    except ValueError:
+        size = 0
+    try:
+        upload = create_upload(request.user, request.POST.get('filename', ''),
+            size, request.POST.get('checksum', ''), request.POST.get('slug', ''),
+            request.POST.get('model', ''), request.POST.get('tile_profile', ''))
+    except UploadError as e:
+        return json_response({'error': "%s" % e}, e.status)
+    return json_response(get_upload_state(upload), 201)
+
+
+@staff_member_required
+@require_http_methods(['GET', 'PUT', 'POST'])
+def chunked_upload(request, upload_id):
+    """
+    Return the number of bytes received, to resume from, or write the chunk
+    in the request body at its ``Content-Range``. The upload is stored when
+    the last chunk is written.
+    """
+    from .models import ChunkedUpload
+    from .uploads import UploadError, complete_upload, write_chunk
+
+    upload = get_object_or_404(ChunkedUpload, upload_id=upload_id, user=request.user)
+    if request.method == 'GET':
+        return json_response(get_upload_state(upload))
+    match = CONTENT_RANGE_RE.match(request.META.get('HTTP_CONTENT_RANGE', ''))
+    if not match or int(match.group(3)) != upload.size:
+        return json_response(dict(get_upload_state(upload),
+                                  error="Invalid Content-Range."), 400)
+    start, end = int(match.group(1)), int(match.group(2))
+    try:
+        write_chunk(upload, request, start, end - start + 1,
+                    request.META.get('HTTP_X_CHUNK_CHECKSUM', ''))
+        if upload.offset == upload.size:
+            complete_upload(upload)
+    except UploadError as e:
+        upload = ChunkedUpload.objects.get(pk=upload.pk)
+        return json_response(dict(get_upload_state(upload), error="%s" % e), e.status)
+    return json_response(get_upload_state(upload))